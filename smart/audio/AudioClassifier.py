@@ -15,13 +15,31 @@
 
  
 import tempfile, os.path
+import collections
+import contextlib
+import hashlib
+import json
 import struct
+import time
+import subprocess
+import multiprocessing
+import shutil
+import concurrent.futures
+import itertools
 import logging
+import signal
+import numpy as np
+from smart.audio import features, gmm, utils
+from smart.audio.cache import FeatureCache
+from smart.audio.stats import Stats
 
 """
 smart.audio.AudioClassifier - audio classification class.
 """
 
+# Backends using the SPTK command line tools
+SPTK_BACKENDS=("sptk", "sptkpipe")
+
 class TrainException(Exception):
     '''Exception in training process'''
     def __init__(self, msg):
@@ -34,50 +52,395 @@ class TrainException(Exception):
     def __str__(self):
         return "TrainException= {0}".format(self.msg)
 
+# classifier used by each worker process
+_worker=None
+
+def _initWorker(cfgDict):
+    '''
+    Create the classifier of a worker process
+    :param cfgDict: configuration values
+    '''
+    global _worker
+    _worker=AudioClassifier(utils.configFromDict(cfgDict))
+
+def _fileFeatures(fileName):
+    '''
+    Calculate the features of an audio file in a worker process
+    :param fileName: input audio file
+    :returns: tuple with features array and the worker statistics
+    '''
+    ftr=_worker.fileFeatures(fileName)[0]
+    snap=_worker.stats.snapshot()
+    _worker.stats.reset()
+    return (ftr, snap)
+
 class AudioClassifier:
-    '''GMM model for audio classification'''
+    '''
+    GMM model for audio classification.
+    After the models are loaded, the classification methods (predict,
+    predFile, fileLogLik...) can be called concurrently from several threads:
+    the models are only read and each call keeps its temporary files in its
+    own scratch folder.
+    '''
 
     def __init__(self, cfg):
         self.cfg=cfg
         self.tempDirObj=tempfile.TemporaryDirectory()
         self.tempDir=self.tempDirObj.name
         self.sptkDir=self.cfg.sptk
+        self.gmms=None
+        self.cache=None
+        self.stats=Stats()
+        if self.cfg.cacheDir:
+            self.cache=FeatureCache(self.cfg.cacheDir, self.cfg.cacheSize, self.cfg, self.stats)
 
-    def do(self,cmd):
-        '''Execute a command'''
+    def do(self, cmd, stage="command"):
+        '''
+        Execute a command
+        :param cmd: command line
+        :param stage: stage name for the statistics
+        '''
         logging.debug("DO: "+ cmd)
-        rc=os.system(cmd)
+        self.stats.count("subprocesses")
+        with self.stats.timer(stage):
+            rc=os.system(cmd)
         if rc!=0:
             raise TrainException("rc={0}".format(rc))
 
+    @contextlib.contextmanager
+    def scratch(self):
+        '''
+        Private folder for the temporary files of one call, removed at the end
+        :returns: folder name
+        '''
+        path=tempfile.mkdtemp(dir=self.tempDir)
+        try:
+            yield path
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def decode(self, inFileName, timeRange=None):
+        '''
+        Decode audio file into 16 bit samples at the working sample rate.
+        Long audio is written to the temporary folder and memory mapped.
+        :param inFileName: input audio file
+        :param timeRange: optional [t1, t2] range (sec)
+        :returns: array of samples
+        '''
+        cmd=[self.cfg.sox, inFileName, "-t", "raw", "-e", "signed-integer", "-b", "16", "-c", "1", "-r", str(self.cfg.samplerate), "-"]
+        if timeRange:
+            cmd.extend(["trim", "={}".format(timeRange[0]), "={}".format(timeRange[1])])
+        logging.debug("DO: "+ " ".join(cmd))
+        maxBytes=2*int(self.cfg.mmapLen*self.cfg.samplerate)
+        chunks=[]
+        size=0
+        pcmFile=None
+        self.stats.count("subprocesses")
+        with self.stats.timer("decode"), subprocess.Popen(cmd, stdout=subprocess.PIPE) as proc:
+            for chunk in iter(lambda: proc.stdout.read(1<<20), b""):
+                size+=len(chunk)
+                if pcmFile is None and size>maxBytes:
+                    # too long to keep in memory: move to a file
+                    (fd, pcmName)=tempfile.mkstemp(dir=self.tempDir, suffix=".pcm")
+                    pcmFile=os.fdopen(fd, "wb")
+                    pcmFile.writelines(chunks)
+                    chunks=[]
+                if pcmFile is None:
+                    chunks.append(chunk)
+                else:
+                    pcmFile.write(chunk)
+        if pcmFile is not None:
+            pcmFile.close()
+            self.stats.count("tempBytes", size)
+        self.stats.count("decodedBytes", size)
+        try:
+            if proc.returncode!=0:
+                raise TrainException("rc={0}".format(proc.returncode))
+            if pcmFile is not None:
+                return np.memmap(pcmName, dtype=np.int16, mode="r", shape=(size//2,))
+        finally:
+            # the mapping stays valid after the file is removed
+            if pcmFile is not None:
+                os.remove(pcmName)
+        return np.frombuffer(b"".join(chunks), dtype=np.int16, count=size//2)
+
+    def file2ftr(self, inFileName, timeRange=None):
+        '''
+        Convert audio file to MFCC with delta and delta^2 in memory
+        :param inFileName: input audio file
+        :param timeRange: optional [t1, t2] range (sec)
+        :returns: float32 array (frames x ftrLen)
+        '''
+        if self.cache is None:
+            return self.ftrFromSamples(self.decode(inFileName, timeRange))
+        key=self.cache.key(inFileName, timeRange)
+        res=self.cache.get(key)
+        if res is not None:
+            return res[0]
+        x=self.decode(inFileName, timeRange)
+        ftr=self.ftrFromSamples(x)
+        self.cache.put(key, ftr, {"nSamples": len(x)})
+        return ftr
+
+    def fileFeatures(self, inFileName, withEnergy=False):
+        '''
+        Calculate the features of a whole file (using the cache when enabled)
+        :param inFileName: input audio file
+        :param withEnergy: also return the energy of each frame
+        :returns: tuple with features array and file duration (sec),
+                  followed by the frames energy (dB) when withEnergy is set
+        '''
+        res=None
+        if self.cache is not None:
+            key=self.cache.key(inFileName)
+            res=self.cache.get(key)
+            if res is not None and withEnergy:
+                # the energy is kept as a separate cache entry
+                energy=self.cache.get(key+"-energy")
+                res=None if energy is None else res+(energy[0],)
+        if res is None:
+            x=self.decode(inFileName)
+            energy=self.energyArray(len(x)) if withEnergy else None
+            ftr=self.ftrFromSamples(x, energy)
+            meta={"nSamples": len(x)}
+            if self.cache is not None:
+                self.cache.put(key, ftr, meta)
+                if withEnergy:
+                    self.cache.put(key+"-energy", energy, meta)
+            res=(ftr, meta, energy)
+        dur=res[1]["nSamples"]/self.cfg.samplerate
+        if withEnergy:
+            return (res[0], dur, res[2])
+        return (res[0], dur)
+
+    def ftrFromSamples(self, x, energy=None):
+        '''
+        Convert audio samples to MFCC with delta and delta^2
+        :param x: audio samples at the working sample rate
+        :param energy: optional array filled with the energy of each frame (dB)
+        :returns: float32 array (frames x ftrLen)
+        '''
+        return features.extract(x, self.cfg, stats=self.stats, energy=energy)
+
+    def energyArray(self, nSamples):
+        '''
+        Array for the energy of the frames of a signal
+        :param nSamples: number of samples
+        :returns: float32 array (frames)
+        '''
+        return np.zeros(features.nFrames(nSamples, self.cfg.winLen, self.cfg.frmLen), dtype=np.float32)
+
+    def activeFrames(self, energy):
+        '''
+        Find the frames which are not silent
+        :param energy: energy of each frame (dB) or None
+        :returns: boolean array, or None when silence detection is disabled
+        '''
+        if energy is None or self.cfg.silenceDb is None:
+            return None
+        return np.asarray(energy)>=self.cfg.silenceDb
+
     def file2mfcc(self, inFileName, mfccName, timeRange=None):
         '''Convert audio file to MFCC with delta and delta^2.
         Then append the output to the mfccName'''
-        #convert file to short format
         logging.debug("file2mfcc: {} >> {}".format(inFileName, mfccName))
+        if self.cfg.backend=="sptk":
+            self.file2mfccSptk(inFileName, mfccName, timeRange)
+            return
+        if self.cfg.backend=="sptkpipe":
+            self.file2mfccPipe(inFileName, mfccName, timeRange)
+            return
+        ftr=self.file2ftr(inFileName, timeRange)
+        with open(mfccName, "ab") as fout:
+            ftr.tofile(fout)
+        self.tempWritten(mfccName, ftr.nbytes)
+
+    def tempWritten(self, fileName, nBytes):
+        '''
+        Count the bytes written to a file in the temporary folder
+        :param fileName: output file
+        :param nBytes: number of bytes written
+        '''
+        tempDir=os.path.abspath(self.tempDir)
+        if os.path.commonpath([os.path.abspath(fileName), tempDir])==tempDir:
+            self.stats.count("tempBytes", nBytes)
+
+    def file2mfccSptk(self, inFileName, mfccName, timeRange=None):
+        '''Convert audio file to MFCC with delta and delta^2 using SPTK tools.
+        Then append the output to the mfccName'''
+        #convert file to short format
         if timeRange:
             trim="trim ={} ={}".format(timeRange[0], timeRange[1])
         else:
             trim=""
-        data=os.path.join(self.tempDir, "data")
-        cmd="{0.sox} {1} -t raw -e signed-integer -b 16 -c 1 -r {0.samplerate} {2}.s {3}".format(self.cfg, inFileName, data, trim)
-        self.do(cmd)
-        #convert from short to float
-        x2x=os.path.join(self.sptkDir, "x2x")
-        cmd="{0} +sf {1}.s > {1}.f".format(x2x, data)
-        self.do(cmd)
-        # cut into frames
-        frame=os.path.join(self.sptkDir, "frame")
-        cmd="{0} -l {1.winLen} -p {1.frmLen} {2}.f > {2}.frm".format(frame, self.cfg, data)
-        self.do(cmd)
-        # convert frames to MFCC
-        mfcc=os.path.join(self.sptkDir, "mfcc")
-        cmd="{0} -l {1.winLen} -m {1.nMfcc} {2}.frm > {2}.mfcc".format(mfcc, self.cfg, data)
-        self.do(cmd)
-        # Calculate dynamic features and append to output file
-        delta=os.path.join(self.sptkDir, "delta")
-        cmd="{0} -l {1.nMfcc}  -d -0.5 0 0.5 -d 1 -2 1 {2}.mfcc >> {3}".format(delta, self.cfg, data, mfccName)
-        self.do(cmd)
+        with self.scratch() as tmp:
+            data=os.path.join(tmp, "data")
+            cmd="{0.sox} {1} -t raw -e signed-integer -b 16 -c 1 -r {0.samplerate} {2}.s {3}".format(self.cfg, inFileName, data, trim)
+            self.do(cmd, "decode")
+            self.tempWritten(data+".s", os.path.getsize(data+".s"))
+            #convert from short to float
+            x2x=os.path.join(self.sptkDir, "x2x")
+            cmd="{0} +sf {1}.s > {1}.f".format(x2x, data)
+            self.do(cmd, "framing")
+            self.tempWritten(data+".f", os.path.getsize(data+".f"))
+            # cut into frames
+            frame=os.path.join(self.sptkDir, "frame")
+            cmd="{0} -l {1.winLen} -p {1.frmLen} {2}.f > {2}.frm".format(frame, self.cfg, data)
+            self.do(cmd, "framing")
+            self.tempWritten(data+".frm", os.path.getsize(data+".frm"))
+            # convert frames to MFCC
+            mfcc=os.path.join(self.sptkDir, "mfcc")
+            cmd="{0} -l {1.winLen} -m {1.nMfcc} -s {2} {3}.frm > {3}.mfcc".format(mfcc, self.cfg, self.cfg.mfccFs/1000.0, data)
+            self.do(cmd, "mfcc")
+            self.tempWritten(data+".mfcc", os.path.getsize(data+".mfcc"))
+            # Calculate dynamic features and append to output file
+            delta=os.path.join(self.sptkDir, "delta")
+            cmd="{0} -l {1.nMfcc}  -d -0.5 0 0.5 -d 1 -2 1 {2}.mfcc >> {3}".format(delta, self.cfg, data, mfccName)
+            size=os.path.getsize(mfccName) if os.path.exists(mfccName) else 0
+            self.do(cmd, "deltas")
+            self.tempWritten(mfccName, os.path.getsize(mfccName)-size)
+
+    def sptkFeatureCmds(self, inFileName, timeRange=None):
+        '''
+        Command lines of the SPTK features chain, with the same options as file2mfccSptk
+        :param inFileName: input audio file
+        :param timeRange: optional [t1, t2] range (sec)
+        :returns: list of argument lists (sox, x2x, frame, mfcc and delta)
+        '''
+        sox=[self.cfg.sox, inFileName, "-t", "raw", "-e", "signed-integer", "-b", "16", "-c", "1", "-r", str(self.cfg.samplerate), "-"]
+        if timeRange:
+            sox.extend(["trim", "={}".format(timeRange[0]), "={}".format(timeRange[1])])
+        return [sox,
+                [os.path.join(self.sptkDir, "x2x"), "+sf"],
+                [os.path.join(self.sptkDir, "frame"), "-l", str(self.cfg.winLen), "-p", str(self.cfg.frmLen)],
+                [os.path.join(self.sptkDir, "mfcc"), "-l", str(self.cfg.winLen), "-m", str(self.cfg.nMfcc), "-s", str(self.cfg.mfccFs/1000.0)],
+                [os.path.join(self.sptkDir, "delta"), "-l", str(self.cfg.nMfcc), "-d", "-0.5", "0", "0.5", "-d", "1", "-2", "1"]]
+
+    def pipeline(self, cmds, stdout):
+        '''
+        Start commands connected by pipes (without a shell)
+        :param cmds: list of argument lists
+        :param stdout: output of the last command (file object or subprocess.PIPE)
+        :returns: list of Popen objects
+        '''
+        procs=[]
+        for cmd in cmds:
+            last=len(procs)==len(cmds)-1
+            stdin=procs[-1].stdout if procs else subprocess.DEVNULL
+            procs.append(self.startProc(cmd, stdin, stdout if last else subprocess.PIPE))
+            if stdin is not subprocess.DEVNULL:
+                # the pipe is now owned by the next command
+                stdin.close()
+        return procs
+
+    def startProc(self, cmd, stdin, stdout):
+        '''
+        Start a command with its error output kept in a temporary file
+        :param cmd: argument list
+        :param stdin: input (file object or subprocess.PIPE)
+        :param stdout: output (file object or subprocess.PIPE)
+        :returns: Popen object with the errFile attribute
+        '''
+        logging.debug("PIPE: "+" ".join(cmd))
+        errFile=tempfile.TemporaryFile(dir=self.tempDir)
+        try:
+            p=subprocess.Popen(cmd, stdin=stdin, stdout=stdout, stderr=errFile)
+        except OSError:
+            errFile.close()
+            raise
+        p.errFile=errFile
+        self.stats.count("subprocesses")
+        return p
+
+    def waitAll(self, procs):
+        '''
+        Wait for commands connected by pipes to end. The first failed command
+        in the order of the list is reported with its error output; commands
+        killed by a closed pipe only follow the failure of a later command.
+        :param procs: list of Popen objects in the order of the data flow
+        '''
+        rc=[p.wait() for p in procs]
+        errors=[]
+        for (p, r) in zip(procs, rc):
+            p.errFile.seek(0)
+            errors.append(p.errFile.read().decode("utf-8", "replace").strip())
+            p.errFile.close()
+        failed=[i for (i, r) in enumerate(rc) if r!=0]
+        if failed:
+            real=[i for i in failed if rc[i]!=-signal.SIGPIPE and "Broken pipe" not in errors[i]]
+            i=(real or failed)[0]
+            raise TrainException("{} rc={}\n{}".format(os.path.basename(procs[i].args[0]), rc[i], errors[i]))
+
+    def file2mfccPipe(self, inFileName, mfccName, timeRange=None):
+        '''
+        Convert audio file to MFCC with delta and delta^2 using the SPTK tools
+        connected by pipes. Then append the output to the mfccName
+        :param inFileName: input audio file
+        :param mfccName: output features file
+        :param timeRange: optional [t1, t2] range (sec)
+        '''
+        size=os.path.getsize(mfccName) if os.path.exists(mfccName) else 0
+        with open(mfccName, "ab") as fout, self.stats.timer("features"):
+            self.waitAll(self.pipeline(self.sptkFeatureCmds(inFileName, timeRange), fout))
+        self.tempWritten(mfccName, os.path.getsize(mfccName)-size)
+
+    def scorePipe(self, chunks, upstream=()):
+        '''
+        Calculate the GMM score for each audio class with SPTK gmmp. The features
+        are sent to the scorers of all the models at once.
+        :param chunks: iterator over bytes of float features
+        :param upstream: Popen objects of the commands producing the features
+                         (their output is chunks), checked before the scorers
+        :returns: dictionary with score for each label
+        '''
+        names=self.labels+["ubm"]
+        gmmp=os.path.join(self.sptkDir, "gmmp")
+        scorers=[]
+        for name in names:
+            cmd=[gmmp, "-a", "-l", str(self.cfg.ftrLen), "-m", str(self.cfg.nGauss), os.path.join(self.modelDir, name+".gmm")]
+            scorers.append(self.startProc(cmd, subprocess.PIPE, subprocess.PIPE))
+        try:
+            for chunk in chunks:
+                for s in scorers:
+                    s.stdin.write(chunk)
+        except BrokenPipeError:
+            # the failed scorer is reported below
+            pass
+        finally:
+            for s in scorers:
+                try:
+                    s.stdin.close()
+                except BrokenPipeError:
+                    pass
+        res=[s.stdout.read(4) for s in scorers]
+        for p in list(upstream[-1:])+scorers:
+            # a failed scorer may leave the features unread
+            p.stdout.close()
+        self.waitAll(list(upstream)+scorers)
+        pred0=dict((name, struct.unpack('f', r)[0]) for (name, r) in zip(names, res))
+        # return the score relative to the UBM
+        pred={}
+        for label in self.labels:
+            pred[label]=pred0[label]-pred0["ubm"]
+        return pred
+
+    def predictPipe(self, audioFile, t1, t2):
+        '''
+        Calculate the GMM score for each audio class with one pipeline of SPTK tools
+        :param audioFile: input file
+        :param t1: start of time range (sec)
+        :param t2: end of time range (sec)
+        :returns: dictionary with score for each label
+        '''
+        with self.stats.timer("scoring"):
+            procs=self.pipeline(self.sptkFeatureCmds(audioFile, [t1, t2]), subprocess.PIPE)
+            try:
+                return self.scorePipe(iter(lambda: procs[-1].stdout.read(1<<16), b""), procs)
+            finally:
+                # no zombies when the scorers could not be started
+                procs[-1].stdout.close()
+                for p in procs:
+                    p.wait()
 
     def createUbm(self, ubmFile, filesData):
         '''
@@ -93,9 +456,7 @@ class AudioClassifier:
             self.file2mfcc(f[0], mfccFile)
         # Create GMM model from all data
         logging.info("createUbm: building GMM model")
-        gmm=os.path.join(self.sptkDir, "gmm")
-        cmd="{0} -l {1.ftrLen} -m {1.nGauss} {2} > {3}".format(gmm, self.cfg, mfccFile, ubmFile)
-        self.do(cmd)
+        self.fitGmm(mfccFile, ubmFile)
 
     def createGmm(self, gmmFile, label, filesData):
         '''
@@ -115,9 +476,161 @@ class AudioClassifier:
                     self.file2mfcc(fileName, mfccFile, lblInfo[1:])
         # Create GMM model from all data
         logging.info("createGmm: building GMM model for "+label)
+        self.fitGmm(mfccFile, gmmFile)
+
+    def fitGmm(self, mfccFile, gmmFile):
+        '''
+        Train a GMM model with SPTK gmm
+        :param mfccFile: input features file
+        :param gmmFile: output file containing GMM model
+        '''
         gmm=os.path.join(self.sptkDir, "gmm")
         cmd="{0} -l {1.ftrLen} -m {1.nGauss} {2} > {3}".format(gmm, self.cfg, mfccFile, gmmFile)
-        self.do(cmd)
+        self.do(cmd, "train")
+
+    def nJobs(self):
+        '''Number of parallel jobs'''
+        return self.cfg.nJobs or os.cpu_count()
+
+    def iterFeatures(self, fileNames):
+        '''
+        Iterator over the features of a list of files calculated in parallel.
+        Only a few files are calculated ahead of the consumer.
+        :param fileNames: list of audio files
+        :returns: features arrays in the order of the list
+        '''
+        if self.nJobs()==1:
+            # no worker processes for a single job
+            for f in fileNames:
+                yield self.fileFeatures(f)[0]
+            return
+        initArgs=(utils.configDict(self.cfg),)
+        window=2*self.nJobs()
+        fileNames=iter(fileNames)
+        with multiprocessing.Pool(self.nJobs(), _initWorker, initArgs) as pool:
+            pending=collections.deque(pool.apply_async(_fileFeatures, (f,)) for f in itertools.islice(fileNames, window))
+            while pending:
+                (ftr, snap)=pending.popleft().get()
+                self.stats.merge(snap)
+                for f in itertools.islice(fileNames, 1):
+                    pending.append(pool.apply_async(_fileFeatures, (f,)))
+                yield ftr
+
+    def trainUbmStream(self, ubmFile, fileNames):
+        '''
+        Train the UBM with mini-batch EM while the features are calculated.
+        Memory does not depend on the amount of training data. The training
+        state is saved periodically and a stopped training is resumed from
+        the last checkpoint.
+        :param ubmFile: output file containing UBM model
+        :param fileNames: list of audio files
+        '''
+        cfg=self.cfg
+        ckptFile=cfg.ubmCheckpoint or os.path.join(self.modelDir, "ubm.ckpt.npz")
+        em=gmm.StreamingEm(cfg.nGauss, cfg.ftrLen, cfg.ubmBatch)
+        sampler=gmm.ReservoirSampler(cfg.ubmReservoir, cfg.ftrLen) if cfg.ubmReservoir else None
+        # pass over the data and number of files done in this pass
+        progress={"epoch": 0, "files": 0}
+        key=hashlib.sha1(json.dumps([fileNames, gmm.configFingerprint(cfg), cfg.ubmBatch, cfg.ubmReservoir]).encode()).hexdigest()
+        if os.path.exists(ckptFile):
+            progress=self.loadCheckpoint(ckptFile, key, em, sampler) or progress
+        lastSave=time.time()
+        # with the reservoir the files are read once and the EM passes use the sample
+        nPasses=1 if sampler else cfg.ubmEpochs
+        while progress["epoch"]<nPasses:
+            logging.info("trainUbmStream: pass {} from file {}".format(progress["epoch"], progress["files"]))
+            with self.stats.timer("ubm"):
+                for ftr in self.iterFeatures(fileNames[progress["files"]:]):
+                    (sampler or em).add(ftr)
+                    progress["files"]+=1
+                    if time.time()-lastSave>=cfg.ubmCheckpointPeriod:
+                        self.saveCheckpoint(ckptFile, key, em, sampler, progress)
+                        lastSave=time.time()
+                if sampler is None:
+                    em.flush()
+            progress={"epoch": progress["epoch"]+1, "files": 0}
+            self.saveCheckpoint(ckptFile, key, em, sampler, progress)
+        if sampler:
+            x=sampler.frames()
+            while progress["epoch"]<1+cfg.ubmEpochs:
+                logging.info("trainUbmStream: pass {} over {} sampled frames".format(progress["epoch"], len(x)))
+                with self.stats.timer("ubm"):
+                    em.add(x[em.rng.permutation(len(x))])
+                    em.flush()
+                progress["epoch"]+=1
+                self.saveCheckpoint(ckptFile, key, em, sampler, progress)
+        (w, mu, var)=em.model()
+        gmm.saveGmm(ubmFile, w, mu, var)
+        os.remove(ckptFile)
+
+    def saveCheckpoint(self, ckptFile, key, em, sampler, progress):
+        '''
+        Save the state of the streaming UBM training
+        :param ckptFile: checkpoint file
+        :param key: identifier of the training data and configuration
+        :param em: StreamingEm
+        :param sampler: ReservoirSampler or None
+        :param progress: dict with the pass number and the files done in this pass
+        '''
+        state=dict(("em_"+k, v) for (k, v) in em.getState().items())
+        if sampler:
+            state.update(("res_"+k, v) for (k, v) in sampler.getState().items())
+        state["key"]=np.array(key)
+        state["progress"]=np.array(json.dumps(progress))
+        (fd, tmpName)=tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(ckptFile)), suffix=".tmp")
+        with os.fdopen(fd, "wb") as fout:
+            np.savez(fout, **state)
+        os.replace(tmpName, ckptFile)
+        logging.debug("saveCheckpoint: {} {}".format(ckptFile, progress))
+
+    def loadCheckpoint(self, ckptFile, key, em, sampler):
+        '''
+        Restore the state of the streaming UBM training
+        :returns: progress dict or None when the checkpoint belongs to another training
+        '''
+        with np.load(ckptFile) as data:
+            if str(data["key"])!=key:
+                logging.warning("Ignoring checkpoint {} of a different training".format(ckptFile))
+                return None
+            em.setState(dict((k[3:], data[k]) for k in data.files if k.startswith("em_")))
+            if sampler:
+                sampler.setState(dict((k[4:], data[k]) for k in data.files if k.startswith("res_")))
+            progress=json.loads(str(data["progress"]))
+        logging.info("loadCheckpoint: resuming from {} {}".format(ckptFile, progress))
+        return progress
+
+    def createAllGmmsParallel(self, filesData):
+        '''
+        Create the GMM models for the UBM and all labels. The features of each
+        file are calculated once and the models are trained concurrently.
+        :param filesData: list of audio files and labels
+        '''
+        stream=self.cfg.ubmTrainer=="stream"
+        if stream:
+            self.trainUbmStream(os.path.join(self.modelDir, "ubm.gmm"), [f[0] for f in filesData])
+        logging.info("createAllGmms: extracting features of {} files".format(len(filesData)))
+        ftrs=self.iterFeatures([f[0] for f in filesData])
+        # write the training data of each model
+        mfccFiles={}
+        for name in (self.labels if stream else ["ubm"]+self.labels):
+            mfccFiles[name]=open(os.path.join(self.tempDir, name+".dmfcc"), "wb")
+        for (f, ftr) in zip(filesData, ftrs):
+            if not stream:
+                ftr.tofile(mfccFiles["ubm"])
+                self.stats.count("tempBytes", ftr.nbytes)
+            for lblInfo in f[1:]:
+                (f1,f2)=self.segFrames(lblInfo[1], lblInfo[2], len(ftr))
+                ftr[f1:f2].tofile(mfccFiles[lblInfo[0]])
+                self.stats.count("tempBytes", ftr[f1:f2].nbytes)
+        for fout in mfccFiles.values():
+            fout.close()
+        del ftrs
+        # train all the models concurrently
+        logging.info("createAllGmms: building GMM models")
+        jobs=[(fout.name, os.path.join(self.modelDir, name+".gmm")) for (name, fout) in mfccFiles.items()]
+        with concurrent.futures.ThreadPoolExecutor(self.nJobs()) as executor:
+            for res in [executor.submit(self.fitGmm, *job) for job in jobs]:
+                res.result()
 
     def createAllGmms(self, modelDir, filesData):
         '''
@@ -134,73 +647,571 @@ class AudioClassifier:
         self.labels=list(labels)
         if not os.path.exists(self.modelDir):
             os.mkdir(self.modelDir)
-        # build UBM
-        gmmFile=os.path.join(self.modelDir, "ubm.gmm")
-        self.createUbm(gmmFile, filesData)
-        # build GMM for each label
-        for lbl in self.labels:
-            gmmFile=os.path.join(self.modelDir, lbl+".gmm")
-            self.createGmm(gmmFile, lbl, filesData)
+        if self.cfg.trainMode=="map":
+            self.createAllGmmsMap(filesData)
+        elif self.cfg.backend in SPTK_BACKENDS:
+            # build UBM
+            gmmFile=os.path.join(self.modelDir, "ubm.gmm")
+            if self.cfg.ubmTrainer=="stream":
+                self.trainUbmStream(gmmFile, [f[0] for f in filesData])
+            else:
+                self.createUbm(gmmFile, filesData)
+            # build GMM for each label
+            for lbl in self.labels:
+                gmmFile=os.path.join(self.modelDir, lbl+".gmm")
+                self.createGmm(gmmFile, lbl, filesData)
+        else:
+            self.createAllGmmsParallel(filesData)
         # save list of labels
         with open(os.path.join(self.modelDir, "labels.txt"), "wt") as flbl:
             for lbl in self.labels:
                 flbl.write(lbl+"\n")
+        self.saveBundle(self.cfg.trainMode=="map")
+        if self.cfg.trainMode!="map" and self.keepStats():
+            self.collectStats(filesData)
+
+    def keepStats(self):
+        '''
+        Check if the statistics of the training data are kept with the models
+        :returns: Configuration.keepStats, or when it is None, whether the
+                  statistics require no additional pass over the audio files
+        '''
+        if self.cfg.keepStats is not None:
+            return self.cfg.keepStats
+        return self.cfg.trainMode=="map" or self.cache is not None
+
+    def createAllGmmsMap(self, filesData):
+        '''
+        Create the UBM with SPTK gmm and adapt the models of all labels from it.
+        The statistics of all labels are accumulated in a single pass over the features.
+        :param filesData: list of audio files and labels
+        '''
+        ubmFile=os.path.join(self.modelDir, "ubm.gmm")
+        fileNames=[f[0] for f in filesData]
+        mfccFile=None
+        if self.cfg.ubmTrainer=="stream":
+            self.trainUbmStream(ubmFile, fileNames)
+            ftrs=self.iterFeatures(fileNames)
+        else:
+            # the features are written to disk as they are calculated and
+            # read back from the UBM training data for the adaptation
+            logging.info("createAllGmmsMap: extracting features of {} files".format(len(filesData)))
+            mfccFile=os.path.join(self.tempDir, "ubm.dmfcc")
+            nFrames=[]
+            with open(mfccFile, "wb") as fout:
+                for ftr in self.iterFeatures(fileNames):
+                    ftr.tofile(fout)
+                    nFrames.append(len(ftr))
+                    self.stats.count("tempBytes", ftr.nbytes)
+            logging.info("createAllGmmsMap: building UBM")
+            self.fitGmm(mfccFile, ubmFile)
+            allFtr=np.memmap(mfccFile, dtype=np.float32, mode="r", shape=(sum(nFrames), self.cfg.ftrLen)) if sum(nFrames)>0 else np.zeros((0, self.cfg.ftrLen), dtype=np.float32)
+            ends=np.cumsum(nFrames)
+            ftrs=(allFtr[e-n:e] for (e, n) in zip(ends, nFrames))
+        ubm=gmm.loadGmm(ubmFile, self.cfg.nGauss, self.cfg.ftrLen)
+        ubmSet=gmm.GmmSet(["ubm"], [ubm])
+        logging.info("createAllGmmsMap: adapting {} models".format(len(self.labels)))
+        names=self.labels+["ubm"]
+        suff=dict((n, gmm.SuffStats(self.cfg.nGauss, self.cfg.ftrLen)) for n in names)
+        refs=dict((n, "ubm") for n in names)
+        with self.stats.timer("adaptation"):
+            for (f, ftr) in zip(filesData, ftrs):
+                self.accumulate(ubmSet, ftr, self.fileRanges(f, len(ftr)), suff, refs)
+            for lbl in self.labels:
+                (w, mu, var)=gmm.mapAdapt(ubm, suff[lbl], self.cfg.mapRelevance, self.cfg.mapAdapt)
+                gmm.saveGmm(os.path.join(self.modelDir, lbl+".gmm"), w, mu, var)
+        if mfccFile is not None:
+            del ftrs, allFtr
+            os.remove(mfccFile)
+        if self.keepStats():
+            self.saveStats(suff, filesData)
+
+    def fileRanges(self, fileData, nFrames):
+        '''
+        Frame ranges of the models trained with a file: the whole file for the UBM
+        and the labeled ranges for the labels models
+        :param fileData: list containing audio file and labels
+        :param nFrames: number of frames in the file
+        :returns: list of (model name, first frame, frame after the last)
+        '''
+        ranges=[("ubm", 0, nFrames)]
+        ranges.extend((lblInfo[0],)+self.segFrames(lblInfo[1], lblInfo[2], nFrames) for lblInfo in fileData[1:])
+        return ranges
+
+    def accumulate(self, gmms, ftr, ranges, suff, refs, blockLen=4096):
+        '''
+        Accumulate the statistics of ranges of frames of a file
+        :param gmms: GmmSet containing the reference models
+        :param ftr: features array of the file (frames x ftrLen)
+        :param ranges: list of (model name, first frame, frame after the last)
+        :param suff: dict with SuffStats of each model
+        :param refs: dict with the model whose posteriors are used for each model
+                     (the UBM for adapted models, otherwise the model itself)
+        :param blockLen: number of frames processed at once
+        '''
+        for i in range(0, len(ftr), blockLen):
+            x=np.asarray(ftr[i:i+blockLen], dtype=np.float64)
+            ubmPost=None
+            for (name, f1, f2) in ranges:
+                (a, b)=(max(f1, i), min(f2, i+len(x)))
+                if a>=b:
+                    continue
+                if refs[name]=="ubm":
+                    # the UBM posteriors of the block are shared by all the models
+                    if ubmPost is None:
+                        ubmPost=gmms.posteriors(x, "ubm")
+                    post=ubmPost[a-i:b-i]
+                else:
+                    post=gmms.posteriors(x[a-i:b-i], refs[name])
+                suff[name].add(x[a-i:b-i], post)
+
+    def entryLabels(self, fileData):
+        '''
+        Labels of a training file as kept with the statistics
+        :param fileData: list containing audio file and labels
+        :returns: list of [label, t1, t2]
+        '''
+        return [list(lblInfo) for lblInfo in fileData[1:]]
+
+    def saveStats(self, suff, filesData, files=None):
+        '''
+        Save the statistics of the training data next to the models
+        :param suff: dict with SuffStats of each model
+        :param filesData: list of audio files and labels used for the statistics
+        :param files: dict with the labels of each file used before
+        '''
+        files=dict(files or {})
+        files.update((f[0], self.entryLabels(f)) for f in filesData)
+        header={"trainMode": self.cfg.trainMode, "fingerprint": gmm.configFingerprint(self.cfg), "files": files}
+        statsFile=os.path.join(self.modelDir, gmm.STATS_NAME)
+        logging.info("saveStats: writing "+statsFile)
+        gmm.saveStats(statsFile, header, suff)
+
+    def collectStats(self, filesData):
+        '''
+        Calculate and save the statistics of the training data for the trained models
+        :param filesData: list of audio files and labels
+        '''
+        names=self.labels+["ubm"]
+        gmms=gmm.GmmSet.load(self.modelDir, names, self.cfg.nGauss, self.cfg.ftrLen)
+        suff=dict((n, gmm.SuffStats(self.cfg.nGauss, self.cfg.ftrLen)) for n in names)
+        refs=dict((n, n) for n in names)
+        logging.info("collectStats: accumulating statistics of {} files".format(len(filesData)))
+        with self.stats.timer("statistics"):
+            for (f, ftr) in zip(filesData, self.iterFeatures([f[0] for f in filesData])):
+                self.accumulate(gmms, ftr, self.fileRanges(f, len(ftr)), suff, refs)
+        self.saveStats(suff, filesData)
+
+    def updateModels(self, modelDir, filesData):
+        '''
+        Update the models with new training files using the statistics kept
+        by the previous training. Only files which were not used before, or
+        whose labels changed, are processed. The statistics of the old labels
+        of a relabelled file are recalculated with the current models and
+        removed. Labels which are new get new models.
+        :param modelDir: models directory
+        :param filesData: list of audio files and labels
+        '''
+        self.modelDir=modelDir
+        statsFile=os.path.join(self.modelDir, gmm.STATS_NAME)
+        if not os.path.exists(statsFile):
+            raise TrainException("{}: missing statistics of the training data, the models must be trained with keepStats".format(statsFile))
+        (header, suff)=gmm.loadStats(statsFile)
+        if header["fingerprint"]!=gmm.configFingerprint(self.cfg):
+            raise TrainException("{}: configuration does not match the models".format(statsFile))
+        if header["trainMode"]!=self.cfg.trainMode:
+            raise TrainException("{}: the models were trained with trainMode={} (configured {})".format(statsFile, header["trainMode"], self.cfg.trainMode))
+        if "files" not in header:
+            raise TrainException("{}: statistics of an older version, the models must be trained again".format(statsFile))
+        mapMode=self.cfg.trainMode=="map"
+        known=header["files"]
+        new=[f for f in filesData if known.get(f[0])!=self.entryLabels(f)]
+        if not new:
+            logging.info("updateModels: no new files")
+            return
+        with open(os.path.join(self.modelDir, "labels.txt"), "rt") as flbl:
+            self.labels=flbl.read().split()
+        newLabels=sorted(set(lblInfo[0] for f in new for lblInfo in f[1:])-set(self.labels))
+        logging.info("updateModels: {} new files, new labels: {}".format(len(new), newLabels))
+        ftrs=list(self.iterFeatures([f[0] for f in new]))
+        ubmFile=os.path.join(self.modelDir, "ubm.gmm")
+        if newLabels and not mapMode:
+            # models of new labels are trained from their frames
+            mfccFiles=dict((lbl, open(os.path.join(self.tempDir, lbl+".dmfcc"), "wb")) for lbl in newLabels)
+            for (f, ftr) in zip(new, ftrs):
+                for (name, f1, f2) in self.fileRanges(f, len(ftr)):
+                    if name in mfccFiles:
+                        ftr[f1:f2].tofile(mfccFiles[name])
+            for fout in mfccFiles.values():
+                fout.close()
+            jobs=[(fout.name, os.path.join(self.modelDir, name+".gmm")) for (name, fout) in mfccFiles.items()]
+            with concurrent.futures.ThreadPoolExecutor(self.nJobs()) as executor:
+                for res in [executor.submit(self.fitGmm, *job) for job in jobs]:
+                    res.result()
+        self.labels.extend(newLabels)
+        names=self.labels+["ubm"]
+        # adapted models of new labels start from the UBM
+        models=[gmm.loadGmm(os.path.join(self.modelDir, n+".gmm") if os.path.exists(os.path.join(self.modelDir, n+".gmm")) else ubmFile,
+                            self.cfg.nGauss, self.cfg.ftrLen) for n in names]
+        gmms=gmm.GmmSet(names, models)
+        refs=dict((n, "ubm" if mapMode else n) for n in names)
+        with self.stats.timer("statistics"):
+            for (f, ftr) in zip(new, ftrs):
+                ranges=self.fileRanges(f, len(ftr))
+                if f[0] in known:
+                    # relabelled file: the UBM statistics are kept and the old labels are removed
+                    ranges=ranges[1:]
+                    oldSuff=dict((n, gmm.SuffStats(self.cfg.nGauss, self.cfg.ftrLen)) for n in names)
+                    oldRanges=self.fileRanges([f[0]]+known[f[0]], len(ftr))[1:]
+                    self.accumulate(gmms, ftr, oldRanges, oldSuff, refs)
+                    for name in set(r[0] for r in oldRanges):
+                        suff[name].remove(oldSuff[name])
+                newSuff=dict((n, gmm.SuffStats(self.cfg.nGauss, self.cfg.ftrLen)) for n in names)
+                self.accumulate(gmms, ftr, ranges, newSuff, refs)
+                for n in names:
+                    if n in suff:
+                        suff[n].merge(newSuff[n])
+                    else:
+                        suff[n]=newSuff[n]
+        # re-estimate the models from all the statistics
+        m=dict(zip(names, models))
+        ubm=gmm.mlEstimate(suff["ubm"], m["ubm"], 1e-3*m["ubm"][2])
+        gmm.saveGmm(ubmFile, *ubm)
+        for lbl in self.labels:
+            if mapMode:
+                model=gmm.mapAdapt(ubm, suff[lbl], self.cfg.mapRelevance, self.cfg.mapAdapt)
+            else:
+                model=gmm.mlEstimate(suff[lbl], m[lbl], 1e-3*m[lbl][2])
+            gmm.saveGmm(os.path.join(self.modelDir, lbl+".gmm"), *model)
+        with open(os.path.join(self.modelDir, "labels.txt"), "wt") as flbl:
+            for lbl in self.labels:
+                flbl.write(lbl+"\n")
+        self.saveBundle(mapMode)
+        self.saveStats(suff, new, known)
+
+    def checkModelFiles(self):
+        '''
+        Check the .gmm files of the models directory against the configuration
+        before they are bundled. The number of Gaussians and the feature length
+        are checked by the size and the weights of each model. The training
+        configuration of an existing bundle or statistics file must match the
+        configuration. The front-end settings (sample rate, framing and MFCC)
+        cannot be checked from the .gmm files and must match the training.
+        '''
+        for name in self.labels+["ubm"]:
+            gmmFile=os.path.join(self.modelDir, name+".gmm")
+            try:
+                (w, mu, var)=gmm.loadGmm(gmmFile, self.cfg.nGauss, self.cfg.ftrLen)
+            except ValueError as e:
+                raise TrainException("{} (nGauss={} ftrLen={})".format(e, self.cfg.nGauss, self.cfg.ftrLen))
+            # a different layout with the same size does not give valid weights and variances
+            if abs(float(w.sum())-1)>1e-3 or (w<0).any() or (var<=0).any():
+                raise TrainException("{}: not a model with nGauss={} ftrLen={}".format(gmmFile, self.cfg.nGauss, self.cfg.ftrLen))
+        fingerprint=gmm.configFingerprint(self.cfg)
+        bundleFile=os.path.join(self.modelDir, gmm.BUNDLE_NAME)
+        if os.path.exists(bundleFile):
+            try:
+                header=gmm.loadBundle(bundleFile)[0]
+            except ValueError as e:
+                logging.warning("checkModelFiles: {}".format(e))
+            else:
+                if header["fingerprint"]!=fingerprint:
+                    diff=["{}={} (trained with {})".format(k, getattr(self.cfg, k), header["config"].get(k))
+                          for k in gmm.MODEL_KEYS if getattr(self.cfg, k)!=header["config"].get(k)]
+                    raise TrainException("{}: configuration does not match the models: {}".format(bundleFile, ", ".join(diff)))
+        statsFile=os.path.join(self.modelDir, gmm.STATS_NAME)
+        if os.path.exists(statsFile) and gmm.loadStats(statsFile)[0]["fingerprint"]!=fingerprint:
+            raise TrainException("{}: configuration does not match the models".format(statsFile))
+
+    def modelsAligned(self):
+        '''
+        Check if the label models of the models directory are adapted from
+        the UBM, by the existing bundle file or the kept training statistics
+        :returns: True for aligned models (default: Configuration.trainMode is map)
+        '''
+        bundleFile=os.path.join(self.modelDir, gmm.BUNDLE_NAME)
+        if os.path.exists(bundleFile):
+            try:
+                return gmm.loadBundle(bundleFile)[0].get("aligned", False)
+            except ValueError as e:
+                logging.warning("modelsAligned: {}".format(e))
+        statsFile=os.path.join(self.modelDir, gmm.STATS_NAME)
+        if os.path.exists(statsFile):
+            return gmm.loadStats(statsFile)[0]["trainMode"]=="map"
+        return self.cfg.trainMode=="map"
+
+    def saveBundle(self, aligned=False):
+        '''
+        Write all the models of the models directory to a single bundle file
+        :param aligned: the label models are adapted from the UBM
+        '''
+        gmms=gmm.GmmSet.load(self.modelDir, self.labels+["ubm"], self.cfg.nGauss, self.cfg.ftrLen)
+        gmms.aligned=aligned
+        bundleFile=os.path.join(self.modelDir, gmm.BUNDLE_NAME)
+        logging.info("saveBundle: writing "+bundleFile)
+        gmms.save(bundleFile, self.labels, self.cfg)
     
-    def predict(self, audioFile, t1, t2):
+    def scoreMfcc(self, mfccFile):
         '''
         Calculate the GMM score for each audio class
-        :param audioFile: input file
-        :param t1: start of time range (sec)        
-        :param t2: end of time ragnge (sec)
+        :param mfccFile: input features file
         :returns: dictionary with score for each label
         '''
-        # extract features for this time range
-        mfccFile=os.path.join(self.tempDir, "data.dmfcc")
-        logging.info("createGmm: creating "+ mfccFile)
-        if os.path.exists(mfccFile):
-            os.remove(mfccFile)
-        self.file2mfcc(audioFile, mfccFile, [t1, t2])
         labels=list(self.labels)
         labels.append("ubm")
         # calc log probability for each class including UBM
         pred0={}
-        for label in labels:
-            gmmFile=os.path.join(self.modelDir, label+".gmm")
-            gmmp=os.path.join(self.sptkDir, "gmmp")
-            predFile=os.path.join(self.tempDir, "pred.f")
-            cmd="{0} -a -l {1.ftrLen} -m {1.nGauss} {2} {3} > {4}".format(gmmp, self.cfg, gmmFile, mfccFile, predFile)
-            self.do(cmd)
-            with open(predFile, 'rb') as fp:
-                res=struct.unpack('f', fp.read(4))
-            pred0[label]=res[0]
+        with self.scratch() as tmp:
+            for label in labels:
+                gmmFile=os.path.join(self.modelDir, label+".gmm")
+                gmmp=os.path.join(self.sptkDir, "gmmp")
+                predFile=os.path.join(tmp, "pred.f")
+                cmd="{0} -a -l {1.ftrLen} -m {1.nGauss} {2} {3} > {4}".format(gmmp, self.cfg, gmmFile, mfccFile, predFile)
+                self.do(cmd, "scoring:"+label)
+                self.stats.count("tempBytes", 4)
+                with open(predFile, 'rb') as fp:
+                    res=struct.unpack('f', fp.read(4))
+                pred0[label]=res[0]
         # return the score relative to the UBM
         pred={}
         for label in self.labels:
             pred[label]=pred0[label]-pred0["ubm"]
         return pred
-    
-    def predFile(self, audioFile):
+
+    def predictFtr(self, ftr):
+        '''
+        Calculate the GMM score for each audio class
+        :param ftr: features array (frames x ftrLen)
+        :returns: dictionary with score for each label
+        '''
+        if self.gmms is None and self.cfg.backend=="sptkpipe":
+            with self.stats.timer("scoring"):
+                return self.scorePipe([np.ascontiguousarray(ftr, dtype=np.float32).tobytes()])
+        if self.gmms is None:
+            with self.scratch() as tmp:
+                mfccFile=os.path.join(tmp, "data.dmfcc")
+                ftr.tofile(mfccFile)
+                self.stats.count("tempBytes", ftr.nbytes)
+                return self.scoreMfcc(mfccFile)
+        # all labels and the UBM are scored in one pass
+        with self.stats.timer("scoring"):
+            ll=self.gmms.avgLogLik(ftr)
+        ubm=ll[self.gmms.index["ubm"]]
+        pred={}
+        for label in self.labels:
+            pred[label]=float(ll[self.gmms.index[label]]-ubm)
+        return pred
+
+    def predict(self, audioFile, t1, t2):
+        '''
+        Calculate the GMM score for each audio class
+        :param audioFile: input file
+        :param t1: start of time range (sec)        
+        :param t2: end of time ragnge (sec)
+        :returns: dictionary with score for each label
+        '''
+        if self.gmms is not None:
+            return self.predictFtr(self.file2ftr(audioFile, [t1, t2]))
+        if self.cfg.backend=="sptkpipe":
+            return self.predictPipe(audioFile, t1, t2)
+        # extract features for this time range
+        with self.scratch() as tmp:
+            mfccFile=os.path.join(tmp, "data.dmfcc")
+            logging.info("predict: creating "+ mfccFile)
+            self.file2mfcc(audioFile, mfccFile, [t1, t2])
+            return self.scoreMfcc(mfccFile)
+
+    def segFrames(self, t1, t2, nFrames):
+        '''
+        Range of frames belonging to a time range. A frame belongs to the
+        segment containing its center, as when framing the trimmed audio.
+        :param t1: start of time range (sec)
+        :param t2: end of time range (sec)
+        :param nFrames: number of frames in the file
+        :returns: tuple with first frame and frame after the last
+        '''
+        s1=int(t1*self.cfg.samplerate+0.5)
+        s2=int(t2*self.cfg.samplerate+0.5)
+        f1=-(-s1//self.cfg.frmLen)
+        f2=min(-(-s2//self.cfg.frmLen), nFrames)
+        # keep at least one frame as trimmed audio is never empty
+        f1=max(min(f1, nFrames-1), 0)
+        f2=max(f2, f1+1)
+        return (f1, f2)
+
+    def segments(self, dur, segLen=None, hop=None):
+        '''
+        Iterator over the segments time ranges of a file
+        :param dur: file duration (sec)
+        :param segLen: segment length (default: Configuration.segLen)
+        :param hop: distance between segments (default: Configuration.segHop)
+        :returns: tuple with start and end of each segment (sec)
+        '''
+        segLen=segLen or self.cfg.segLen
+        hop=hop or self.cfg.segHop or segLen
+        i=0
+        t1=i*hop
+        while t1<dur:
+            yield (t1, t1+segLen)
+            i+=1
+            t1=i*hop
+
+    def fileLogLik(self, audioFile):
+        '''
+        Calculate the log likelihood of each frame for all models
+        :param audioFile: input file
+        :returns: tuple with the cumulative sum of the frame log likelihoods
+                  (frames+1 x models) and the file duration (sec)
+        '''
+        # decode and calculate the features of the whole file once
+        if self.cfg.silenceDb is None:
+            (ftr, dur)=self.fileFeatures(audioFile)
+            return (self.ftrLogLik(ftr), dur)
+        (ftr, dur, energy)=self.fileFeatures(audioFile, True)
+        return (self.ftrLogLik(ftr, self.activeFrames(energy)), dur)
+
+    def samplesLogLik(self, x):
+        '''
+        Calculate the log likelihood of each frame of audio samples for all models
+        :param x: audio samples at the working sample rate
+        :returns: cumulative sum of the frame log likelihoods as returned by ftrLogLik
+        '''
+        energy=None if self.cfg.silenceDb is None else self.energyArray(len(x))
+        ftr=self.ftrFromSamples(x, energy)
+        return self.ftrLogLik(ftr, self.activeFrames(energy))
+
+    def ftrLogLik(self, ftr, active=None):
+        '''
+        Calculate the log likelihood of each frame for all models.
+        Silent frames are not scored and add zero to the sums.
+        :param ftr: features array (frames x ftrLen)
+        :param active: optional boolean array of the frames to score
+        :returns: cumulative sum of the frame log likelihoods (frames+1 x models+1),
+                  the last column counts the scored frames
+        '''
+        with self.stats.timer("scoring"):
+            ll=np.zeros((len(ftr), self.gmms.nModels+1))
+            if active is None:
+                ll[:, :-1]=self.gmms.frameLogLik(ftr)
+                ll[:, -1]=1.0
+            else:
+                nActive=int(np.count_nonzero(active))
+                self.stats.count("silentFrames", len(ftr)-nActive)
+                if nActive>0:
+                    ll[active, :-1]=self.gmms.frameLogLik(ftr if nActive==len(ftr) else ftr[active])
+                ll[active, -1]=1.0
+            cum=np.zeros((len(ll)+1, ll.shape[1]))
+            np.cumsum(ll, axis=0, out=cum[1:])
+        return cum
+
+    def segmentScores(self, d, nFrames):
+        '''
+        Scores of a segment relative to the UBM
+        :param d: difference of the cumulative frame log likelihoods at the segment ends
+        :param nFrames: number of frames in the segment
+        :returns: dict with score for each label, or with "silent" set when
+                  the segment has too few scored frames
+        '''
+        n=d[-1]
+        if n<=0 or n<self.cfg.silenceMinActive*nFrames:
+            self.stats.count("skippedSegments")
+            return {"silent": True}
+        ll=d/n
+        ubm=ll[self.gmms.index["ubm"]]
+        p={}
+        for label in self.labels:
+            p[label]=float(ll[self.gmms.index[label]]-ubm)
+        return p
+
+    def windowScores(self, cum, dur, segLen=None, hop=None):
+        '''
+        Iterator returning the prediction for windows of frames
+        :param cum: cumulative frame log likelihoods from fileLogLik
+        :param dur: file duration (sec)
+        :param segLen: segment length (default: Configuration.segLen)
+        :param hop: distance between segments (default: Configuration.segHop)
+        :returns: dict with scores for each label including the time range
+                  ("silent" is set instead of the scores for skipped segments)
+        '''
+        for (t1, t2) in self.segments(dur, segLen, hop):
+            (f1,f2)=self.segFrames(t1, min(t2,dur), len(cum)-1)
+            p=self.segmentScores(cum[f2]-cum[f1], f2-f1)
+            p["t1"]=t1
+            p["t2"]=t2
+            self.stats.count("segments")
+            yield p
+
+    def predFile(self, audioFile, segLen=None, hop=None, dur=None):
         '''
         Iterator returning the prediction for all segments in the file
         :param audioFile: input file
+        :param segLen: segment length (default: Configuration.segLen)
+        :param hop: distance between segments (default: Configuration.segHop)
+        :param dur: audio duration when already known (SPTK only, default: from the file header)
+        :returns: dict with scores for each label including the time range
+        '''
+        if self.gmms is None:
+            yield from self.predFileSptk(audioFile, segLen, hop, dur)
+            return
+        (cum, dur)=self.fileLogLik(audioFile)
+        yield from self.windowScores(cum, dur, segLen, hop)
+
+    def predFileMulti(self, audioFile, segLens, hop=None):
+        '''
+        Predictions for several segment lengths from a single pass over the file
+        :param audioFile: input file
+        :param segLens: list of segment lengths (sec)
+        :param hop: distance between segments (default: segment length)
+        :returns: dict with list of predictions for each segment length
+        '''
+        (cum, dur)=self.fileLogLik(audioFile)
+        res={}
+        for segLen in segLens:
+            res[segLen]=list(self.windowScores(cum, dur, segLen, hop))
+        return res
+
+    def predFileSptk(self, audioFile, segLen=None, hop=None, dur=None):
+        '''
+        Iterator returning the prediction for all segments in the file.
+        Each segment is decoded separately with the SPTK tools.
+        :param audioFile: input file
+        :param segLen: segment length (default: Configuration.segLen)
+        :param hop: distance between segments (default: Configuration.segHop)
+        :param dur: audio duration when already known (default: from the file header)
         :returns: dict with scores for each label including the time range
         '''
-        # find audio duration (in seconds)
-        durFile=os.path.join(self.tempDir, "dur.txt")
-        cmd="{}i -D {} > {}".format(self.cfg.sox, audioFile, durFile)
-        self.do(cmd)
-        with open(durFile,"rt") as fin:
-            dur=float(fin.readline())
+        if dur is None:
+            dur=self.fileDuration(audioFile)
         # iterate over all segments
-        t1=0
-        while t1<dur:
-            t2=t1+self.cfg.segLen
+        for (t1, t2) in self.segments(dur, segLen, hop):
             p=self.predict(audioFile, t1, min(t2,dur))
             p["t1"]=t1
             p["t2"]=t2
-            t1=t2   
+            self.stats.count("segments")
             yield p
 
+    def fileDuration(self, audioFile):
+        '''
+        Audio duration from the file header (with soxi)
+        :param audioFile: input file
+        :returns: duration (sec)
+        '''
+        if self.cfg.backend=="sptkpipe":
+            self.stats.count("subprocesses")
+            with self.stats.timer("decode"):
+                res=subprocess.run(["{}i".format(self.cfg.sox), "-D", audioFile], stdout=subprocess.PIPE)
+            if res.returncode!=0:
+                raise TrainException("rc={0}".format(res.returncode))
+            dur=float(res.stdout.split()[0])
+        else:
+            with self.scratch() as tmp:
+                durFile=os.path.join(tmp, "dur.txt")
+                cmd="{}i -D {} > {}".format(self.cfg.sox, audioFile, durFile)
+                self.do(cmd, "decode")
+                with open(durFile,"rt") as fin:
+                    dur=float(fin.readline())
+        return dur
+
     def testFile(self, audioFileData):
         '''
         Calculate the scores and the expected values for each segment in the file.
@@ -208,6 +1219,15 @@ class AudioClassifier:
         :param audioFileData: list containing audio file and labels
         :returns: tuple with dict with list for each label
         '''
+        return self.testPreds(audioFileData, self.predFile(audioFileData[0]))
+
+    def testPreds(self, audioFileData, preds):
+        '''
+        Arrange the scores and the expected values of the predictions of a file
+        :param audioFileData: list containing audio file and labels
+        :param preds: iterator over the segments predictions
+        :returns: tuple with dict with list for each label
+        '''
         # initialize empty dicts
         scr={}
         trg={}
@@ -215,7 +1235,10 @@ class AudioClassifier:
             scr[label]=[]
             trg[label]=[]
         # iterate over all segments
-        for p in self.predFile(audioFileData[0]):
+        for p in preds:
+            if p.get("silent"):
+                # skipped segments have no scores
+                continue
             # convert score into lists
             trg1={}
             for label in self.labels:
@@ -267,15 +1290,41 @@ class AudioClassifier:
                 filesData.append(fileData)
         return filesData
     
+    def setTopC(self, topC):
+        '''
+        Select the number of UBM Gaussians evaluated in the label models
+        :param topC: number of Gaussians (None to evaluate all)
+        '''
+        if topC and not self.gmms.aligned:
+            logging.warning("topC ignored: the models are not adapted from the UBM")
+            topC=None
+        self.gmms.topC=topC
+
     def loadModels(self, modelDir):
         '''
-        Load labels names from the models directory
+        Load labels names and models from the models directory.
+        The bundle file is used when it exists.
         :param modelDir: input folder
         '''
         self.modelDir=modelDir
+        bundleFile=os.path.join(self.modelDir, gmm.BUNDLE_NAME)
+        if os.path.exists(bundleFile):
+            try:
+                (gmms, self.labels)=gmm.GmmSet.loadBundle(bundleFile, self.cfg)
+            except ValueError as e:
+                raise TrainException(str(e))
+            if self.cfg.backend not in SPTK_BACKENDS:
+                self.gmms=gmms
+                self.setTopC(self.cfg.topC)
+            return
+        # models trained without a bundle file
         self.labels=[]
         with open(os.path.join(self.modelDir, "labels.txt"), "rt") as flbl:
             for ln in flbl:
                 self.labels.extend(ln.split())
+        # load the models for the in-process scoring
+        if self.cfg.backend not in SPTK_BACKENDS:
+            self.gmms=gmm.GmmSet.load(self.modelDir, self.labels+["ubm"], self.cfg.nGauss, self.cfg.ftrLen)
+            self.setTopC(self.cfg.topC)
         
             
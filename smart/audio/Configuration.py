@@ -25,18 +25,77 @@ smart.audio.Configuration - Audio classifier configuration file.
 sptk="/usr/local/sptk/bin"
 sox="/usr/bin/sox"
 
+# Feature extraction backend:
+#  "numpy" - in-process feature extraction (default)
+#  "sptk"  - SPTK command line tools (reference implementation)
+#  "sptkpipe" - SPTK command line tools connected by pipes, without
+#               temporary files (same results as "sptk")
+backend="numpy"
+
+# Number of parallel jobs used for training (None for the number of CPUs)
+nJobs=None
+
+# Folder of the persistent features cache (None to disable the cache)
+cacheDir=None
+# Maximal size of the features cache in bytes
+cacheSize=10*1024**3
+
 # Working sample rate in Hz
 samplerate=22050
+# Audio longer than this (in seconds) is decoded to a memory mapped file
+mmapLen=600
 # Window length in samples
 winLen=1024
 # Distance between each frame in samples
 frmLen=512
 # Length of MFCC vector
 nMfcc=16
+# Sampling frequency (Hz) assumed by the mel filter bank.
+# This is the SPTK mfcc default which was used to train the models.
+mfccFs=16000
 # Length of the feature vector = (MFCC + dMFCC + ddMFCC)
 ftrLen = nMfcc *3
 # Number of Gaussians in each GMM
 nGauss = 16
+# UBM training:
+#  "sptk"   - SPTK gmm on the features of all the training files
+#  "stream" - mini-batch EM on the features as they are calculated (bounded memory)
+ubmTrainer="sptk"
+# Number of frames in each mini-batch EM step
+ubmBatch=20000
+# Number of EM passes over the training files (or over the reservoir sample)
+ubmEpochs=5
+# Number of frames kept by the reservoir subsampler (None to use all the frames)
+ubmReservoir=None
+# Checkpoint file of the streaming UBM training (None for ubm.ckpt.npz in the models folder)
+ubmCheckpoint=None
+# Time between checkpoints of the streaming UBM training (sec)
+ubmCheckpointPeriod=300
+
+# Training of the label models:
+#  "em"  - independent training of each model with SPTK gmm
+#  "map" - MAP adaptation of the UBM (models are aligned with the UBM)
+trainMode="em"
+# MAP adaptation relevance factor
+mapRelevance=16.0
+# MAP adapted parameters: any of "w" (weights), "m" (means) and "v" (variances)
+mapAdapt="m"
+# Keep the statistics of the training data with the models (for train.py --update).
+# None keeps them when they are free: with MAP adaptation, or when the features
+# cache is enabled (otherwise the EM training decodes the files a second time).
+keepStats=None
+# Number of UBM Gaussians evaluated in the label models for each frame
+# (None to evaluate all). Only used with models adapted from the UBM.
+topC=None
+
+# Frames with energy below this level (dB relative to a full scale 16 bit
+# signal) are silent and are not scored. None disables silence detection.
+silenceDb=None
+# Segments with a smaller fraction of non-silent frames are skipped (not scored)
+silenceMinActive=0.1
 
 # Length of segment used for classification (in seconds)
 segLen=5
+# Distance between the start of consecutive segments (in seconds).
+# None for non-overlapping segments.
+segHop=None
@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+# SMART FP7 - Search engine for MultimediA enviRonment generated contenT
+# Webpage: http://smartfp7.eu
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# The Original Code is Copyright (C) 2013 IBM Corp.
+# All Rights Reserved
+#
+# Contributor(s):
+#  Zvi Kons <zvi@il.ibm.com>
+
+
+"""
+smart.audio.bench - Performance benchmark on a synthetic audio corpus CLI.
+"""
+import sys
+
+from smart.audio import AudioClassifier, Configuration, gmm, utils
+import argparse
+import concurrent.futures
+import json
+import logging
+import os
+import os.path
+import platform
+import resource
+import tempfile
+import time
+import wave
+import numpy as np
+
+# Labels of the synthetic corpus
+SYNTH_LABELS=("tone", "noise", "chirp")
+
+
+def synthAudio(dur, samplerate, rng):
+    '''
+    Create synthetic audio made of tones, noise bursts and chirps separated by silence
+    :param dur: duration (sec)
+    :param samplerate: sample rate (Hz)
+    :param rng: random generator
+    :returns: tuple with 16 bit samples and list of (t1, t2, label)
+    '''
+    n=int(dur*samplerate)
+    x=rng.normal(0, 30, n)
+    labels=[]
+    t=0.0
+    while True:
+        t+=rng.uniform(0.2, 1.0)
+        segDur=rng.uniform(1.0, 4.0)
+        if t+segDur>dur:
+            break
+        lbl=SYNTH_LABELS[rng.integers(len(SYNTH_LABELS))]
+        s1=int(t*samplerate)
+        tt=np.arange(int(segDur*samplerate))/samplerate
+        if lbl=="tone":
+            f0=rng.uniform(200, 1000)
+            y=sum(np.sin(2*np.pi*f0*h*tt)/h for h in range(1, 5))
+        elif lbl=="noise":
+            y=rng.normal(0, 0.5, len(tt))
+        else:
+            f1=rng.uniform(100, 500)
+            f2=rng.uniform(2000, 6000)
+            y=np.sin(2*np.pi*(f1*tt+(f2-f1)*tt*tt/(2*segDur)))
+        x[s1:s1+len(tt)]+=rng.uniform(2000, 8000)*y
+        labels.append((t, t+segDur, lbl))
+        t+=segDur
+    return (np.clip(x, -32768, 32767).astype(np.int16), labels)
+
+def makeCorpus(workDir, lengths, nFiles, samplerate, seed=0):
+    '''
+    Write a synthetic corpus with audio files, label files and a list file
+    for each file length
+    :param workDir: output folder
+    :param lengths: list of file lengths (sec)
+    :param nFiles: number of files of each length
+    :param samplerate: sample rate (Hz)
+    :param seed: random seed
+    :returns: dict with the list file of each length
+    '''
+    rng=np.random.default_rng(seed)
+    lists={}
+    for dur in lengths:
+        listFile=os.path.join(workDir, "list_{}.txt".format(dur))
+        with open(listFile, "wt") as flist:
+            for i in range(nFiles):
+                base=os.path.join(workDir, "synth_{}_{}".format(dur, i))
+                (x, labels)=synthAudio(dur, samplerate, rng)
+                with wave.open(base+".wav", "wb") as w:
+                    w.setnchannels(1)
+                    w.setsampwidth(2)
+                    w.setframerate(samplerate)
+                    w.writeframes(x.astype("<i2").tobytes())
+                with open(base+".lbl", "wt") as flbl:
+                    for (t1, t2, lbl) in labels:
+                        flbl.write("{:.6f} {:.6f} {}\n".format(t1, t2, lbl))
+                flist.write("{0}.wav {0}.lbl\n".format(base))
+        lists[dur]=listFile
+    return lists
+
+def makeModels(modelDir, labels, nGauss, ftrLen, seed=0):
+    '''
+    Write random models in SPTK format (scoring cost does not depend on the values)
+    :param modelDir: output folder
+    :param labels: list of labels
+    :param nGauss: number of Gaussians
+    :param ftrLen: length of the feature vector
+    '''
+    rng=np.random.default_rng(seed)
+    if not os.path.exists(modelDir):
+        os.makedirs(modelDir)
+    for name in list(labels)+["ubm"]:
+        w=np.full(nGauss, 1.0/nGauss)
+        mu=rng.normal(0, 5, (nGauss, ftrLen))
+        var=rng.uniform(0.5, 10, (nGauss, ftrLen))
+        gmm.saveGmm(os.path.join(modelDir, name+".gmm"), w, mu, var)
+    with open(os.path.join(modelDir, "labels.txt"), "wt") as flbl:
+        for lbl in labels:
+            flbl.write(lbl+"\n")
+
+def resetPeakRss():
+    '''Reset the peak resident memory (Linux only)'''
+    try:
+        with open("/proc/self/clear_refs", "wt") as fout:
+            fout.write("5")
+    except OSError:
+        pass
+
+def peakRss():
+    '''
+    Peak resident memory of this process (MB)
+    '''
+    try:
+        with open("/proc/self/status", "rt") as fin:
+            for ln in fin:
+                if ln.startswith("VmHWM:"):
+                    return int(ln.split()[1])/1024.0
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.0
+
+def timeStage(func, repeat):
+    '''
+    Time a benchmark stage
+    :param func: function to run
+    :param repeat: number of runs (the fastest is reported)
+    :returns: tuple with the best time (sec), peak memory (MB) and the function result
+    '''
+    best=None
+    resetPeakRss()
+    for i in range(repeat):
+        t0=time.perf_counter()
+        res=func()
+        t=time.perf_counter()-t0
+        best=t if best is None else min(best, t)
+    return (best, peakRss(), res)
+
+def runBench(cfg, workDir, lengths, gaussList, nFiles, repeat, train):
+    '''
+    Run all the benchmark stages
+    :returns: list of results dicts
+    '''
+    lists=makeCorpus(workDir, lengths, nFiles, cfg.samplerate)
+    results=[]
+    # stage times of the first model size for the predFile breakdown
+    stageTimes={}
+
+    def add(stage, dur, nGauss, t, rss, breakdown=None, audio=None):
+        audio=audio or dur
+        r={"stage": stage, "length": dur, "nGauss": nGauss, "time": t, "rtf": t/audio, "peakRssMB": rss}
+        if breakdown:
+            r["breakdown"]=breakdown
+        results.append(r)
+        logging.info("bench: {}".format(r))
+
+    for nGauss in gaussList:
+        cfg.nGauss=nGauss
+        modelDir=os.path.join(workDir, "models_{}".format(nGauss))
+        makeModels(modelDir, SYNTH_LABELS, nGauss, cfg.ftrLen)
+        cls=AudioClassifier.AudioClassifier(cfg)
+        cls.loadModels(modelDir)
+        for dur in lengths:
+            fd=cls.loadFilesData(lists[dur])
+            audioFile=fd[0][0]
+            totalDur=dur*len(fd)
+            if nGauss==gaussList[0]:
+                # feature extraction does not depend on the models
+                (t, rss, x)=timeStage(lambda: cls.decode(audioFile), repeat)
+                (tf, rssf, ftr)=timeStage(lambda: cls.ftrFromSamples(x), repeat)
+                add("decode", dur, None, t, rss)
+                add("features", dur, None, tf, rssf)
+                stageTimes[("decode", dur)]=t
+                stageTimes[("features", dur)]=tf
+                mfccFile=os.path.join(workDir, "bench.mfcc")
+
+                def file2mfcc():
+                    if os.path.exists(mfccFile):
+                        os.remove(mfccFile)
+                    cls.file2mfcc(audioFile, mfccFile)
+                (t, rss, res)=timeStage(file2mfcc, repeat)
+                add("file2mfcc", dur, None, t, rss)
+            else:
+                ftr=cls.file2ftr(audioFile)
+            breakdown=None
+            if cls.gmms is not None:
+                (t, rss, res)=timeStage(lambda: cls.gmms.frameLogLik(ftr), repeat)
+                add("scoring", dur, nGauss, t, rss)
+                breakdown={"decode": stageTimes[("decode", dur)], "features": stageTimes[("features", dur)], "scoring": t}
+            segLen=min(cfg.segLen, dur)
+            (t, rss, res)=timeStage(lambda: cls.predict(audioFile, 0, segLen), repeat)
+            add("predict", dur, nGauss, t, rss, audio=segLen)
+            (t, rss, res)=timeStage(lambda: list(cls.predFile(audioFile)), repeat)
+            add("predFile", dur, nGauss, t, rss, breakdown)
+            # evaluation data for the EER stage
+            scr=[]
+            trg=[]
+            for f in fd:
+                (s1, t1)=cls.testFile(f)
+                for lbl in cls.labels:
+                    scr.extend(s1[lbl])
+                    trg.extend(t1[lbl])
+            (t, rss, res)=timeStage(lambda: utils.eer(scr, trg), repeat)
+            add("eer", dur, nGauss, t, rss, audio=totalDur)
+            if train:
+                trainDir=os.path.join(workDir, "trained_{}_{}".format(nGauss, dur))
+                trn=AudioClassifier.AudioClassifier(cfg)
+                try:
+                    (t, rss, res)=timeStage(lambda: trn.createAllGmms(trainDir, fd), 1)
+                    add("createAllGmms", dur, nGauss, t, rss, audio=totalDur)
+                except AudioClassifier.TrainException as e:
+                    logging.error("ERROR: training failed {}\n".format(e))
+    return results
+
+def checkConcurrency(cls, audioFiles, nThreads, rounds=4, seed=0):
+    '''
+    Call predict and predFile of one classifier from many threads and
+    compare the results with serial calls
+    :param cls: classifier with loaded models
+    :param audioFiles: list of audio files
+    :param nThreads: number of threads
+    :param rounds: number of times each call is repeated
+    :param seed: random seed of the time ranges and the order of the calls
+    :returns: dict with number of calls, mismatches and the serial and concurrent times (sec)
+    '''
+    rng=np.random.default_rng(seed)
+    calls=[]
+    for audioFile in audioFiles:
+        calls.append(("predFile", audioFile, None, None))
+        dur=cls.fileFeatures(audioFile)[1]
+        for i in range(4):
+            t1=float(rng.uniform(0, dur*0.8))
+            calls.append(("predict", audioFile, t1, min(t1+cls.cfg.segLen, dur)))
+
+    def run(call):
+        (kind, audioFile, t1, t2)=call
+        if kind=="predFile":
+            return list(cls.predFile(audioFile))
+        return cls.predict(audioFile, t1, t2)
+
+    t0=time.perf_counter()
+    expected=[run(c) for c in calls]
+    serial=time.perf_counter()-t0
+    order=[i for r in range(rounds) for i in range(len(calls))]
+    rng.shuffle(order)
+    t0=time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(nThreads) as executor:
+        results=list(executor.map(lambda i: run(calls[i]), order))
+    parallel=time.perf_counter()-t0
+    mismatches=0
+    for (i, res) in zip(order, results):
+        if res!=expected[i]:
+            mismatches+=1
+            logging.error("ERROR: concurrent result differs for {}\n".format(calls[i]))
+    return {"calls": len(order), "threads": nThreads, "mismatches": mismatches,
+            "serial": serial*rounds, "concurrent": parallel}
+
+def compare(results, baseline):
+    '''
+    Print the speed of each stage relative to a baseline
+    :param results: list of results dicts
+    :param baseline: baseline results dict
+    '''
+    base=dict(((r["stage"], r["length"], r["nGauss"]), r) for r in baseline["results"])
+    print("{:<15} {:>8} {:>7} {:>10} {:>10} {:>8}".format("stage", "length", "nGauss", "time", "baseline", "speedup"))
+    for r in results:
+        b=base.get((r["stage"], r["length"], r["nGauss"]))
+        if b is None:
+            continue
+        print("{:<15} {:>8} {:>7} {:>10.4f} {:>10.4f} {:>7.2f}x".format(r["stage"], r["length"], str(r["nGauss"]), r["time"], b["time"], b["time"]/max(r["time"], 1e-12)))
+
+def main(argv):
+    '''Command line benchmark.'''
+
+    parser = argparse.ArgumentParser(description="Benchmark the audio classifier on a synthetic corpus")
+    parser.add_argument("-v", "--verbose", dest="verbose", action="count", help="increase verbosity level", default=0)
+    parser.add_argument("-l", "--lengths", dest="lengths", default="10,60,300", help="comma separated file lengths in seconds [%(default)s]")
+    parser.add_argument("-g", "--gauss", dest="gauss", default="16,64,256", help="comma separated numbers of Gaussians [%(default)s]")
+    parser.add_argument("-f", "--files", dest="nFiles", type=int, default=2, help="number of files of each length [%(default)s]")
+    parser.add_argument("-r", "--repeat", dest="repeat", type=int, default=3, help="number of runs of each stage [%(default)s]")
+    parser.add_argument("-t", "--train", dest="train", action="store_true", help="benchmark training (requires SPTK gmm)")
+    parser.add_argument("-w", "--work_dir", dest="workDir", help="folder for the synthetic corpus [temporary folder]")
+    parser.add_argument("-b", "--baseline", dest="baseline", help="compare with results saved by a previous run")
+    parser.add_argument("-o", "--output", dest="output", help="save the results to a JSON file")
+    parser.add_argument("-c", "--concurrency", dest="threads", type=int, help="only check that one classifier gives the serial results when called from this number of threads")
+    args = parser.parse_args()
+    if args.verbose==1:
+        logging.basicConfig(level=logging.INFO)
+    if args.verbose>1:
+        logging.basicConfig(level=logging.DEBUG)
+    cfg=utils.configFromDict(utils.configDict(Configuration))
+    lengths=[float(v) for v in args.lengths.split(",")]
+    gaussList=[int(v) for v in args.gauss.split(",")]
+
+    with tempfile.TemporaryDirectory() as tmpDir:
+        workDir=args.workDir or tmpDir
+        if not os.path.exists(workDir):
+            os.makedirs(workDir)
+        if args.threads:
+            lists=makeCorpus(workDir, lengths[:1], args.nFiles, cfg.samplerate)
+            cfg.nGauss=gaussList[0]
+            modelDir=os.path.join(workDir, "models_{}".format(cfg.nGauss))
+            makeModels(modelDir, SYNTH_LABELS, cfg.nGauss, cfg.ftrLen)
+            cls=AudioClassifier.AudioClassifier(cfg)
+            cls.loadModels(modelDir)
+            audioFiles=[f[0] for f in cls.loadFilesData(lists[lengths[0]])]
+            res=checkConcurrency(cls, audioFiles, args.threads, args.repeat)
+            print("{0[calls]} calls from {0[threads]} threads: {0[mismatches]} mismatches, "
+                  "serial {0[serial]:.3f} sec, concurrent {0[concurrent]:.3f} sec".format(res))
+            return 1 if res["mismatches"] else 0
+        results=runBench(cfg, workDir, lengths, gaussList, args.nFiles, args.repeat, args.train)
+    # the configuration the benchmark ran with (nGauss is set by each run)
+    config=utils.configDict(cfg)
+    config["nGauss"]=gaussList
+    report={"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "host": platform.node(), "python": platform.python_version(),
+            "numpy": np.__version__, "config": config, "results": results}
+
+    print("{:<15} {:>8} {:>7} {:>10} {:>10} {:>10}".format("stage", "length", "nGauss", "time", "RTF", "peak MB"))
+    for r in results:
+        print("{:<15} {:>8} {:>7} {:>10.4f} {:>10.5f} {:>10.1f}".format(r["stage"], r["length"], str(r["nGauss"]), r["time"], r["rtf"], r["peakRssMB"]))
+    if args.output:
+        with open(args.output, "wt") as fout:
+            json.dump(report, fout, indent=2)
+    if args.baseline:
+        with open(args.baseline, "rt") as fin:
+            compare(results, json.load(fin))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,173 @@
+'''
+smart.audio.cache - Persistent features cache.
+'''
+
+# SMART FP7 - Search engine for MultimediA enviRonment generated contenT
+# Webpage: http://smartfp7.eu
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# The Original Code is Copyright (C) 2013 IBM Corp.
+# All Rights Reserved
+#
+# Contributor(s):
+#  Zvi Kons <zvi@il.ibm.com>
+
+import os
+import os.path
+import hashlib
+import json
+import logging
+import tempfile
+import threading
+import numpy as np
+from smart.audio.stats import Stats
+
+# Configuration values that change the features
+FEATURE_KEYS=("samplerate", "winLen", "frmLen", "nMfcc", "mfccFs", "ftrLen")
+
+
+class FeatureCache:
+    '''
+    Features cache keyed by the audio file content and the features configuration.
+    Features are stored as .npy files and read back memory mapped.
+    The least recently used entries are removed when the cache is too large.
+    The cache size is tracked by the writes of this object, so the folder is
+    scanned only when it may exceed the limit (other processes sharing the
+    folder are counted at each scan). The cache can be used from several threads.
+    '''
+
+    def __init__(self, cacheDir, maxBytes, cfg, metrics=None, evictTo=0.9):
+        '''
+        :param cacheDir: cache folder
+        :param maxBytes: maximal size of the cache
+        :param cfg: configuration
+        :param metrics: Stats object counting the cache hits, misses and evictions (default: private)
+        :param evictTo: fraction of maxBytes kept after an eviction
+        '''
+        self.cacheDir=cacheDir
+        self.maxBytes=maxBytes
+        self.evictTo=evictTo
+        self.cfgKey=json.dumps([getattr(cfg, k) for k in FEATURE_KEYS])
+        self.hashes={}
+        self.metrics=metrics or Stats()
+        self.lock=threading.Lock()
+        # estimated size of the cache (None before the first scan)
+        self.total=None
+        if not os.path.exists(self.cacheDir):
+            os.makedirs(self.cacheDir, exist_ok=True)
+
+    def fileHash(self, fileName):
+        '''
+        Hash of the file content. The hash is kept for files that were not modified.
+        :param fileName: input file
+        :returns: hex digest
+        '''
+        st=os.stat(fileName)
+        fileId=(os.path.abspath(fileName), st.st_size, st.st_mtime_ns)
+        if fileId not in self.hashes:
+            h=hashlib.sha1()
+            with open(fileName, "rb") as fin:
+                for chunk in iter(lambda: fin.read(1<<20), b""):
+                    h.update(chunk)
+            self.hashes[fileId]=h.hexdigest()
+        return self.hashes[fileId]
+
+    def key(self, fileName, timeRange=None):
+        '''
+        Cache key for the features of an audio file
+        :param fileName: input audio file
+        :param timeRange: optional [t1, t2] range (sec)
+        :returns: key string
+        '''
+        h=hashlib.sha1(self.fileHash(fileName).encode())
+        h.update(self.cfgKey.encode())
+        if timeRange:
+            h.update(json.dumps([float(t) for t in timeRange]).encode())
+        return h.hexdigest()
+
+    def get(self, key):
+        '''
+        Read features from the cache
+        :param key: cache key
+        :returns: tuple with memory mapped features and metadata dict, or None
+        '''
+        path=os.path.join(self.cacheDir, key)
+        try:
+            ftr=np.load(path+".npy", mmap_mode="r")
+            with open(path+".json", "rt") as fin:
+                meta=json.load(fin)
+            # mark as recently used
+            os.utime(path+".npy")
+        except (OSError, ValueError):
+            self.metrics.count("cacheMisses")
+            return None
+        self.metrics.count("cacheHits")
+        return (ftr, meta)
+
+    def put(self, key, ftr, meta=None):
+        '''
+        Write features to the cache
+        :param key: cache key
+        :param ftr: features array
+        :param meta: metadata dict
+        '''
+        path=os.path.join(self.cacheDir, key)
+        self.writeFile(path+".json", json.dumps(meta or {}).encode())
+        size=self.writeFile(path+".npy", np.ascontiguousarray(ftr, dtype=np.float32))
+        with self.lock:
+            self.total=None if self.total is None else self.total+size
+            full=self.total is None or self.total>self.maxBytes
+        if full:
+            self.evict()
+
+    def writeFile(self, fileName, data):
+        '''
+        Write a file through a temporary file so readers never see partial data
+        :param fileName: output file
+        :param data: bytes or numpy array
+        :returns: file size
+        '''
+        (fd, tmpName)=tempfile.mkstemp(dir=self.cacheDir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as fout:
+            if isinstance(data, np.ndarray):
+                np.save(fout, data)
+            else:
+                fout.write(data)
+            size=fout.tell()
+        os.replace(tmpName, fileName)
+        return size
+
+    def evict(self):
+        '''
+        Scan the cache folder and remove least recently used entries when
+        the cache is larger than maxBytes, down to evictTo*maxBytes
+        '''
+        entries=[]
+        total=0
+        for name in os.listdir(self.cacheDir):
+            if not name.endswith(".npy"):
+                continue
+            try:
+                st=os.stat(os.path.join(self.cacheDir, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name[:-4]))
+            total+=st.st_size
+        entries.sort()
+        limit=self.maxBytes if total<=self.maxBytes else self.evictTo*self.maxBytes
+        for (mtime, size, key) in entries:
+            if total<=limit:
+                break
+            logging.debug("FeatureCache: evicting "+key)
+            for ext in (".npy", ".json"):
+                try:
+                    os.remove(os.path.join(self.cacheDir, key+ext))
+                except OSError:
+                    pass
+            total-=size
+            self.metrics.count("cacheEvictions")
+        with self.lock:
+            self.total=total
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+# SMART FP7 - Search engine for MultimediA enviRonment generated contenT
+# Webpage: http://smartfp7.eu
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# The Original Code is Copyright (C) 2013 IBM Corp.
+# All Rights Reserved
+#
+# Contributor(s):
+#  Zvi Kons <zvi@il.ibm.com>
+
+
+"""
+smart.audio.checkfeatures - Compare the numpy features with the SPTK output CLI.
+"""
+import sys
+
+from smart.audio import AudioClassifier, Configuration
+import argparse
+import logging
+import os.path
+import numpy as np
+
+
+def compareFeatures(cls, audioFile):
+    '''
+    Compare the numpy features of an audio file with the SPTK features
+    :param cls: AudioClassifier object
+    :param audioFile: input audio file
+    :returns: numpy and SPTK features shapes, and max relative difference
+              for static, delta and delta^2 parts (None on shape mismatch)
+    '''
+    cfg=cls.cfg
+    mfccFile=os.path.join(cls.tempDir, "check.dmfcc")
+    # reference features from the SPTK tools
+    if os.path.exists(mfccFile):
+        os.remove(mfccFile)
+    cls.file2mfccSptk(audioFile, mfccFile)
+    ref=np.fromfile(mfccFile, dtype=np.float32).reshape(-1, cfg.ftrLen)
+    os.remove(mfccFile)
+    ftr=cls.file2ftr(audioFile)
+    if ref.shape!=ftr.shape:
+        return (ftr.shape, ref.shape, None)
+    # relative difference for static, delta and delta^2 parts
+    diffs=[]
+    for i in range(3):
+        blk=slice(i*cfg.nMfcc, (i+1)*cfg.nMfcc)
+        scale=max(np.abs(ref[:, blk]).max(), 1e-6) if len(ref) else 1.0
+        diffs.append(float(np.abs(ftr[:, blk]-ref[:, blk]).max()/scale) if len(ref) else 0.0)
+    return (ftr.shape, ref.shape, diffs)
+
+def main(argv):
+    '''Command line features comparison.'''
+
+    parser = argparse.ArgumentParser(description="Compare numpy and SPTK features for audio files")
+    parser.add_argument("-v", "--verbose", dest="verbose", action="count", help="increase verbosity level", default=0)
+    parser.add_argument("-t", "--tolerance", dest="tolerance", type=float, default=1e-3, help="maximal relative difference [%(default)s]")
+    parser.add_argument("audio_files", nargs="+", help="audio files for comparison")
+    args = parser.parse_args()
+    if args.verbose==1:
+        logging.basicConfig(level=logging.INFO)
+    if args.verbose>1:
+        logging.basicConfig(level=logging.DEBUG)
+    cls=AudioClassifier.AudioClassifier(Configuration)
+
+    rc=0
+    for audioFile in args.audio_files:
+        (shape, refShape, diffs)=compareFeatures(cls, audioFile)
+        if diffs is None:
+            print("{}: shape mismatch {} != {}".format(audioFile, shape, refShape))
+            rc=1
+            continue
+        print("{}: {} frames, max relative difference {:.2e} {:.2e} {:.2e}".format(audioFile, shape[0], *diffs))
+        if max(diffs)>args.tolerance:
+            rc=1
+    return rc
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
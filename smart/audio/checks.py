@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+# SMART FP7 - Search engine for MultimediA enviRonment generated contenT
+# Webpage: http://smartfp7.eu
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# The Original Code is Copyright (C) 2013 IBM Corp.
+# All Rights Reserved
+#
+# Contributor(s):
+#  Zvi Kons <zvi@il.ibm.com>
+
+
+"""
+smart.audio.checks - Self checks of the classifier components CLI.
+"""
+import sys
+
+from smart.audio import AudioClassifier, Configuration, bench, checkfeatures, publisher, utils
+import argparse
+import http.server
+import json
+import logging
+import os.path
+import shutil
+import tempfile
+import threading
+import time
+import numpy as np
+
+
+class CheckSkipped(Exception):
+    '''Exception when a check cannot run in this environment'''
+    pass
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    '''EdgeNode server stub: replies with the next status of the server list (201 when empty)'''
+    protocol_version="HTTP/1.1"
+
+    def do_POST(self):
+        body=self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with self.server.lock:
+            status=self.server.statuses.pop(0) if self.server.statuses else 201
+            if status==201:
+                self.server.received.append(json.loads(body.decode("utf-8")))
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        logging.debug("stub: "+format%args)
+
+
+def stubServer(statuses):
+    '''
+    Start an EdgeNode server stub on a local port
+    :param statuses: list of the reply status codes of the first requests
+    :returns: server (stop with shutdown), the documents it accepted are in its received list
+    '''
+    server=http.server.ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.statuses=list(statuses)
+    server.received=[]
+    server.lock=threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def checkPublisher():
+    '''
+    The publisher delivers all the documents in order through server
+    errors, and keeps or discards the documents it could not send
+    '''
+    docs=[json.dumps({"seq": i}) for i in range(120)]
+    for bulk in (False, True):
+        server=stubServer([500, 201, 503, 500])
+        url="http://127.0.0.1:{}/db".format(server.server_address[1])
+        pub=publisher.EdgeNodePublisher(url, batchSize=16, bulk=bulk, retryMin=0.05, retryMax=0.2)
+        for d in docs:
+            pub.publish(d)
+        assert pub.close(10.0)==0, "bulk={}: documents were not posted".format(bulk)
+        server.shutdown()
+        received=[d for r in server.received for d in (r["docs"] if bulk else [r])]
+        assert [d["seq"] for d in received]==list(range(len(docs))), "bulk={}: documents lost or out of order".format(bulk)
+        assert pub.counters["errors"]>0 and pub.counters["spooled"]>0
+    # server down: the documents stay in the spool folder for the next run
+    with tempfile.TemporaryDirectory() as spoolDir:
+        server=stubServer([500]*1000)
+        url="http://127.0.0.1:{}/db".format(server.server_address[1])
+        pub=publisher.EdgeNodePublisher(url, spoolDir, retryMin=0.05, retryMax=0.1)
+        for d in docs[:10]:
+            pub.publish(d)
+        assert pub.close(0.5)==10, "unsent documents were not reported"
+        assert len(pub.spool)==10, "spooled documents were not kept"
+        server.statuses=[]
+        pub=publisher.EdgeNodePublisher(url, spoolDir, retryMin=0.05)
+        assert pub.close(10.0)==0, "spooled documents were not posted"
+        server.shutdown()
+        assert [d["seq"] for d in server.received]==list(range(10)), "spooled documents were not sent by the next run"
+
+def eerReference(scr, trg):
+    '''
+    Calculate equal error rate (EER).
+    Reference implementation of utils.eer (O(n^2)).
+    :param scr: scores vector
+    :param trg: target vector
+    :returns: EER
+    '''
+    (fa,md)=rocReference(scr, trg)
+    mind=10
+    # find best point where fa~=md
+    for fm in zip(fa,md):
+        d=abs(fm[0]-fm[1])
+        if d<mind:
+            e=sum(fm)/2
+            mind=d
+    return e
+
+def rocReference(scr, trg):
+    '''
+    Calculate ROC: false alarm vs. miss detection curve.
+    Reference implementation of utils.roc (O(n^2)).
+    :param scr: scores vector
+    :param trg: target vector
+    :returns: two vectors for false alarms and miss detection curve
+    '''
+    # convert target to Booleans
+    t1=[x>0.5 for x in trg]
+    # number of true
+    nt=sum(t1)
+    # number of false
+    nf=len(t1)-nt
+    if nt==0 or nf==0:
+        return ([0, 1], [1, 0])
+    #possible thresholds
+    ths=[min(scr)-1] # add point lower than min
+    ths.extend(set(scr)) # all unit scores
+    ths.append(max(scr)+1) # add point larger than max
+    ths.sort()
+
+    # check FA / MD for all possible thresholds
+    fa=[]
+    md=[]
+    for th in ths:
+        fa1=0.0
+        md1=0.0
+        for st in zip(scr, t1):
+            # count how many positives have scores below threshold (MD)
+            if st[0]<th and st[1]:
+                md1+=1.0
+            # count how many negatives have scores above threshold (FA)
+            if st[0]>=th and not st[1]:
+                fa1+=1.0
+        fa.append(fa1/nf)
+        md.append(md1/nt)
+    return (fa, md)
+
+def checkEer():
+    '''
+    The ROC and EER match the reference implementation for random scores,
+    tied scores and single class targets
+    '''
+    rng=np.random.default_rng(0)
+    cases=[]
+    for n in (1, 2, 10, 200):
+        trg=rng.integers(0, 2, n)
+        cases.append((rng.normal(size=n)+trg, trg))
+        cases.append((rng.integers(0, 4, n).astype(float), trg))
+    cases.append(([0.5, 0.5, 0.5, 0.5], [1, 0, 1, 0]))
+    cases.append(([1.0, 2.0, 3.0], [1, 1, 1]))
+    for (scr, trg) in cases:
+        scr=[float(x) for x in scr]
+        (fa, md)=utils.roc(scr, trg)
+        (faRef, mdRef)=rocReference(scr, trg)
+        assert np.allclose(fa, faRef) and np.allclose(md, mdRef), "roc differs for {} {}".format(scr, list(trg))
+        assert abs(utils.eer(scr, trg)-eerReference(scr, trg))<1e-12, "eer differs for {} {}".format(scr, list(trg))
+
+def checkFeatures():
+    '''
+    The numpy features of synthetic audio match the SPTK features
+    (skipped when sox or SPTK are not installed)
+    '''
+    cfg=utils.configFromDict(utils.configDict(Configuration))
+    if shutil.which(cfg.sox) is None:
+        raise CheckSkipped("sox not found: {}".format(cfg.sox))
+    if not os.path.exists(os.path.join(cfg.sptk, "x2x")):
+        raise CheckSkipped("SPTK not found: {}".format(cfg.sptk))
+    with tempfile.TemporaryDirectory() as workDir:
+        listFile=bench.makeCorpus(workDir, [7.3], 2, cfg.samplerate)[7.3]
+        cls=AudioClassifier.AudioClassifier(cfg)
+        for fileData in cls.loadFilesData(listFile):
+            (shape, refShape, diffs)=checkfeatures.compareFeatures(cls, fileData[0])
+            assert diffs is not None, "shape mismatch {} != {}".format(shape, refShape)
+            assert max(diffs)<=1e-3, "max relative difference {:.2e} {:.2e} {:.2e}".format(*diffs)
+
+def checkConcurrency():
+    '''
+    One classifier called from many threads gives the serial results
+    (skipped when sox is not installed)
+    '''
+    cfg=utils.configFromDict(utils.configDict(Configuration), nGauss=8, cacheDir=None)
+    if shutil.which(cfg.sox) is None:
+        raise CheckSkipped("sox not found: {}".format(cfg.sox))
+    with tempfile.TemporaryDirectory() as workDir:
+        listFile=bench.makeCorpus(workDir, [12.0], 2, cfg.samplerate)[12.0]
+        modelDir=os.path.join(workDir, "models")
+        bench.makeModels(modelDir, bench.SYNTH_LABELS, cfg.nGauss, cfg.ftrLen)
+        cls=AudioClassifier.AudioClassifier(cfg)
+        cls.loadModels(modelDir)
+        audioFiles=[f[0] for f in cls.loadFilesData(listFile)]
+        res=bench.checkConcurrency(cls, audioFiles, 8)
+        assert res["mismatches"]==0, "{0[mismatches]} of {0[calls]} concurrent results differ from the serial results".format(res)
+
+# name and function of each check
+CHECKS=[("concurrency", checkConcurrency), ("eer", checkEer), ("features", checkFeatures), ("publisher", checkPublisher)]
+
+def main(argv):
+    '''Command line self checks.'''
+
+    parser = argparse.ArgumentParser(description="Self checks of the audio classifier components")
+    parser.add_argument("-v", "--verbose", dest="verbose", action="count", help="increase verbosity level", default=0)
+    parser.add_argument("checks", nargs="*", help="checks to run: {} [all]".format(" ".join(n for (n, f) in CHECKS)))
+    args = parser.parse_args()
+    if args.verbose==1:
+        logging.basicConfig(level=logging.INFO)
+    if args.verbose>1:
+        logging.basicConfig(level=logging.DEBUG)
+    rc=0
+    for (name, func) in CHECKS:
+        if args.checks and name not in args.checks:
+            continue
+        t0=time.time()
+        try:
+            func()
+            result="ok"
+        except CheckSkipped as e:
+            result="skipped ({})".format(e)
+        except AssertionError as e:
+            result="FAILED {}".format(e)
+            rc=1
+        print("{}: {} [{:.1f} sec]".format(name, result, time.time()-t0))
+    return rc
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
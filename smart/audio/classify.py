@@ -20,12 +20,15 @@ smart.audio.classify - audio classification CLI.
 
 import sys
 
-from smart.audio import AudioClassifier, Configuration
+from smart.audio import AudioClassifier, Configuration, stream, publisher, scoreindex, stats, utils
 import argparse, math
 import datetime
+import time
+import multiprocessing
+import socket
+import numpy as np
 import os.path
 import json
-import urllib.request
 import logging
 
 
@@ -35,6 +38,10 @@ def logsig(x):
     :param x: input
     :returns: output
     '''
+    if x<0:
+        # avoid overflow for very low scores
+        e=math.exp(x)
+        return e/(1+e)
     return 1/(1+math.exp(-x))
 
 def pred2json(componentName, pred, d0):
@@ -52,33 +59,261 @@ def pred2json(componentName, pred, d0):
     d1s=d1.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
     # build JSON data in EdgeNode format
     audio={"@ID":componentName, "position" : pos}
+    if pred.get("silent"):
+        # the segment was not scored
+        audio["silent"]=True
     for lbl in pred:
-        if (lbl != "t1" ) and (lbl != "t2"):
+        if lbl not in ("t1", "t2", "silent"):
             # score if mapped to the (0,1) range
             audio.update({lbl+"_score" :  logsig(pred[lbl])})
     data={"time": d1s, "audio": audio}
     jsondict={"timestamp":int(pos*1000), "data": data}
     return json.dumps(jsondict, indent=2)
 
-def postJson(url, jsonData):
+# Audio file extensions used when a folder is classified
+AUDIO_EXT=(".wav", ".flac", ".mp3", ".ogg", ".aif", ".aiff", ".au", ".sph")
+
+# classifier used by each batch worker process
+_cls=None
+
+def listAudioFiles(source):
     '''
-    Post JSON data to EdgeNode server
-    :param url: server URL
-    :param jsonData: JSON string
+    List the audio files in a list file or a folder
+    :param source: list file (same format as the training list) or folder
+    :returns: list of audio files
+    '''
+    files=[]
+    if os.path.isdir(source):
+        for (root, dirs, names) in os.walk(source):
+            dirs.sort()
+            for name in sorted(names):
+                if name.lower().endswith(AUDIO_EXT):
+                    files.append(os.path.join(root, name))
+    else:
+        with open(source, "rt") as fin:
+            for ln in fin:
+                # line format: <audio file> [<label file>]
+                tk=ln.split()
+                if len(tk)>0:
+                    files.append(tk[0])
+    return files
+
+def initWorker(modelDir, cfgDict):
+    '''
+    Load the models once in each batch worker process
+    :param modelDir: input folder
+    :param cfgDict: configuration values
+    '''
+    global _cls
+    _cls=AudioClassifier.AudioClassifier(utils.configFromDict(cfgDict))
+    _cls.loadModels(modelDir)
+
+def classifyFile(task):
     '''
-    data = jsonData.encode('utf-8')
-    request = urllib.request.Request(url)
-    request.add_header("Content-Type","application/json")
+    Classify one file in a batch worker process
+    :param task: tuple with audio file, segment length and hop
+    :returns: tuple with audio file, list of predictions, duration (sec)
+              and the worker statistics
+    '''
+    (audioFile, segLen, hop)=task
     try:
-        with urllib.request.urlopen(request, data) as rin:
-            res=json.loads(rin.read().decode("utf-8"))
-            if rin.getcode() != 201:
-                logging.error("ERROR: Server rejected JSON data\n[{}]\n".format(res))
-                return None
-        return res
+        if _cls.gmms is not None:
+            (cum, dur)=_cls.fileLogLik(audioFile)
+            preds=list(_cls.windowScores(cum, dur, segLen, hop))
+        else:
+            dur=_cls.fileDuration(audioFile)
+            preds=list(_cls.predFile(audioFile, segLen, hop, dur))
     except Exception as e:
-        logging.error("ERROR: Failed to post JSON data\n{}\n".format(e))
-        return None
+        logging.error("ERROR: Failed to classify {}\n{}\n".format(audioFile, e))
+        preds=None
+        dur=0.0
+    snap=_cls.stats.snapshot()
+    _cls.stats.reset()
+    return (audioFile, preds, dur, snap)
+
+def csvHeader(labels, withFile=False):
+    '''
+    CSV table header
+    :param labels: labels list
+    :param withFile: add file name column
+    :returns: header line
+    '''
+    cols=["file"] if withFile else []
+    cols.extend(["t1", "t2"])
+    cols.extend(labels)
+    return ",".join(cols)
+
+def pred2csv(labels, pred, fileName=None):
+    '''
+    Converts classification scores into a CSV table line
+    :param labels: labels list
+    :param pred: prediction values
+    :param fileName: optional file name column
+    :returns: CSV line (the scores of skipped silent segments are empty)
+    '''
+    cols=[fileName] if fileName is not None else []
+    cols.extend(["{}".format(pred["t1"]), "{}".format(pred["t2"])])
+    cols.extend(["{}".format(logsig(pred[lbl])) if lbl in pred else "" for lbl in labels])
+    return ",".join(cols)
+
+def batch(args, labels, pub, st, cfg):
+    '''
+    Classify a batch of files in parallel
+    :param args: command line arguments
+    :param labels: labels list
+    :param pub: EdgeNode publisher or None
+    :param st: Stats object collecting the workers statistics
+    :param cfg: configuration of the workers
+    :returns: exit code
+    '''
+    files=listAudioFiles(args.batch)
+    logging.info("batch: {} files, {} workers".format(len(files), args.workers))
+    if args.outputDir and not os.path.exists(args.outputDir):
+        os.makedirs(args.outputDir)
+    merged=not args.outputDir
+    if merged and args.csvOutput:
+        print(csvHeader(labels, True))
+    rc=0
+    totalDur=0.0
+    t0=time.time()
+    tasks=[(f, args.segLen, args.hop) for f in files]
+    with multiprocessing.Pool(args.workers, initWorker, (args.modelDir, utils.configDict(cfg))) as pool:
+        # results are returned in the order of the files list
+        for (audioFile, preds, dur, snap) in pool.imap(classifyFile, tasks):
+            st.merge(snap)
+            if preds is None:
+                rc=1
+                continue
+            totalDur+=dur
+            with st.timer("output"):
+                batchOutput(args, labels, pub, audioFile, preds)
+    wall=time.time()-t0
+    if args.scoreIndex:
+        with st.timer("index"):
+            args.scoreIndex.buildIndex()
+    print("Processed {} files, {:.1f} sec audio in {:.1f} sec ({:.1f} audio sec / sec)".format(len(files), totalDur, wall, totalDur/max(wall, 1e-9)), file=sys.stderr)
+    return rc
+
+def batchOutput(args, labels, pub, audioFile, preds):
+    '''
+    Write and post the predictions of one file in batch mode
+    :param args: command line arguments
+    :param labels: labels list
+    :param pub: EdgeNode publisher or None
+    :param audioFile: audio file
+    :param preds: list of predictions
+    '''
+    if args.dropSilent:
+        preds=[p for p in preds if not p.get("silent")]
+    if args.scoreIndex:
+        args.scoreIndex.append(audioFile, preds)
+    merged=not args.outputDir
+    if args.jsonOutput or args.edgeNodeUrl:
+        sampleDateTime=datetime.datetime.fromtimestamp(os.path.getmtime(audioFile))
+    if not merged:
+        base=os.path.join(args.outputDir, os.path.basename(audioFile))
+        if args.csvOutput:
+            with open(base+".csv", "wt") as fout:
+                fout.write(csvHeader(labels)+"\n")
+                for p in preds:
+                    fout.write(pred2csv(labels, p)+"\n")
+        if args.jsonOutput:
+            with open(base+".json", "wt") as fout:
+                json.dump([json.loads(pred2json(args.componentName, p, sampleDateTime)) for p in preds], fout, indent=2)
+    for p in preds:
+        if merged and args.csvOutput:
+            print(pred2csv(labels, p, audioFile))
+        if args.jsonOutput or args.edgeNodeUrl:
+            jsonData=pred2json(args.componentName, p, sampleDateTime)
+            if merged and args.jsonOutput:
+                print(jsonData)
+            if pub:
+                pub.publish(jsonData)
+
+def readStream(args, samplerate):
+    '''
+    Iterator over chunks of raw audio from the standard input or a local socket
+    :param args: command line arguments
+    :param samplerate: sample rate of the audio (Hz)
+    :returns: bytes
+    '''
+    chunkLen=max(int(args.chunk*samplerate)*2, 2)
+    if args.socketPath:
+        if os.path.exists(args.socketPath):
+            os.remove(args.socketPath)
+        server=socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(args.socketPath)
+        server.listen(1)
+        logging.info("stream: waiting for connection on "+args.socketPath)
+        (conn, addr)=server.accept()
+        with conn:
+            for data in iter(lambda: conn.recv(chunkLen), b""):
+                yield data
+        server.close()
+        os.remove(args.socketPath)
+    else:
+        fd=sys.stdin.buffer.fileno()
+        for data in iter(lambda: os.read(fd, chunkLen), b""):
+            yield data
+
+def classifyStream(args, cls, pub):
+    '''
+    Classify live 16 bit PCM audio at the working sample rate
+    :param args: command line arguments
+    :param cls: classifier with loaded models
+    :param pub: EdgeNode publisher or None
+    :returns: exit code
+    '''
+    if cls.gmms is None:
+        logging.critical("Streaming requires the numpy backend\n")
+        return 1
+    sc=stream.StreamClassifier(cls, args.segLen, args.hop)
+    sampleDateTime=datetime.datetime.now()
+    # the index keeps the segments times relative to the stream start
+    args.indexName="stream@"+sampleDateTime.isoformat(timespec="seconds")
+    rest=b""
+    for data in readStream(args, cls.cfg.samplerate):
+        arrival=time.time()
+        data=rest+data
+        # keep an odd byte for the next chunk
+        n=len(data)//2*2
+        rest=data[n:]
+        preds=sc.push(np.frombuffer(data[:n], dtype=np.int16), arrival)
+        with cls.stats.timer("output"):
+            output(args, cls.labels, preds, sampleDateTime, pub)
+        if sc.nSeg and sc.nSeg%args.statsEvery==0:
+            logging.info("stream: {}".format(sc.metrics()))
+    preds=sc.flush()
+    with cls.stats.timer("output"):
+        output(args, cls.labels, preds, sampleDateTime, pub)
+    m=sc.metrics()
+    print("Processed {0[audio]:.1f} sec audio in {0[processing]:.1f} sec (real time factor {0[rtf]:.4f}), "
+          "segment latency avg {0[lagAvg]:.3f} sec max {0[lagMax]:.3f} sec".format(m), file=sys.stderr)
+    return 0
+
+def output(args, labels, preds, sampleDateTime, pub):
+    '''
+    Print and post predictions
+    :param args: command line arguments
+    :param labels: labels list
+    :param preds: list of predictions
+    :param sampleDateTime: sample start time
+    :param pub: EdgeNode publisher or None
+    '''
+    if args.dropSilent:
+        preds=[p for p in preds if not p.get("silent")]
+    if args.scoreIndex and preds:
+        args.scoreIndex.append(args.indexName, preds)
+        args.scoreIndex.flush()
+    for p in preds:
+        if args.csvOutput:
+            print(pred2csv(labels, p), flush=True)
+        if args.jsonOutput or pub:
+            jsonData=pred2json(args.componentName, p, sampleDateTime)
+            if args.jsonOutput:
+                print(jsonData, flush=True)
+            if pub:
+                pub.publish(jsonData)
 
 def main(argv): 
     '''Command line classification.'''
@@ -86,18 +321,41 @@ def main(argv):
     parser = argparse.ArgumentParser(description="Classification for an audio file")
     parser.add_argument("-v", "--verbose", dest="verbose", action="count", help="increase verbosity level", default=0)
     parser.add_argument("-m", "--model_dir", dest="modelDir", default="./models", help="input directory for models data [%(default)s]")
+    parser.add_argument("--cache_dir", dest="cacheDir", help="folder of the persistent features cache [Configuration.cacheDir]")
     parser.add_argument("-c", "--csv_ouput", dest="csvOutput", action="store_true", help="CSV table output [default]")
     parser.add_argument("-j", "--json_ouput", dest="jsonOutput", action="store_true", help="JSON format output")
     parser.add_argument("-e", "--edge_node", dest="edgeNodeUrl", help="URL for edge node server. JSON output will be posted to this URL")
+    parser.add_argument("--spool_dir", dest="spoolDir", help="folder keeping JSON data until it is posted to the edge node server [temporary folder]")
     parser.add_argument("-n", "--component_name", dest="componentName", help="Name of the component within the edge server (required if -j or -e are used)")
+    parser.add_argument("-s", "--seg_len", dest="segLen", type=float, help="segment length in seconds [Configuration.segLen]")
+    parser.add_argument("-p", "--hop", dest="hop", type=float, help="distance between segments in seconds [segment length]")
+    parser.add_argument("--silence_db", dest="silenceDb", type=float, help="skip scoring of frames below this energy in dB relative to full scale [Configuration.silenceDb]")
+    parser.add_argument("--drop_silent", dest="dropSilent", action="store_true", help="do not write or post the skipped silent segments")
+    parser.add_argument("--index", dest="indexDir", help="also append the segment scores to the score index in this folder (see scoreindex.py)")
     
-    parser.add_argument("audio_file", help="audio file for classification")
+    parser.add_argument("-b", "--batch", dest="batch", help="classify all the audio files in a list file or a folder")
+    parser.add_argument("-w", "--workers", dest="workers", type=int, default=os.cpu_count(), help="number of batch worker processes [%(default)s]")
+    parser.add_argument("-o", "--output_dir", dest="outputDir", help="write batch results to a file per audio file in this folder [merged to stdout]")
+    parser.add_argument("--stream", dest="stream", action="store_true", help="classify raw 16 bit PCM audio at the working sample rate from the standard input")
+    parser.add_argument("--socket", dest="socketPath", help="classify raw 16 bit PCM audio from a connection to this local socket")
+    parser.add_argument("--chunk", dest="chunk", type=float, default=0.1, help="stream read size in seconds [%(default)s]")
+    parser.add_argument("--stats_every", dest="statsEvery", type=int, default=100, help="log stream metrics every N segments [%(default)s]")
+    parser.add_argument("--stats", dest="stats", action="store_true", help="print processing timers and counters to the standard error at the end")
+    parser.add_argument("--stats_period", dest="statsPeriod", type=float, help="also print the timers and counters every N seconds")
+
+    parser.add_argument("audio_file", nargs="?", help="audio file for classification")
     args = parser.parse_args()
+    if not args.audio_file and not args.batch and not args.stream and not args.socketPath:
+        parser.error("audio_file, --batch, --stream or --socket is required")
     if args.verbose==1:
         logging.basicConfig(level=logging.INFO)
     if args.verbose>1:
         logging.basicConfig(level=logging.DEBUG)
     cfg=Configuration
+    if args.cacheDir:
+        cfg.cacheDir=args.cacheDir
+    if args.silenceDb is not None:
+        cfg.silenceDb=args.silenceDb
     if (not args.csvOutput) and (not args.jsonOutput) and (not args.edgeNodeUrl):
         args.csvOutput=True 
     if (args.jsonOutput or args.edgeNodeUrl) and not args.componentName:
@@ -107,33 +365,65 @@ def main(argv):
     cls=AudioClassifier.AudioClassifier(cfg)
     # load GMMs
     cls.loadModels(args.modelDir)
+    # segment scores store
+    args.scoreIndex=None
+    if args.indexDir:
+        try:
+            args.scoreIndex=scoreindex.ScoreIndex(args.indexDir, cls.labels)
+        except ValueError as e:
+            logging.critical("Bad score index: {}\n".format(e))
+            return 1
+    # results are posted to the server in the background
+    pub=None
+    if args.edgeNodeUrl:
+        pub=publisher.EdgeNodePublisher(args.edgeNodeUrl, args.spoolDir, metrics=cls.stats)
+    dumper=None
+    if args.statsPeriod:
+        dumper=stats.StatsDumper(cls.stats, args.statsPeriod)
+    try:
+        rc=classifyAll(args, cls, pub)
+    finally:
+        if dumper:
+            dumper.close()
+        if args.scoreIndex:
+            args.scoreIndex.close()
+        if pub:
+            if pub.close():
+                # results were lost
+                rc=1
+            logging.info("publisher: {}".format(pub.stats()))
+            for k in ("sent", "errors", "spooled", "dropped"):
+                cls.stats.count("post_"+k, pub.counters[k])
+        if args.stats or args.statsPeriod:
+            sys.stderr.write(cls.stats.dump())
+    return rc
+
+def classifyAll(args, cls, pub):
+    '''
+    Classify the input selected by the command line
+    :param args: command line arguments
+    :param cls: classifier with loaded models
+    :param pub: EdgeNode publisher or None
+    :returns: exit code
+    '''
+    if args.batch:
+        return batch(args, cls.labels, pub, cls.stats, cls.cfg)
 
     # print CSV header
     if args.csvOutput:
-        print("t1,t2", end="")
-        for lbl in cls.labels:
-            print(",{}".format(lbl), end="")
-        print()
+        print(csvHeader(cls.labels), flush=True)
+    if args.stream or args.socketPath:
+        return classifyStream(args, cls, pub)
     
     # Sample start time from the file creation time
-    if args.jsonOutput or args.edgeNodeUrl:
-        sampleTime=os.path.getmtime(args.audio_file)
-        sampleDateTime=datetime.datetime.fromtimestamp(sampleTime)
+    sampleTime=os.path.getmtime(args.audio_file)
+    sampleDateTime=datetime.datetime.fromtimestamp(sampleTime)
+    args.indexName=args.audio_file
 
     # iterate over segments
-    for p in cls.predFile(args.audio_file):
-        if args.csvOutput:
-            print("{0[t1]},{0[t2]}".format(p), end="")
-            for lbl in cls.labels:
-                print(",{}".format(logsig(p[lbl])), end="")
-            print()
-        if args.jsonOutput or args.edgeNodeUrl:
-            jsonData=pred2json(args.componentName, p, sampleDateTime)
-            if args.jsonOutput:
-                print(jsonData)
-            if args.edgeNodeUrl:
-                if not postJson(args.edgeNodeUrl, jsonData):
-                    return 1
+    for p in cls.predFile(args.audio_file, args.segLen, args.hop):
+        with cls.stats.timer("output"):
+            output(args, cls.labels, [p], sampleDateTime, pub)
     return 0
         
 if __name__ == "__main__":
@@ -0,0 +1,472 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+# SMART FP7 - Search engine for MultimediA enviRonment generated contenT
+# Webpage: http://smartfp7.eu
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# The Original Code is Copyright (C) 2013 IBM Corp.
+# All Rights Reserved
+#
+# Contributor(s):
+#  Zvi Kons <zvi@il.ibm.com>
+
+'''
+smart.audio.embed - UBM supervector embeddings and similar sounds search CLI.
+'''
+
+import sys
+
+from smart.audio import AudioClassifier, Configuration, classify, gmm, scoreindex, utils
+import argparse
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import os.path
+import tempfile
+import time
+import numpy as np
+
+EMBED_VERSION=1
+META_NAME="embed.json"
+VECTORS_NAME="vectors.f32"
+SEGMENTS_DIR="segments"
+IVF_NAME="ivf.json"
+
+
+def loadUbm(modelDir, cfg):
+    '''
+    Load the UBM from the bundle file or from ubm.gmm
+    :param modelDir: models folder
+    :param cfg: configuration
+    :returns: tuple with weights, means and variances
+    '''
+    bundleFile=os.path.join(modelDir, gmm.BUNDLE_NAME)
+    if os.path.exists(bundleFile):
+        (gmms, labels)=gmm.GmmSet.loadBundle(bundleFile, cfg)
+        u=gmms.index["ubm"]
+        return tuple(np.array(m[u], dtype=np.float64) for m in (gmms.w, gmms.mu, gmms.var))
+    return gmm.loadGmm(os.path.join(modelDir, "ubm.gmm"), cfg.nGauss, cfg.ftrLen)
+
+def normalize(x):
+    '''
+    L2 normalization of the rows
+    :param x: array (rows x dim)
+    :returns: float32 array
+    '''
+    x=np.asarray(x, dtype=np.float32)
+    return x/np.maximum(np.linalg.norm(x, axis=1, keepdims=True), 1e-12)
+
+
+class SupervectorExtractor:
+    '''
+    Fixed length embedding of a segment from the UBM posterior statistics:
+    the MAP adapted means of the segment relative to the UBM means, scaled
+    by the UBM standard deviations and weights (the KL divergence
+    supervector) and L2 normalized, so the inner product is a cosine similarity.
+    '''
+
+    def __init__(self, ubm, relevance):
+        '''
+        :param ubm: tuple with UBM weights, means and variances
+        :param relevance: MAP relevance factor
+        '''
+        (w, self.mu, var)=ubm
+        self.ubm=gmm.GmmSet(["ubm"], [ubm])
+        self.relevance=relevance
+        self.scale=np.sqrt(w)[:, None]/np.sqrt(var)
+        self.dim=self.mu.size
+
+    def vectors(self, ftr, ranges, active=None):
+        '''
+        Embeddings of segments of a file
+        :param ftr: features array (frames x ftrLen)
+        :param ranges: list of (first frame, frame after the last)
+        :param active: optional boolean array of the frames to use
+        :returns: float32 array (segments x dim)
+        '''
+        x=np.asarray(ftr, dtype=np.float64)
+        post=self.ubm.posteriors(x)
+        if active is not None:
+            post[~active]=0.0
+        out=np.empty((len(ranges), self.dim), dtype=np.float32)
+        for (i, (f1, f2)) in enumerate(ranges):
+            p=post[f1:f2]
+            n=p.sum(axis=0)
+            f=np.dot(p.T, x[f1:f2])
+            # MAP adapted means minus the UBM means
+            d=(f-n[:, None]*self.mu)/(n+self.relevance)[:, None]
+            out[i]=(self.scale*d).reshape(-1)
+        return normalize(out)
+
+
+class EmbeddingStore:
+    '''
+    Folder with the embeddings of archive segments: an append-only float32
+    matrix (segments x dim) which is memory mapped for the searches, and the
+    file and time range of each segment in a score index without labels.
+    An optional coarse index (IVF) clusters the vectors with spherical
+    k-means; a search then scans only the clusters closest to each query.
+    '''
+
+    def __init__(self, path, info=None):
+        '''
+        :param path: store folder
+        :param info: dict with "dim" and the extraction settings, required to create a new store
+        '''
+        self.path=path
+        metaFile=os.path.join(path, META_NAME)
+        if os.path.exists(metaFile):
+            with open(metaFile, "rt") as fin:
+                self.meta=json.load(fin)
+            if info is not None and any(self.meta.get(k)!=v for (k, v) in info.items()):
+                raise ValueError("{}: embedding settings {} do not match {}".format(path, info, self.meta))
+        else:
+            if info is None:
+                raise ValueError("{}: not an embedding store".format(path))
+            if not os.path.exists(path):
+                os.makedirs(path)
+            self.meta=dict(info, version=EMBED_VERSION)
+            with open(metaFile, "wt") as fout:
+                json.dump(self.meta, fout, indent=2)
+        if self.meta["version"]!=EMBED_VERSION:
+            raise ValueError("{}: unsupported version {}".format(path, self.meta["version"]))
+        self.dim=self.meta["dim"]
+        self.segments=scoreindex.ScoreIndex(os.path.join(path, SEGMENTS_DIR), [])
+        self.fout=None
+        self.ivf=None
+        ivfFile=os.path.join(path, IVF_NAME)
+        if os.path.exists(ivfFile):
+            with open(ivfFile, "rt") as fin:
+                self.ivf=json.load(fin)
+
+    def append(self, fileName, segs, vectors):
+        '''
+        Append the embeddings of a file
+        :param fileName: audio file name
+        :param segs: list of (t1, t2) of the segments
+        :param vectors: array (segments x dim)
+        '''
+        if len(segs)==0:
+            return
+        if self.fout is None:
+            self.fout=open(os.path.join(self.path, VECTORS_NAME), "ab")
+            # drop the vectors of an interrupted append (without segments)
+            self.fout.truncate(self.nRows()*self.dim*4)
+        # the segments are written last: the rows are counted by the segments
+        self.fout.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        self.fout.flush()
+        self.segments.append(fileName, [{"t1": t1, "t2": t2} for (t1, t2) in segs])
+
+    def close(self):
+        '''Close the output files'''
+        if self.fout is not None:
+            self.fout.close()
+            self.fout=None
+        self.segments.close()
+
+    def nRows(self):
+        '''Number of complete segments'''
+        return self.segments.nRows()
+
+    def matrix(self, n=None):
+        '''
+        Memory mapped embeddings
+        :param n: number of rows (default: all complete rows)
+        :returns: float32 array (rows x dim)
+        '''
+        n=self.nRows() if n is None else n
+        if n==0:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.memmap(os.path.join(self.path, VECTORS_NAME), dtype=np.float32, mode="r", shape=(n, self.dim))
+
+    def records(self, rows):
+        '''
+        Segments of rows
+        :param rows: array of rows
+        :returns: list of dicts with file, t1 and t2
+        '''
+        return self.segments.records(rows)
+
+    def search(self, queries, k=10, nprobe=None, blockLen=65536):
+        '''
+        Batched nearest neighbours search by cosine similarity
+        :param queries: array of query embeddings (queries x dim)
+        :param k: number of neighbours of each query
+        :param nprobe: number of IVF clusters scanned for each query
+                       (None or no IVF index for the exact search)
+        :param blockLen: number of rows compared at once in the exact search
+        :returns: tuple with arrays of rows and similarities (queries x k) by
+                  decreasing similarity (rows are -1 when fewer were found)
+        '''
+        q=normalize(np.atleast_2d(queries))
+        n=self.nRows()
+        best=(np.full((len(q), k), -1, dtype=np.int64), np.full((len(q), k), -np.inf, dtype=np.float32))
+        first=0
+        if nprobe and self.ivf:
+            best=self.searchIvf(q, k, nprobe, best)
+            first=self.ivf["indexed"]
+        # exact search of the rows which are not in the IVF index
+        m=self.matrix(n)
+        for i in range(first, n, blockLen):
+            s=np.dot(q, np.asarray(m[i:i+blockLen]).T)
+            best=mergeTop(best, np.broadcast_to(np.arange(i, i+s.shape[1]), s.shape), s, k)
+        order=np.argsort(-best[1], axis=1, kind="stable")
+        return (np.take_along_axis(best[0], order, 1), np.take_along_axis(best[1], order, 1))
+
+    def searchIvf(self, q, k, nprobe, best):
+        '''
+        Search the clusters of the IVF index closest to each query. The
+        queries probing a cluster are compared with its rows together.
+        :param q: normalized queries (queries x dim)
+        :param k: number of neighbours of each query
+        :param nprobe: number of clusters scanned for each query
+        :param best: tuple with current rows and similarities
+        :returns: updated best tuple
+        '''
+        (centroids, order, offsets)=self.loadIvf()
+        nprobe=min(nprobe, len(centroids))
+        c=np.dot(q, centroids.T)
+        probe=np.argpartition(-c, nprobe-1, axis=1)[:, :nprobe]
+        m=self.matrix(self.ivf["indexed"])
+        for l in np.unique(probe):
+            qs=np.nonzero(np.any(probe==l, axis=1))[0]
+            rows=np.asarray(order[offsets[l]:offsets[l+1]])
+            if len(rows)==0:
+                continue
+            s=np.dot(q[qs], np.asarray(m[rows]).T)
+            sub=mergeTop((best[0][qs], best[1][qs]), np.broadcast_to(rows, s.shape), s, k)
+            best[0][qs]=sub[0]
+            best[1][qs]=sub[1]
+        return best
+
+    def loadIvf(self):
+        '''
+        Memory map the IVF index
+        :returns: tuple with centroids (clusters x dim), rows ordered by
+                  cluster and the offset of each cluster in the rows
+        '''
+        nLists=self.ivf["nLists"]
+        centroids=np.fromfile(os.path.join(self.path, "ivf.centroids.f32"), dtype=np.float32).reshape(nLists, self.dim)
+        offsets=np.fromfile(os.path.join(self.path, "ivf.offsets"), dtype=np.int64)
+        n=self.ivf["indexed"]
+        order=np.memmap(os.path.join(self.path, "ivf.order"), dtype=np.int64, mode="r", shape=(n,)) if n>0 else np.zeros(0, dtype=np.int64)
+        return (centroids, order, offsets)
+
+    def buildIvf(self, nLists, iters=10, sampleLen=100000, blockLen=65536, seed=0):
+        '''
+        Build the IVF index of all the rows with spherical k-means on a sample
+        :param nLists: number of clusters
+        :param iters: number of k-means iterations
+        :param sampleLen: number of rows used to train the centroids
+        :param blockLen: number of rows assigned at once
+        :param seed: random seed
+        '''
+        t0=time.time()
+        n=self.nRows()
+        if n==0:
+            logging.warning("buildIvf: the store is empty, no index was built")
+            return
+        m=self.matrix(n)
+        rng=np.random.default_rng(seed)
+        nLists=max(min(nLists, n), 1)
+        x=np.asarray(m[np.sort(rng.choice(n, min(sampleLen, n), replace=False))])
+        centroids=x[rng.choice(len(x), nLists, replace=False)]
+        for it in range(iters):
+            assign=np.argmax(np.dot(x, centroids.T), axis=1)
+            sums=np.zeros_like(centroids)
+            np.add.at(sums, assign, x)
+            counts=np.bincount(assign, minlength=nLists)
+            # empty clusters are moved to random rows
+            empty=np.nonzero(counts==0)[0]
+            sums[empty]=x[rng.choice(len(x), len(empty))]
+            centroids=normalize(sums)
+        assign=np.concatenate([np.argmax(np.dot(np.asarray(m[i:i+blockLen]), centroids.T), axis=1)
+                               for i in range(0, n, blockLen)]) if n>0 else np.zeros(0, dtype=np.int64)
+        order=np.argsort(assign, kind="stable").astype(np.int64)
+        offsets=np.zeros(nLists+1, dtype=np.int64)
+        np.cumsum(np.bincount(assign, minlength=nLists), out=offsets[1:])
+        self.writeArray("ivf.centroids.f32", centroids.astype(np.float32))
+        self.writeArray("ivf.order", order)
+        self.writeArray("ivf.offsets", offsets)
+        self.ivf={"nLists": nLists, "indexed": n}
+        (fd, tmpName)=tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        with os.fdopen(fd, "wt") as fout:
+            json.dump(self.ivf, fout)
+        os.replace(tmpName, os.path.join(self.path, IVF_NAME))
+        logging.info("buildIvf: {} rows, {} clusters in {:.2f} sec".format(n, nLists, time.time()-t0))
+
+    def writeArray(self, name, x):
+        '''Write an array file of the store atomically'''
+        (fd, tmpName)=tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        with os.fdopen(fd, "wb") as fout:
+            fout.write(np.ascontiguousarray(x).tobytes())
+        os.replace(tmpName, os.path.join(self.path, name))
+
+
+def mergeTop(best, rows, sims, k):
+    '''
+    Merge candidates into the best k of each query
+    :param best: tuple with rows and similarities (queries x k)
+    :param rows: candidate rows (queries x candidates)
+    :param sims: candidate similarities (queries x candidates)
+    :param k: number of kept candidates
+    :returns: tuple with rows and similarities (queries x k), not sorted
+    '''
+    allRows=np.concatenate([best[0], rows], axis=1)
+    allSims=np.concatenate([best[1], sims.astype(np.float32)], axis=1)
+    top=np.argpartition(-allSims, k-1, axis=1)[:, :k]
+    return (np.take_along_axis(allRows, top, 1), np.take_along_axis(allSims, top, 1))
+
+
+# classifier and extractor used by each worker process
+_cls=None
+_ext=None
+
+def initWorker(modelDir, cfgDict):
+    '''
+    Load the UBM once in each worker process
+    :param modelDir: models folder
+    :param cfgDict: configuration values
+    '''
+    global _cls, _ext
+    _cls=AudioClassifier.AudioClassifier(utils.configFromDict(cfgDict))
+    _ext=SupervectorExtractor(loadUbm(modelDir, _cls.cfg), _cls.cfg.mapRelevance)
+
+def embedFile(task):
+    '''
+    Embeddings of the segments of one file in a worker process. Segments
+    with too few non-silent frames are skipped.
+    :param task: tuple with audio file, segment length (None for the whole file) and hop
+    :returns: tuple with audio file, list of (t1, t2), embeddings array and
+              duration (sec), or None for the segments on errors
+    '''
+    (audioFile, segLen, hop)=task
+    try:
+        if _cls.cfg.silenceDb is None:
+            (ftr, dur)=_cls.fileFeatures(audioFile)
+            active=None
+        else:
+            (ftr, dur, energy)=_cls.fileFeatures(audioFile, True)
+            active=_cls.activeFrames(energy)
+        segs=list(_cls.segments(dur, segLen, hop)) if segLen!=0 else [(0.0, dur)]
+        ranges=[_cls.segFrames(t1, min(t2, dur), len(ftr)) for (t1, t2) in segs]
+        if active is not None:
+            keep=[i for (i, (f1, f2)) in enumerate(ranges)
+                  if np.count_nonzero(active[f1:f2])>=max(_cls.cfg.silenceMinActive*(f2-f1), 1)]
+            segs=[segs[i] for i in keep]
+            ranges=[ranges[i] for i in keep]
+        return (audioFile, segs, _ext.vectors(ftr, ranges, active), dur)
+    except Exception as e:
+        logging.error("ERROR: Failed to embed {}\n{}\n".format(audioFile, e))
+        return (audioFile, None, None, 0.0)
+
+def benchmark(store, nQueries, k, nprobes, seed=0):
+    '''
+    Recall and latency of the IVF search relative to the exact search for
+    queries sampled from the stored embeddings
+    :param store: EmbeddingStore
+    :param nQueries: number of queries
+    :param k: number of neighbours
+    :param nprobes: list of numbers of scanned clusters
+    :returns: list of dicts with search method, nprobe, recall@k and latency per query (ms)
+    '''
+    rng=np.random.default_rng(seed)
+    n=store.nRows()
+    q=np.asarray(store.matrix(n)[np.sort(rng.choice(n, min(nQueries, n), replace=False))])
+    t0=time.perf_counter()
+    (exact, sims)=store.search(q, k)
+    res=[{"search": "exact", "nprobe": None, "recall": 1.0, "ms": 1000*(time.perf_counter()-t0)/len(q)}]
+    for nprobe in nprobes:
+        t0=time.perf_counter()
+        (rows, sims)=store.search(q, k, nprobe)
+        dt=time.perf_counter()-t0
+        hits=sum(len(np.intersect1d(a[a>=0], b[b>=0])) for (a, b) in zip(rows, exact))
+        res.append({"search": "ivf", "nprobe": nprobe, "recall": float(hits/max(np.count_nonzero(exact>=0), 1)), "ms": 1000*dt/len(q)})
+    return res
+
+def main(argv):
+    '''Command line embeddings extraction and similar sounds search.'''
+
+    parser = argparse.ArgumentParser(description="UBM supervector embeddings of archive segments and search of similar sounds")
+    parser.add_argument("-v", "--verbose", dest="verbose", action="count", help="increase verbosity level", default=0)
+    parser.add_argument("-m", "--model_dir", dest="modelDir", default="./models", help="input directory for models data (the UBM is used) [%(default)s]")
+    parser.add_argument("--cache_dir", dest="cacheDir", help="folder of the persistent features cache [Configuration.cacheDir]")
+    parser.add_argument("-a", "--add", dest="add", help="add the segments of the audio files in a list file or a folder to the store")
+    parser.add_argument("-s", "--seg_len", dest="segLen", type=float, help="segment length in seconds [Configuration.segLen]")
+    parser.add_argument("-p", "--hop", dest="hop", type=float, help="distance between segments in seconds [segment length]")
+    parser.add_argument("--silence_db", dest="silenceDb", type=float, help="skip segments of frames below this energy in dB relative to full scale [Configuration.silenceDb]")
+    parser.add_argument("-w", "--workers", dest="workers", type=int, default=os.cpu_count(), help="number of worker processes [%(default)s]")
+    parser.add_argument("-i", "--ivf", dest="nLists", type=int, help="build the IVF index with this number of clusters")
+    parser.add_argument("-q", "--query", dest="query", help="audio clip to search for")
+    parser.add_argument("-k", "--neighbours", dest="k", type=int, default=10, help="number of similar segments [%(default)s]")
+    parser.add_argument("-n", "--nprobe", dest="nprobe", type=int, help="number of IVF clusters scanned for each query [exact search]")
+    parser.add_argument("-B", "--bench", dest="bench", type=int, help="benchmark the recall and latency of the IVF search with this number of queries from the store")
+    parser.add_argument("--nprobes", dest="nprobes", default="1,2,4,8,16", help="comma separated nprobe values of the benchmark [%(default)s]")
+    parser.add_argument("store", help="embeddings store folder")
+    args = parser.parse_args()
+    if args.verbose==1:
+        logging.basicConfig(level=logging.INFO)
+    if args.verbose>1:
+        logging.basicConfig(level=logging.DEBUG)
+    cfg=Configuration
+    if args.cacheDir:
+        cfg.cacheDir=args.cacheDir
+    if args.silenceDb is not None:
+        cfg.silenceDb=args.silenceDb
+    # the embeddings are comparable only for the same UBM and features
+    ubm=loadUbm(args.modelDir, cfg)
+    info={"dim": ubm[1].size, "fingerprint": gmm.configFingerprint(cfg), "relevance": cfg.mapRelevance,
+          "ubm": hashlib.sha1(b"".join(np.asarray(m, dtype=np.float64).tobytes() for m in ubm)).hexdigest()}
+    try:
+        store=EmbeddingStore(args.store, info)
+    except ValueError as e:
+        logging.critical("Bad embedding store: {}\n".format(e))
+        return 1
+    rc=0
+    if args.add:
+        files=classify.listAudioFiles(args.add)
+        tasks=[(f, args.segLen, args.hop) for f in files]
+        t0=time.time()
+        totalDur=0.0
+        nSegs=0
+        with multiprocessing.Pool(args.workers, initWorker, (args.modelDir, utils.configDict(cfg))) as pool:
+            for (audioFile, segs, vectors, dur) in pool.imap(embedFile, tasks):
+                if segs is None:
+                    rc=1
+                    continue
+                store.append(audioFile, segs, vectors)
+                totalDur+=dur
+                nSegs+=len(segs)
+        store.close()
+        print("Embedded {} segments of {} files, {:.1f} sec audio in {:.1f} sec".format(nSegs, len(files), totalDur, time.time()-t0), file=sys.stderr)
+    if args.nLists:
+        store.buildIvf(args.nLists)
+    if args.query:
+        initWorker(args.modelDir, utils.configDict(cfg))
+        (audioFile, segs, vectors, dur)=embedFile((args.query, 0, None))
+        if segs is None:
+            return 1
+        if len(segs)==0:
+            logging.critical("The query clip is silent\n")
+            return 1
+        t0=time.perf_counter()
+        (rows, sims)=store.search(vectors, args.k, args.nprobe)
+        dt=time.perf_counter()-t0
+        print("file,t1,t2,similarity")
+        for (r, s) in zip(store.records(rows[0][rows[0]>=0]), sims[0]):
+            print("{},{},{},{:.4f}".format(r["file"], r["t1"], r["t2"], s))
+        print("{} segments searched in {:.2f} ms".format(store.nRows(), 1000*dt), file=sys.stderr)
+    if args.bench:
+        print("search  nprobe  recall@{}  ms/query".format(args.k))
+        for r in benchmark(store, args.bench, args.k, [int(x) for x in args.nprobes.split(",")]):
+            print("{:6}  {:>6}  {:9.3f}  {:8.3f}".format(r["search"], r["nprobe"] or "-", r["recall"], r["ms"]))
+    return rc
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
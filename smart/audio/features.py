@@ -0,0 +1,193 @@
+'''
+smart.audio.features - In-process MFCC feature extraction.
+'''
+
+# SMART FP7 - Search engine for MultimediA enviRonment generated contenT
+# Webpage: http://smartfp7.eu
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# The Original Code is Copyright (C) 2013 IBM Corp.
+# All Rights Reserved
+#
+# Contributor(s):
+#  Zvi Kons <zvi@il.ibm.com>
+
+# The functions below follow the SPTK tools used by the original chain
+# (frame, mfcc and delta with their default options) so that the features
+# can be used with models trained by the SPTK backend.
+
+import numpy as np
+from smart.audio.stats import Stats
+
+# SPTK mfcc defaults
+PRE_EMPHASIS=0.97
+LIFTER=22
+N_CHANNELS=20
+FB_FLOOR=1.0
+MEL=1127.01048
+
+# Delta windows as passed to the SPTK delta tool
+DELTA_WINDOWS=((-0.5, 0.0, 0.5), (1.0, -2.0, 1.0))
+
+# Amplitude of a full scale 16 bit signal and floor of the frame energy (dB)
+FULL_SCALE=32768.0
+ENERGY_FLOOR=-120.0
+
+
+def nFrames(nSamples, winLen, frmLen):
+    '''
+    Number of frames produced by SPTK frame for a signal
+    :param nSamples: number of samples
+    :param winLen: window length in samples
+    :param frmLen: distance between frames in samples
+    :returns: number of frames
+    '''
+    if nSamples<=0:
+        return 0
+    half=winLen//2
+    if nSamples<=half:
+        return 1
+    return 1+(nSamples-half+frmLen-1)//frmLen
+
+def frames(x, winLen, frmLen, first=0, last=None):
+    '''
+    Cut a signal into overlapping frames. The first frame is centered on the
+    first sample and the signal is padded with zeros (SPTK frame default).
+    :param x: input signal (1D array)
+    :param winLen: window length in samples
+    :param frmLen: distance between frames in samples
+    :param first: index of first frame to return
+    :param last: index after the last frame to return (default: all frames)
+    :returns: 2D array (frames x winLen)
+    '''
+    if last is None:
+        last=nFrames(len(x), winLen, frmLen)
+    n=max(last-first, 0)
+    # copy only the samples needed for the requested frames
+    s1=first*frmLen-winLen//2
+    s2=s1+(n-1)*frmLen+winLen if n>0 else s1
+    padded=np.zeros(max(s2-s1, 0), dtype=np.float64)
+    src=x[max(s1, 0):max(min(s2, len(x)), 0)]
+    padded[max(-s1, 0):max(-s1, 0)+len(src)]=src
+    shape=(n, winLen)
+    strides=(padded.strides[0]*frmLen, padded.strides[0])
+    return np.lib.stride_tricks.as_strided(padded, shape=shape, strides=strides, writeable=False)
+
+def fftLen(winLen):
+    '''
+    FFT length used by SPTK mfcc: smallest power of 2 not less than winLen
+    '''
+    n=1
+    while n<winLen:
+        n*=2
+    return n
+
+def melFilterBank(flng, nChannels, fs):
+    '''
+    Build the mel filter bank matrix of SPTK mfcc.
+    :param flng: FFT length
+    :param nChannels: number of filter bank channels
+    :param fs: sampling frequency (Hz)
+    :returns: matrix (flng/2 x nChannels) applied to the amplitude spectrum
+    '''
+    no=flng//2
+    maxMel=MEL*np.log(fs/2.0/700.0+1.0)
+    countMel=(np.arange(nChannels+1)+1.0)/(nChannels+1)*maxMel
+    k=np.arange(1, no)
+    kMel=MEL*np.log(k/no*(fs/2.0)/700.0+1.0)
+    # index of the first channel center above each bin
+    chanNum=np.searchsorted(countMel, kMel, side="left")
+    w=(countMel[np.minimum(chanNum, nChannels)]-kMel)/countMel[0]
+    fb=np.zeros((no, nChannels+2))
+    fb[k, chanNum]+=np.where(chanNum>0, w, 0.0)
+    fb[k, chanNum+1]+=1.0-w
+    return fb[:, 1:nChannels+1]
+
+def mfcc(frm, nMfcc, fs):
+    '''
+    Calculate MFCC for each frame (SPTK mfcc without c0 and energy)
+    :param frm: 2D array of frames
+    :param nMfcc: number of cepstral coefficients
+    :param fs: sampling frequency (Hz) used by the mel filter bank
+    :returns: 2D array (frames x nMfcc)
+    '''
+    winLen=frm.shape[1]
+    flng=fftLen(winLen)
+    # pre-emphasis inside each frame
+    px=np.empty(frm.shape)
+    px[:, 0]=frm[:, 0]*(1.0-PRE_EMPHASIS)
+    px[:, 1:]=frm[:, 1:]-PRE_EMPHASIS*frm[:, :-1]
+    # hamming window
+    px*=0.54-0.46*np.cos(np.arange(winLen)*(2*np.pi/(winLen-1)))
+    # amplitude spectrum
+    sp=np.abs(np.fft.rfft(px, flng))[:, :flng//2]
+    # log filter bank outputs
+    fb=np.dot(sp, melFilterBank(flng, N_CHANNELS, fs))
+    np.maximum(fb, FB_FLOOR, out=fb)
+    np.log(fb, out=fb)
+    # DCT and liftering of c1..cm
+    k=np.arange(1, nMfcc+1)
+    j=np.arange(N_CHANNELS)+0.5
+    dct=np.sqrt(2.0/N_CHANNELS)*np.cos(np.pi*np.outer(j, k)/N_CHANNELS)
+    lift=1.0+LIFTER/2.0*np.sin(np.pi*k/LIFTER)
+    return np.dot(fb, dct*lift)
+
+def frameEnergy(frm):
+    '''
+    Energy of each frame
+    :param frm: 2D array of frames (16 bit scale)
+    :returns: 1D array with the mean power of each frame in dB relative to full scale
+    '''
+    p=np.einsum("ij,ij->i", frm, frm)/(frm.shape[1]*FULL_SCALE**2)
+    return 10.0*np.log10(np.maximum(p, 10.0**(ENERGY_FLOOR/10.0)))
+
+def delta(c, windows=DELTA_WINDOWS):
+    '''
+    Append dynamic features. Frames outside the range are replaced by the
+    nearest frame.
+    :param c: 2D array of static features (frames x dim)
+    :param windows: list of delta windows with odd length
+    :returns: 2D array (frames x dim*(1+len(windows)))
+    '''
+    out=[c]
+    nf=len(c)
+    for win in windows:
+        w=len(win)//2
+        idx=np.arange(nf)
+        d=np.zeros(c.shape)
+        for j, coef in enumerate(win):
+            if coef!=0:
+                d+=coef*c[np.clip(idx+j-w, 0, nf-1)]
+        out.append(d)
+    return np.hstack(out)
+
+def extract(x, cfg, blockLen=4096, stats=None, energy=None):
+    '''
+    Convert audio samples to MFCC with delta and delta^2.
+    :param x: audio samples (16 bit scale)
+    :param cfg: configuration
+    :param blockLen: number of frames processed at once
+    :param stats: optional Stats object timing the framing, mfcc and deltas stages
+    :param energy: optional array (frames) filled with the energy of each frame (dB)
+    :returns: float32 array (frames x cfg.ftrLen)
+    '''
+    if stats is None:
+        stats=Stats()
+    n=nFrames(len(x), cfg.winLen, cfg.frmLen)
+    # SPTK tools exchange float data so round before the deltas
+    c=np.zeros((n, cfg.nMfcc), dtype=np.float32)
+    for i in range(0, n, blockLen):
+        with stats.timer("framing"):
+            frm=frames(x, cfg.winLen, cfg.frmLen, i, min(i+blockLen, n))
+        if energy is not None:
+            with stats.timer("energy"):
+                energy[i:i+len(frm)]=frameEnergy(frm)
+        with stats.timer("mfcc"):
+            c[i:i+len(frm)]=mfcc(frm, cfg.nMfcc, cfg.mfccFs)
+    with stats.timer("deltas"):
+        res=delta(c.astype(np.float64)).astype(np.float32)
+    stats.count("frames", n)
+    return res
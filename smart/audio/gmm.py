@@ -0,0 +1,600 @@
+'''
+smart.audio.gmm - GMM models in SPTK format and batched scoring.
+'''
+
+# SMART FP7 - Search engine for MultimediA enviRonment generated contenT
+# Webpage: http://smartfp7.eu
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# The Original Code is Copyright (C) 2013 IBM Corp.
+# All Rights Reserved
+#
+# Contributor(s):
+#  Zvi Kons <zvi@il.ibm.com>
+
+import os
+import os.path
+import hashlib
+import json
+import struct
+import tempfile
+import numpy as np
+
+# Model bundle file format: magic, header length (uint64), JSON header and
+# the arrays, each starting at a multiple of BUNDLE_ALIGN bytes
+BUNDLE_NAME="models.bundle"
+BUNDLE_MAGIC=b"SMARTGMM"
+BUNDLE_VERSION=1
+BUNDLE_ALIGN=64
+# Sufficient statistics of the training data kept with the models
+STATS_NAME="stats.npz"
+# Configuration values the models depend on
+MODEL_KEYS=("samplerate", "winLen", "frmLen", "nMfcc", "mfccFs", "ftrLen", "nGauss")
+# Configuration values recorded for information only
+INFO_KEYS=("segLen", "segHop", "backend")
+
+
+def loadGmm(fileName, nGauss, ftrLen):
+    '''
+    Load a diagonal covariance GMM written by SPTK gmm.
+    The file contains the weights followed by the mean and variance
+    vectors of each Gaussian (float32).
+    :param fileName: model file
+    :param nGauss: number of Gaussians
+    :param ftrLen: length of the feature vector
+    :returns: tuple with weights (nGauss), means and variances (nGauss x ftrLen)
+    '''
+    data=np.fromfile(fileName, dtype=np.float32)
+    if len(data)!=nGauss*(1+2*ftrLen):
+        raise ValueError("{}: expected {} values, found {}".format(fileName, nGauss*(1+2*ftrLen), len(data)))
+    w=data[:nGauss]
+    mv=data[nGauss:].reshape(nGauss, 2, ftrLen)
+    return (w.copy(), mv[:, 0].copy(), mv[:, 1].copy())
+
+def saveGmm(fileName, w, mu, var):
+    '''
+    Save a diagonal covariance GMM in SPTK format
+    :param fileName: model file
+    :param w: weights (nGauss)
+    :param mu: means (nGauss x ftrLen)
+    :param var: variances (nGauss x ftrLen)
+    '''
+    mv=np.stack([mu, var], axis=1)
+    data=np.concatenate([np.ravel(w), np.ravel(mv)]).astype(np.float32)
+    data.tofile(fileName)
+
+def configFingerprint(cfg):
+    '''
+    Fingerprint of the configuration values the models depend on
+    :param cfg: configuration
+    :returns: hex digest
+    '''
+    values=dict((k, getattr(cfg, k)) for k in MODEL_KEYS)
+    return hashlib.sha1(json.dumps(values, sort_keys=True).encode()).hexdigest()
+
+def _align(n):
+    '''Round up to a multiple of BUNDLE_ALIGN'''
+    return -(-n//BUNDLE_ALIGN)*BUNDLE_ALIGN
+
+def saveBundle(fileName, header, arrays):
+    '''
+    Write a bundle file. The file is replaced atomically.
+    :param fileName: output file
+    :param header: dict saved as the JSON header
+    :param arrays: dict of numpy arrays
+    '''
+    header=dict(header)
+    header["arrays"]={}
+    offset=0
+    for (name, x) in arrays.items():
+        header["arrays"][name]={"offset": offset, "shape": list(x.shape), "dtype": x.dtype.str}
+        offset=_align(offset+x.nbytes)
+    hdr=json.dumps(header).encode("utf-8")
+    start=_align(len(BUNDLE_MAGIC)+8+len(hdr))
+    (fd, tmpName)=tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(fileName)), suffix=".tmp")
+    with os.fdopen(fd, "wb") as fout:
+        fout.write(BUNDLE_MAGIC)
+        fout.write(struct.pack("<Q", len(hdr)))
+        fout.write(hdr)
+        for (name, x) in arrays.items():
+            fout.write(b"\0"*(start+header["arrays"][name]["offset"]-fout.tell()))
+            fout.write(np.ascontiguousarray(x).tobytes())
+    os.replace(tmpName, fileName)
+
+def loadBundle(fileName):
+    '''
+    Read a bundle file. The arrays are read only views of a memory
+    mapping of the file, so processes loading the same file share the data.
+    :param fileName: input file
+    :returns: tuple with header dict and dict of arrays
+    '''
+    with open(fileName, "rb") as fin:
+        if fin.read(len(BUNDLE_MAGIC))!=BUNDLE_MAGIC:
+            raise ValueError("{}: not a model bundle".format(fileName))
+        (n,)=struct.unpack("<Q", fin.read(8))
+        header=json.loads(fin.read(n).decode("utf-8"))
+    if header.get("version")!=BUNDLE_VERSION:
+        raise ValueError("{}: unsupported bundle version {}".format(fileName, header.get("version")))
+    start=_align(len(BUNDLE_MAGIC)+8+n)
+    buf=np.memmap(fileName, dtype=np.uint8, mode="r")
+    arrays={}
+    for (name, info) in header["arrays"].items():
+        dtype=np.dtype(info["dtype"])
+        size=int(np.prod(info["shape"]))*dtype.itemsize
+        o=start+info["offset"]
+        arrays[name]=buf[o:o+size].view(dtype).reshape(info["shape"])
+    return (header, arrays)
+
+def logSumExp(x, axis=-1):
+    '''
+    Calculate log(sum(exp(x))) along an axis
+    '''
+    m=np.max(x, axis=axis, keepdims=True)
+    m[~np.isfinite(m)]=0.0
+    return np.squeeze(m, axis=axis)+np.log(np.sum(np.exp(x-m), axis=axis))
+
+class SuffStats:
+    '''Zero, first and second order statistics of features for the components of a GMM'''
+
+    def __init__(self, nGauss, ftrLen):
+        '''
+        :param nGauss: number of Gaussians
+        :param ftrLen: length of the feature vector
+        '''
+        self.nFrames=0
+        self.n=np.zeros(nGauss)
+        self.f=np.zeros((nGauss, ftrLen))
+        self.s=np.zeros((nGauss, ftrLen))
+
+    def add(self, x, post):
+        '''
+        Accumulate statistics of frames
+        :param x: features array (frames x ftrLen)
+        :param post: components posteriors (frames x nGauss)
+        '''
+        self.nFrames+=len(x)
+        self.n+=np.sum(post, axis=0)
+        self.f+=np.dot(post.T, x)
+        self.s+=np.dot(post.T, x*x)
+
+    def merge(self, other):
+        '''
+        Add the statistics of other data
+        :param other: SuffStats
+        '''
+        self.nFrames+=other.nFrames
+        self.n+=other.n
+        self.f+=other.f
+        self.s+=other.s
+
+    def remove(self, other):
+        '''
+        Subtract the statistics of data which was added before
+        :param other: SuffStats
+        '''
+        self.nFrames-=other.nFrames
+        self.n-=other.n
+        self.f-=other.f
+        self.s-=other.s
+
+def mlEstimate(stats, prev, varFloor):
+    '''
+    Maximum likelihood estimate of a GMM from statistics (EM M-step)
+    :param stats: SuffStats (or any object with n, f and s)
+    :param prev: tuple with the previous weights, means and variances,
+                 kept for the components without data
+    :param varFloor: minimal variance
+    :returns: tuple with weights, means and variances
+    '''
+    (mu, var)=(np.array(prev[1], dtype=np.float64), np.array(prev[2], dtype=np.float64))
+    live=stats.n>1e-10
+    n=np.maximum(stats.n, 1e-10)
+    mu1=stats.f/n[:, None]
+    var1=np.maximum(stats.s/n[:, None]-mu1*mu1, varFloor)
+    mu[live]=mu1[live]
+    var[live]=np.broadcast_to(var1, var.shape)[live]
+    return (n/np.sum(n), mu, var)
+
+def saveStats(fileName, header, suff):
+    '''
+    Save the statistics of several models. The file is replaced atomically.
+    :param fileName: output file
+    :param header: dict saved with the statistics
+    :param suff: dict with SuffStats of each model
+    '''
+    header=dict(header)
+    header["names"]=sorted(suff)
+    arrays={"header": np.array(json.dumps(header))}
+    for (i, name) in enumerate(header["names"]):
+        st=suff[name]
+        arrays.update({"nFrames{}".format(i): np.array(st.nFrames), "n{}".format(i): st.n, "f{}".format(i): st.f, "s{}".format(i): st.s})
+    (fd, tmpName)=tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(fileName)), suffix=".tmp")
+    with os.fdopen(fd, "wb") as fout:
+        np.savez(fout, **arrays)
+    os.replace(tmpName, fileName)
+
+def loadStats(fileName):
+    '''
+    Load the statistics saved by saveStats
+    :param fileName: input file
+    :returns: tuple with header dict and dict with SuffStats of each model
+    '''
+    suff={}
+    with np.load(fileName) as data:
+        header=json.loads(str(data["header"]))
+        for (i, name) in enumerate(header["names"]):
+            st=SuffStats(*data["f{}".format(i)].shape)
+            st.nFrames=int(data["nFrames{}".format(i)])
+            (st.n, st.f, st.s)=(data["n{}".format(i)], data["f{}".format(i)], data["s{}".format(i)])
+            suff[name]=st
+    return (header, suff)
+
+class ReservoirSampler:
+    '''
+    Uniform random sample of a fixed number of frames from a stream of
+    features (reservoir sampling), so memory does not depend on the stream length.
+    '''
+
+    def __init__(self, size, ftrLen, seed=0):
+        '''
+        :param size: number of kept frames
+        :param ftrLen: length of the feature vector
+        :param seed: random seed
+        '''
+        self.x=np.zeros((size, ftrLen), dtype=np.float32)
+        self.n=0
+        self.seen=0
+        self.rng=np.random.default_rng(seed)
+
+    def add(self, ftr):
+        '''
+        Offer frames to the sample
+        :param ftr: features array (frames x ftrLen)
+        '''
+        size=len(self.x)
+        k=min(size-self.n, len(ftr))
+        self.x[self.n:self.n+k]=ftr[:k]
+        self.n+=k
+        rest=np.asarray(ftr[k:])
+        if len(rest)>0:
+            # frame i replaces a random kept frame with probability size/(i+1)
+            idx=self.seen+k+np.arange(len(rest))
+            j=self.rng.integers(0, idx+1)
+            keep=j<size
+            self.x[j[keep]]=rest[keep]
+        self.seen+=len(ftr)
+
+    def frames(self):
+        '''
+        :returns: sampled frames
+        '''
+        return self.x[:self.n]
+
+    def getState(self):
+        '''
+        :returns: dict of arrays for a checkpoint
+        '''
+        return {"x": self.x[:self.n], "seen": np.array(self.seen), "rng": np.array(json.dumps(self.rng.bit_generator.state))}
+
+    def setState(self, state):
+        '''
+        Restore a checkpoint
+        :param state: dict returned by getState
+        '''
+        self.n=len(state["x"])
+        self.x[:self.n]=state["x"]
+        self.seen=int(state["seen"])
+        self.rng.bit_generator.state=json.loads(str(state["rng"]))
+
+class StreamingEm:
+    '''
+    Mini-batch (stepwise) EM training of a diagonal GMM. Features are
+    consumed as they arrive and only one batch of frames is kept. After each
+    batch the running statistics are interpolated with the batch statistics
+    with step size (k+2)^-stepPower and the model is re-estimated.
+    '''
+
+    def __init__(self, nGauss, ftrLen, batchLen=20000, stepPower=0.6, initIter=10, seed=0):
+        '''
+        :param nGauss: number of Gaussians
+        :param ftrLen: length of the feature vector
+        :param batchLen: number of frames in each batch
+        :param stepPower: step size decay power (0.5, 1]
+        :param initIter: EM iterations on the first batch
+        :param seed: random seed
+        '''
+        self.nGauss=nGauss
+        self.ftrLen=ftrLen
+        self.batchLen=batchLen
+        self.stepPower=stepPower
+        self.initIter=initIter
+        self.rng=np.random.default_rng(seed)
+        self.nBatches=0
+        self.buf=[]
+        self.bufLen=0
+        (self.w, self.mu, self.var)=(None, None, None)
+        # running statistics per frame
+        (self.n, self.f, self.s)=(None, None, None)
+        self.varFloor=None
+
+    def add(self, ftr):
+        '''
+        Add frames and run an EM step for each complete batch
+        :param ftr: features array (frames x ftrLen)
+        '''
+        self.buf.append(np.asarray(ftr, dtype=np.float64))
+        self.bufLen+=len(ftr)
+        while self.bufLen>=self.batchLen:
+            x=np.concatenate(self.buf)
+            self.step(x[:self.batchLen])
+            self.buf=[x[self.batchLen:]]
+            self.bufLen=len(self.buf[0])
+
+    def flush(self):
+        '''Run an EM step on the remaining frames'''
+        if self.bufLen>=self.nGauss:
+            self.step(np.concatenate(self.buf))
+        self.buf=[]
+        self.bufLen=0
+
+    def batchStats(self, x):
+        '''
+        Statistics per frame of a batch for the current model
+        :param x: features array (frames x ftrLen)
+        :returns: tuple with zero, first and second order statistics
+        '''
+        post=GmmSet(["gmm"], [(self.w, self.mu, self.var)]).posteriors(x, "gmm")
+        return (np.mean(post, axis=0), np.dot(post.T, x)/len(x), np.dot(post.T, x*x)/len(x))
+
+    def mStep(self):
+        '''Re-estimate the model from the running statistics'''
+        (self.w, self.mu, self.var)=mlEstimate(self, (self.w, self.mu, self.var), self.varFloor)
+
+    def initMeans(self, x):
+        '''
+        Select spread out frames as the initial means (k-means++ seeding)
+        :param x: features array (frames x ftrLen)
+        :returns: array (nGauss x ftrLen)
+        '''
+        mu=np.empty((self.nGauss, self.ftrLen))
+        mu[0]=x[self.rng.integers(len(x))]
+        d=np.sum((x-mu[0])**2, axis=1)
+        for i in range(1, self.nGauss):
+            # pick a frame with probability proportional to its distance from the selected means
+            p=d/np.sum(d) if np.sum(d)>0 else None
+            mu[i]=x[self.rng.choice(len(x), p=p)]
+            d=np.minimum(d, np.sum((x-mu[i])**2, axis=1))
+        return mu
+
+    def step(self, x):
+        '''
+        EM step with a batch of frames
+        :param x: features array (frames x ftrLen)
+        '''
+        if self.w is None:
+            self.mu=self.initMeans(x)
+            v=np.var(x, axis=0)
+            self.varFloor=1e-3*v
+            self.var=np.tile(np.maximum(v, self.varFloor), (self.nGauss, 1))
+            self.w=np.full(self.nGauss, 1.0/self.nGauss)
+            for i in range(self.initIter):
+                (self.n, self.f, self.s)=self.batchStats(x)
+                self.mStep()
+        else:
+            eta=(self.nBatches+2)**-self.stepPower
+            (n, f, s)=self.batchStats(x)
+            self.n=(1-eta)*self.n+eta*n
+            self.f=(1-eta)*self.f+eta*f
+            self.s=(1-eta)*self.s+eta*s
+            self.mStep()
+        self.nBatches+=1
+
+    def model(self):
+        '''
+        :returns: tuple with weights, means and variances
+        '''
+        return (self.w, self.mu, self.var)
+
+    def getState(self):
+        '''
+        :returns: dict of arrays for a checkpoint
+        '''
+        state={"nBatches": np.array(self.nBatches), "rng": np.array(json.dumps(self.rng.bit_generator.state)),
+               "buf": np.concatenate(self.buf) if self.buf else np.zeros((0, self.ftrLen))}
+        if self.w is not None:
+            state.update({"w": self.w, "mu": self.mu, "var": self.var, "n": self.n, "f": self.f, "s": self.s, "varFloor": self.varFloor})
+        return state
+
+    def setState(self, state):
+        '''
+        Restore a checkpoint
+        :param state: dict returned by getState
+        '''
+        self.nBatches=int(state["nBatches"])
+        self.rng.bit_generator.state=json.loads(str(state["rng"]))
+        self.buf=[np.array(state["buf"])]
+        self.bufLen=len(self.buf[0])
+        if "w" in state:
+            for k in ("w", "mu", "var", "n", "f", "s", "varFloor"):
+                setattr(self, k, np.array(state[k]))
+
+def mapAdapt(ubm, stats, relevance, adapt="m", varFloor=1e-3):
+    '''
+    MAP adaptation of a GMM from the UBM (Reynolds et al. 2000)
+    :param ubm: tuple with UBM weights, means and variances
+    :param stats: SuffStats of the adaptation data for the UBM components
+    :param relevance: relevance factor
+    :param adapt: adapted parameters: any of "w" (weights), "m" (means) and "v" (variances)
+    :param varFloor: variance floor relative to the UBM variance
+    :returns: tuple with weights, means and variances
+    '''
+    (w, mu, var)=(np.asarray(p, dtype=np.float64) for p in ubm)
+    alpha=stats.n/(stats.n+relevance)
+    n=np.maximum(stats.n, 1e-10)[:, None]
+    ex=stats.f/n
+    ex2=stats.s/n
+    a=alpha[:, None]
+    mu1=a*ex+(1-a)*mu if "m" in adapt else mu
+    if "v" in adapt:
+        var1=np.maximum(a*ex2+(1-a)*(var+mu*mu)-mu1*mu1, varFloor*var)
+    else:
+        var1=var
+    if "w" in adapt and stats.nFrames>0:
+        w1=alpha*stats.n/stats.nFrames+(1-alpha)*w
+        w1/=np.sum(w1)
+    else:
+        w1=w
+    return (w1, mu1, var1)
+
+class GmmSet:
+    '''Set of GMMs with the same size scored together'''
+
+    def __init__(self, names, models):
+        '''
+        :param names: list of model names
+        :param models: list of (weights, means, variances) tuples
+        '''
+        self.names=list(names)
+        self.index=dict((n, i) for (i, n) in enumerate(self.names))
+        w=np.array([m[0] for m in models], dtype=np.float64)
+        mu=np.array([m[1] for m in models], dtype=np.float64)
+        var=np.array([m[2] for m in models], dtype=np.float64)
+        (self.nModels, self.nGauss, self.ftrLen)=mu.shape
+        (self.w, self.mu, self.var)=(w, mu, var)
+        # models adapted from the UBM share its components order
+        self.aligned=False
+        # number of UBM components evaluated in the other models (None for all)
+        self.topC=None
+        self.terms=None
+        # log N(x) = const + x.b - 0.5 x^2.a
+        a=1.0/var
+        with np.errstate(divide="ignore"):
+            const=np.log(w)-0.5*(self.ftrLen*np.log(2*np.pi)+np.sum(np.log(var), axis=2)+np.sum(mu*mu*a, axis=2))
+        # stack all models along the Gaussians axis
+        n=self.nModels*self.nGauss
+        self.a=(-0.5*a).reshape(n, self.ftrLen).T.copy()
+        self.b=(mu*a).reshape(n, self.ftrLen).T.copy()
+        self.const=const.reshape(n)
+
+    @classmethod
+    def load(cls, modelDir, names, nGauss, ftrLen):
+        '''
+        Load SPTK models from a folder
+        :param modelDir: folder containing <name>.gmm files
+        :param names: list of model names
+        :returns: GmmSet
+        '''
+        models=[loadGmm(os.path.join(modelDir, n+".gmm"), nGauss, ftrLen) for n in names]
+        return cls(names, models)
+
+    def save(self, fileName, labels, cfg):
+        '''
+        Save all the models to a single bundle file with the labels list
+        and the fingerprint of the training configuration
+        :param fileName: output file
+        :param labels: list of labels
+        :param cfg: training configuration
+        '''
+        config=dict((k, getattr(cfg, k, None)) for k in MODEL_KEYS+INFO_KEYS)
+        header={"version": BUNDLE_VERSION, "names": self.names, "labels": list(labels),
+                "nGauss": self.nGauss, "ftrLen": self.ftrLen, "aligned": self.aligned, "config": config,
+                "fingerprint": configFingerprint(cfg)}
+        arrays={"w": self.w.astype(np.float32), "mu": self.mu.astype(np.float32), "var": self.var.astype(np.float32),
+                "a": self.a, "b": self.b, "const": self.const}
+        saveBundle(fileName, header, arrays)
+
+    @classmethod
+    def loadBundle(cls, fileName, cfg=None):
+        '''
+        Load the models from a bundle file without copying the data
+        :param fileName: input file
+        :param cfg: configuration which must match the training configuration
+        :returns: tuple with GmmSet and list of labels
+        '''
+        (header, arrays)=loadBundle(fileName)
+        if cfg is not None and header["fingerprint"]!=configFingerprint(cfg):
+            diff=["{}={} (trained with {})".format(k, getattr(cfg, k), header["config"].get(k))
+                  for k in MODEL_KEYS if getattr(cfg, k)!=header["config"].get(k)]
+            raise ValueError("{}: configuration does not match the models: {}".format(fileName, ", ".join(diff)))
+        self=cls.__new__(cls)
+        self.names=list(header["names"])
+        self.index=dict((n, i) for (i, n) in enumerate(self.names))
+        (self.nModels, self.nGauss, self.ftrLen)=arrays["mu"].shape
+        (self.w, self.mu, self.var)=(arrays["w"], arrays["mu"], arrays["var"])
+        (self.a, self.b, self.const)=(arrays["a"], arrays["b"], arrays["const"])
+        self.aligned=header.get("aligned", False)
+        self.topC=None
+        self.terms=None
+        return (self, list(header["labels"]))
+
+    def frameLogLik(self, ftr, blockLen=4096):
+        '''
+        Calculate the log likelihood of each frame for each model
+        :param ftr: features array (frames x ftrLen)
+        :param blockLen: number of frames processed at once
+        :returns: array (frames x models)
+        '''
+        if self.topC and self.topC<self.nGauss:
+            return self.frameLogLikTopC(ftr, self.topC)
+        out=np.empty((len(ftr), self.nModels))
+        for i in range(0, len(ftr), blockLen):
+            x=np.asarray(ftr[i:i+blockLen], dtype=np.float64)
+            lg=np.dot(x*x, self.a)+np.dot(x, self.b)+self.const
+            out[i:i+len(x)]=logSumExp(lg.reshape(len(x), self.nModels, self.nGauss))
+        return out
+
+    def frameLogLikTopC(self, ftr, topC, ubm="ubm", blockLen=1024):
+        '''
+        Calculate the log likelihood of each frame with Gaussian selection.
+        The UBM is fully evaluated and only its topC best components of each
+        frame are evaluated in the other models, which must be aligned with the UBM.
+        :param ftr: features array (frames x ftrLen)
+        :param topC: number of selected components
+        :param ubm: name of the UBM
+        :param blockLen: number of frames processed at once
+        :returns: array (frames x models)
+        '''
+        nTerms=2*self.ftrLen+1
+        if self.terms is None:
+            # terms of each Gaussian for [x^2, x, 1] (components x models x terms)
+            n=self.nModels*self.nGauss
+            terms=np.concatenate([self.a.T, self.b.T, np.reshape(self.const, (n, 1))], axis=1)
+            self.terms=np.ascontiguousarray(terms.reshape(self.nModels, self.nGauss, nTerms).transpose(1, 0, 2))
+        u=self.index[ubm]
+        g=slice(u*self.nGauss, (u+1)*self.nGauss)
+        out=np.empty((len(ftr), self.nModels))
+        for i in range(0, len(ftr), blockLen):
+            x=np.asarray(ftr[i:i+blockLen], dtype=np.float64)
+            lgU=np.dot(x*x, self.a[:, g])+np.dot(x, self.b[:, g])+self.const[g]
+            sel=np.argpartition(lgU, self.nGauss-topC, axis=1)[:, self.nGauss-topC:]
+            z=np.concatenate([x*x, x, np.ones((len(x), 1))], axis=1)
+            # selected components of all models (frames x topC*models x terms)
+            w=self.terms[sel].reshape(len(x), topC*self.nModels, nTerms)
+            lg=np.matmul(w, z[:, :, None]).reshape(len(x), topC, self.nModels)
+            out[i:i+len(x)]=logSumExp(lg, axis=1)
+            out[i:i+len(x), u]=logSumExp(lgU)
+        return out
+
+    def posteriors(self, ftr, name="ubm"):
+        '''
+        Calculate the posterior probability of each component of a model
+        :param ftr: features array (frames x ftrLen)
+        :param name: model name
+        :returns: array (frames x nGauss)
+        '''
+        m=self.index[name]
+        g=slice(m*self.nGauss, (m+1)*self.nGauss)
+        x=np.asarray(ftr, dtype=np.float64)
+        lg=np.dot(x*x, self.a[:, g])+np.dot(x, self.b[:, g])+self.const[g]
+        return np.exp(lg-logSumExp(lg)[:, None])
+
+    def avgLogLik(self, ftr):
+        '''
+        Calculate the average log likelihood for each model (as gmmp -a)
+        :param ftr: features array (frames x ftrLen)
+        :returns: array (models)
+        '''
+        return np.mean(self.frameLogLik(ftr), axis=0)
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+# SMART FP7 - Search engine for MultimediA enviRonment generated contenT
+# Webpage: http://smartfp7.eu
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# The Original Code is Copyright (C) 2013 IBM Corp.
+# All Rights Reserved
+#
+# Contributor(s):
+#  Zvi Kons <zvi@il.ibm.com>
+
+'''
+smart.audio.multistream - classification of many live audio streams CLI.
+'''
+
+import sys
+
+from smart.audio import AudioClassifier, Configuration, classify, publisher, scoreindex, stream, utils
+import argparse
+import datetime
+import logging
+import multiprocessing
+import os
+import os.path
+import queue
+import socket
+import threading
+import time
+import numpy as np
+
+
+def parseSource(text):
+    '''
+    Parse a stream source argument
+    :param text: "name=path" or a path (the name is then the file name)
+    :returns: tuple with stream name and path
+    '''
+    if "=" in text:
+        (name, path)=text.split("=", 1)
+    else:
+        path=text
+        name=os.path.basename(text[5:] if text.startswith("unix:") else text)
+    return (name, path)
+
+def readSource(path, chunkLen):
+    '''
+    Iterator over chunks of raw audio of a stream
+    :param path: file or named pipe, or "unix:<socket file>" to wait for a
+                 connection to a local socket
+    :param chunkLen: read size in bytes
+    :returns: bytes
+    '''
+    if path.startswith("unix:"):
+        socketPath=path[5:]
+        if os.path.exists(socketPath):
+            os.remove(socketPath)
+        server=socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(socketPath)
+        server.listen(1)
+        logging.info("multistream: waiting for connection on "+socketPath)
+        (conn, addr)=server.accept()
+        with conn:
+            for data in iter(lambda: conn.recv(chunkLen), b""):
+                yield data
+        server.close()
+        os.remove(socketPath)
+    else:
+        with open(path, "rb", buffering=0) as fin:
+            for data in iter(lambda: fin.read(chunkLen), b""):
+                yield data
+
+def reader(name, path, chunkLen, chunks):
+    '''
+    Reader thread of a stream. Puts (name, samples, arrival time) into the
+    chunks queue and (name, None, time) at the end of the stream.
+    :param name: stream name
+    :param path: stream source (see readSource)
+    :param chunkLen: read size in bytes
+    :param chunks: queue shared by the streams of a worker
+    '''
+    rest=b""
+    try:
+        for data in readSource(path, chunkLen):
+            arrival=time.time()
+            data=rest+data
+            # keep an odd byte for the next chunk
+            n=len(data)//2*2
+            rest=data[n:]
+            if n>0:
+                chunks.put((name, np.frombuffer(data[:n], dtype=np.int16), arrival))
+    except OSError as e:
+        logging.error("ERROR: Failed to read stream {}\n{}\n".format(name, e))
+    chunks.put((name, None, time.time()))
+
+def runShard(sources, modelDir, cfgDict, segLen, hop, chunk, batchWait, results):
+    '''
+    Worker process classifying a shard of the streams. The frames of all the
+    streams received during batchWait seconds are scored together.
+    :param sources: list of (stream name, path)
+    :param modelDir: input folder
+    :param cfgDict: configuration values
+    :param segLen: segment length (default: Configuration.segLen)
+    :param hop: distance between segments (default: Configuration.segHop)
+    :param chunk: stream read size (sec)
+    :param batchWait: maximal time to collect audio for one scoring call (sec)
+    :param results: multiprocessing queue receiving ("preds", name, predictions),
+                    ("metrics", name, metrics) and finally ("done", None, statistics),
+                    or ("failed", None, error message) when the worker fails
+    '''
+    try:
+        cfg=utils.configFromDict(cfgDict)
+        cls=AudioClassifier.AudioClassifier(cfg)
+        cls.loadModels(modelDir)
+        msc=stream.MultiStreamClassifier(cls, segLen, hop)
+        chunks=queue.Queue()
+        chunkLen=max(int(chunk*cfg.samplerate)*2, 2)
+        for (name, path) in sources:
+            msc.add(name)
+            threading.Thread(target=reader, args=(name, path, chunkLen, chunks), name="reader-"+name, daemon=True).start()
+        nOpen=len(sources)
+        while nOpen>0:
+            batch=[chunks.get()]
+            deadline=time.time()+batchWait
+            try:
+                while len(batch)<4*len(sources):
+                    batch.append(chunks.get(timeout=max(deadline-time.time(), 0)))
+            except queue.Empty:
+                pass
+            for (name, preds) in msc.push(batch):
+                if preds:
+                    results.put(("preds", name, preds))
+            nOpen-=sum(1 for c in batch if c[1] is None)
+        for (name, m) in msc.metrics()["streams"].items():
+            results.put(("metrics", name, m))
+        snap=cls.stats.snapshot()
+        snap["counters"]["batches"]=msc.batches
+        results.put(("done", None, snap))
+    except BaseException as e:
+        # the main process waits for a message from each worker
+        results.put(("failed", None, "{}: {}".format(type(e).__name__, e)))
+        raise
+
+def main(argv):
+    '''Command line classification of many live audio streams.'''
+
+    parser = argparse.ArgumentParser(description="Classification of many live audio streams")
+    parser.add_argument("-v", "--verbose", dest="verbose", action="count", help="increase verbosity level", default=0)
+    parser.add_argument("-m", "--model_dir", dest="modelDir", default="./models", help="input directory for models data [%(default)s]")
+    parser.add_argument("-c", "--csv_ouput", dest="csvOutput", action="store_true", help="CSV table output [default]")
+    parser.add_argument("-j", "--json_ouput", dest="jsonOutput", action="store_true", help="JSON format output")
+    parser.add_argument("-e", "--edge_node", dest="edgeNodeUrl", help="URL for edge node server. JSON output will be posted to this URL")
+    parser.add_argument("--spool_dir", dest="spoolDir", help="folder keeping JSON data until it is posted to the edge node server [temporary folder]")
+    parser.add_argument("-s", "--seg_len", dest="segLen", type=float, help="segment length in seconds [Configuration.segLen]")
+    parser.add_argument("-p", "--hop", dest="hop", type=float, help="distance between segments in seconds [segment length]")
+    parser.add_argument("-w", "--workers", dest="workers", type=int, default=os.cpu_count(), help="number of worker processes, the streams are divided between them [%(default)s]")
+    parser.add_argument("--chunk", dest="chunk", type=float, default=0.1, help="stream read size in seconds [%(default)s]")
+    parser.add_argument("--batch_wait", dest="batchWait", type=float, default=0.05, help="maximal time to collect audio of the streams for one scoring call in seconds [%(default)s]")
+    parser.add_argument("--silence_db", dest="silenceDb", type=float, help="skip scoring of frames below this energy in dB relative to full scale [Configuration.silenceDb]")
+    parser.add_argument("--index", dest="indexDir", help="also append the segment scores to the score index in this folder (see scoreindex.py)")
+    parser.add_argument("--stats", dest="stats", action="store_true", help="print processing timers and counters to the standard error at the end")
+    parser.add_argument("sources", nargs="+", help="streams of raw 16 bit PCM audio at the working sample rate: [name=]path of a file or named pipe, or [name=]unix:<socket file> to wait for a connection on a local socket. The name is the component name in the JSON output")
+    args = parser.parse_args()
+    if args.verbose==1:
+        logging.basicConfig(level=logging.INFO)
+    if args.verbose>1:
+        logging.basicConfig(level=logging.DEBUG)
+    cfg=Configuration
+    if args.silenceDb is not None:
+        cfg.silenceDb=args.silenceDb
+    if (not args.csvOutput) and (not args.jsonOutput) and (not args.edgeNodeUrl):
+        args.csvOutput=True
+    sources=[parseSource(s) for s in args.sources]
+    if len(set(name for (name, path) in sources))<len(sources):
+        parser.error("stream names must be unique")
+    # the models are loaded once to check them before starting the workers
+    cls=AudioClassifier.AudioClassifier(cfg)
+    cls.loadModels(args.modelDir)
+    if cls.gmms is None:
+        logging.critical("Streaming requires the numpy backend\n")
+        return 1
+    labels=cls.labels
+    index=None
+    if args.indexDir:
+        try:
+            index=scoreindex.ScoreIndex(args.indexDir, labels)
+        except ValueError as e:
+            logging.critical("Bad score index: {}\n".format(e))
+            return 1
+    nWorkers=max(min(args.workers, len(sources)), 1)
+    results=multiprocessing.Queue()
+    workers=[]
+    for i in range(nWorkers):
+        shard=sources[i::nWorkers]
+        w=multiprocessing.Process(target=runShard, name="shard{}".format(i),
+                                  args=(shard, args.modelDir, utils.configDict(cfg), args.segLen, args.hop, args.chunk, args.batchWait, results))
+        w.start()
+        workers.append(w)
+    logging.info("multistream: {} streams, {} workers".format(len(sources), nWorkers))
+    pub=None
+    lost=0
+    if args.edgeNodeUrl:
+        pub=publisher.EdgeNodePublisher(args.edgeNodeUrl, args.spoolDir, metrics=cls.stats)
+    sampleDateTime=datetime.datetime.now()
+    if args.csvOutput:
+        print("stream,"+classify.csvHeader(labels), flush=True)
+    st=cls.stats
+    metrics={}
+    nDone=0
+    try:
+        while nDone<nWorkers:
+            try:
+                (kind, name, data)=results.get(timeout=1.0)
+            except queue.Empty:
+                # workers killed without a message
+                if not any(w.is_alive() for w in workers):
+                    logging.error("ERROR: Stream workers exited without results\n")
+                    break
+                continue
+            if kind=="preds":
+                if index:
+                    index.append(name, data)
+                    index.flush()
+                with st.timer("output"):
+                    for p in data:
+                        if args.csvOutput:
+                            print(classify.pred2csv(labels, p, name), flush=True)
+                        if args.jsonOutput or pub:
+                            jsonData=classify.pred2json(name, p, sampleDateTime)
+                            if args.jsonOutput:
+                                print(jsonData, flush=True)
+                            if pub:
+                                pub.publish(jsonData)
+            elif kind=="metrics":
+                metrics[name]=data
+            elif kind=="failed":
+                logging.error("ERROR: Stream worker failed\n{}\n".format(data))
+                nDone+=1
+            else:
+                st.merge(data)
+                nDone+=1
+    finally:
+        for w in workers:
+            w.join()
+        if index:
+            index.close()
+        if pub:
+            lost=pub.close()
+            for k in ("sent", "errors", "spooled", "dropped"):
+                st.count("post_"+k, pub.counters[k])
+    for (name, path) in sources:
+        if name in metrics:
+            print("{0}: {1[audio]:.1f} sec audio, {1[segments]} segments, segment latency avg {1[lagAvg]:.3f} sec max {1[lagMax]:.3f} sec"
+                  .format(name, metrics[name]), file=sys.stderr)
+    if args.stats:
+        sys.stderr.write(st.dump())
+    return 0 if all(w.exitcode==0 for w in workers) and not lost else 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,254 @@
+'''
+smart.audio.publisher - Background publisher of JSON data to the EdgeNode server.
+'''
+
+# SMART FP7 - Search engine for MultimediA enviRonment generated contenT
+# Webpage: http://smartfp7.eu
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# The Original Code is Copyright (C) 2013 IBM Corp.
+# All Rights Reserved
+#
+# Contributor(s):
+#  Zvi Kons <zvi@il.ibm.com>
+
+import collections
+import http.client
+import json
+import logging
+import os
+import os.path
+import queue
+import tempfile
+import threading
+import time
+import urllib.parse
+from smart.audio.stats import Stats
+
+
+class PublishException(Exception):
+    '''Exception when the server rejects the data'''
+    def __init__(self, msg):
+        Exception.__init__(self)
+        self.msg=msg
+
+    def __repr__(self):
+        return "<PublishException:: {0}>".format(self.msg)
+
+    def __str__(self):
+        return "PublishException= {0}".format(self.msg)
+
+class EdgeNodePublisher:
+    '''
+    Post JSON documents to the EdgeNode server from a background thread.
+    Documents are sent in batches over a persistent connection. Documents
+    which could not be sent are kept in a spool folder and retried with
+    exponential backoff, so the caller never waits for the server.
+    '''
+
+    def __init__(self, url, spoolDir=None, batchSize=50, maxSpool=100000, bulk=False,
+                 timeout=10.0, retryMin=1.0, retryMax=60.0, metrics=None):
+        '''
+        :param url: server URL
+        :param spoolDir: folder for unsent documents (default: temporary folder)
+        :param batchSize: maximal number of documents sent together
+        :param maxSpool: maximal number of spooled documents (oldest are dropped)
+        :param bulk: post each batch as one request to the CouchDB _bulk_docs API
+        :param timeout: connection timeout (sec)
+        :param retryMin: first retry delay (sec)
+        :param retryMax: maximal retry delay (sec)
+        :param metrics: Stats object timing the posts (default: private)
+        '''
+        self.url=urllib.parse.urlsplit(url)
+        self.path=self.url.path or "/"
+        if bulk:
+            self.path=self.path.rstrip("/")+"/_bulk_docs"
+        self.bulk=bulk
+        self.batchSize=batchSize
+        self.maxSpool=maxSpool
+        self.timeout=timeout
+        self.retryMin=retryMin
+        self.retryMax=retryMax
+        self.retryDelay=retryMin
+        self.retryAt=0.0
+        self.metrics=metrics or Stats()
+        self.spoolDirObj=None
+        if spoolDir is None:
+            self.spoolDirObj=tempfile.TemporaryDirectory()
+            spoolDir=self.spoolDirObj.name
+        elif not os.path.exists(spoolDir):
+            os.makedirs(spoolDir)
+        self.spoolDir=spoolDir
+        # documents left by a previous run are sent first
+        self.spool=collections.deque(sorted(n for n in os.listdir(spoolDir) if n.endswith(".json")))
+        self.seq=int(self.spool[-1][:-5])+1 if self.spool else 0
+        self.conn=None
+        self.queue=queue.Queue()
+        self.stopping=threading.Event()
+        self.stopAt=None
+        self.counters={"sent": 0, "errors": 0, "spooled": 0, "dropped": 0, "requests": 0}
+        self.thread=threading.Thread(target=self.run, name="EdgeNodePublisher", daemon=True)
+        self.thread.start()
+
+    def publish(self, jsonData):
+        '''
+        Queue a JSON document for posting (does not block)
+        :param jsonData: JSON string
+        '''
+        self.queue.put(jsonData)
+
+    def close(self, timeout=60.0):
+        '''
+        Send the queued documents and stop the background thread. The spooled
+        documents are retried with backoff until the timeout. Documents that
+        could not be sent stay in the spool folder, or are discarded with a
+        temporary spool folder.
+        :param timeout: maximal time to retry (sec)
+        :returns: number of documents that were not posted (left unsent or dropped)
+        '''
+        self.stopAt=time.time()+timeout
+        self.stopping.set()
+        # a request in progress may take up to the connection timeout
+        self.thread.join(timeout+2*self.timeout)
+        if self.conn is not None:
+            self.conn.close()
+        lost=len(self.spool)+self.queue.qsize()+self.counters["dropped"]
+        if self.spool:
+            if self.spoolDirObj is None:
+                logging.error("ERROR: {} documents were not posted and are kept in {}\n".format(len(self.spool), self.spoolDir))
+            else:
+                logging.error("ERROR: {} documents were not posted and are discarded with the temporary spool folder (use --spool_dir to keep them)\n".format(len(self.spool)))
+        if self.spoolDirObj is not None and not self.thread.is_alive():
+            self.spoolDirObj.cleanup()
+        return lost
+
+    def stats(self):
+        '''
+        Publisher counters
+        :returns: dict with sent, errors, spooled, dropped and requests counters and queue sizes
+        '''
+        res=dict(self.counters)
+        res["queued"]=self.queue.qsize()
+        res["inSpool"]=len(self.spool)
+        return res
+
+    def run(self):
+        '''Background thread loop'''
+        while True:
+            batch=self.nextBatch()
+            if batch:
+                if self.spool:
+                    # keep the order of the documents behind the spooled ones
+                    self.spoolDocs(batch)
+                else:
+                    sent=self.send(batch)
+                    self.spoolDocs(batch[sent:])
+            if self.spool and time.time()>=self.retryAt:
+                self.retrySpool()
+            if self.stopping.is_set() and self.queue.empty():
+                if not self.spool or time.time()>=self.stopAt:
+                    break
+
+    def nextBatch(self):
+        '''
+        Wait for documents in the queue
+        :returns: list of up to batchSize documents
+        '''
+        batch=[]
+        try:
+            batch.append(self.queue.get(timeout=0.2))
+            while len(batch)<self.batchSize:
+                batch.append(self.queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def connect(self):
+        '''Open a connection to the server if needed'''
+        if self.conn is None:
+            if self.url.scheme=="https":
+                self.conn=http.client.HTTPSConnection(self.url.hostname, self.url.port, timeout=self.timeout)
+            else:
+                self.conn=http.client.HTTPConnection(self.url.hostname, self.url.port, timeout=self.timeout)
+        return self.conn
+
+    def post(self, body):
+        '''
+        Post one request over the persistent connection
+        :param body: JSON string
+        '''
+        conn=self.connect()
+        self.counters["requests"]+=1
+        try:
+            with self.metrics.timer("post"):
+                conn.request("POST", self.path, body.encode("utf-8"), {"Content-Type": "application/json"})
+                res=conn.getresponse()
+                data=res.read()
+        except Exception:
+            # reconnect on the next request
+            conn.close()
+            self.conn=None
+            raise
+        if res.status!=201:
+            raise PublishException("status={} {}".format(res.status, data[:200]))
+
+    def send(self, batch):
+        '''
+        Send a batch of documents
+        :param batch: list of JSON strings
+        :returns: number of documents sent before the first failure
+        '''
+        sent=0
+        try:
+            if self.bulk:
+                self.post(json.dumps({"docs": [json.loads(d) for d in batch]}))
+                sent=len(batch)
+            else:
+                for doc in batch:
+                    self.post(doc)
+                    sent+=1
+        except Exception as e:
+            logging.error("ERROR: Failed to post JSON data\n{}\n".format(e))
+            self.counters["errors"]+=1
+            self.retryAt=time.time()+self.retryDelay
+            self.retryDelay=min(self.retryDelay*2, self.retryMax)
+        else:
+            self.retryDelay=self.retryMin
+        self.counters["sent"]+=sent
+        return sent
+
+    def spoolDocs(self, docs):
+        '''
+        Keep documents in the spool folder
+        :param docs: list of JSON strings
+        '''
+        for doc in docs:
+            name="{:012d}.json".format(self.seq)
+            self.seq+=1
+            with open(os.path.join(self.spoolDir, name), "wt") as fout:
+                fout.write(doc)
+            self.spool.append(name)
+            self.counters["spooled"]+=1
+        while len(self.spool)>self.maxSpool:
+            name=self.spool.popleft()
+            os.remove(os.path.join(self.spoolDir, name))
+            self.counters["dropped"]+=1
+            logging.error("ERROR: Spool is full, dropping {}\n".format(name))
+
+    def retrySpool(self):
+        '''Send the spooled documents, oldest first'''
+        while self.spool:
+            names=list(self.spool)[:self.batchSize]
+            docs=[]
+            for name in names:
+                with open(os.path.join(self.spoolDir, name), "rt") as fin:
+                    docs.append(fin.read())
+            sent=self.send(docs)
+            for name in names[:sent]:
+                self.spool.popleft()
+                os.remove(os.path.join(self.spoolDir, name))
+            if sent<len(docs):
+                break
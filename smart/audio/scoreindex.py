@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+# SMART FP7 - Search engine for MultimediA enviRonment generated contenT
+# Webpage: http://smartfp7.eu
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# The Original Code is Copyright (C) 2013 IBM Corp.
+# All Rights Reserved
+#
+# Contributor(s):
+#  Zvi Kons <zvi@il.ibm.com>
+
+'''
+smart.audio.scoreindex - Store and query the segment scores of an archive CLI.
+'''
+
+import sys
+
+import argparse
+import json
+import logging
+import os
+import os.path
+import tempfile
+import time
+import numpy as np
+
+INDEX_VERSION=1
+META_NAME="index.json"
+FILES_NAME="files.txt"
+
+# Columns of each segment besides the labels scores
+FILE_COLUMN=("file", np.uint32)
+TIME_COLUMNS=(("t1", np.float64), ("t2", np.float64))
+SCORE_TYPE=np.float32
+
+
+def sigmoid(x):
+    '''
+    Map scores to the (0,1) range as in the classify.py output
+    :param x: array of scores
+    :returns: array
+    '''
+    return 1.0/(1.0+np.exp(-np.clip(x, -500.0, 500.0)))
+
+
+class ScoreIndex:
+    '''
+    Append-only columnar store of the segment scores. Each column (file id,
+    t1, t2 and the score of each label) is a flat binary file which is
+    memory mapped for queries. Sorted indexes of each label and of the files
+    are built by buildIndex; rows appended after the last build are scanned.
+    A store has a single writer and any number of readers.
+    '''
+
+    def __init__(self, path, labels=None):
+        '''
+        :param path: store folder
+        :param labels: labels list, required to create a new store
+        '''
+        self.path=path
+        metaFile=os.path.join(path, META_NAME)
+        if os.path.exists(metaFile):
+            with open(metaFile, "rt") as fin:
+                self.meta=json.load(fin)
+            if labels is not None and list(labels)!=self.meta["labels"]:
+                raise ValueError("{}: labels {} do not match {}".format(path, list(labels), self.meta["labels"]))
+        else:
+            if labels is None:
+                raise ValueError("{}: not a score index".format(path))
+            if not os.path.exists(path):
+                os.makedirs(path)
+            self.meta={"version": INDEX_VERSION, "labels": list(labels), "indexed": 0}
+            self.saveMeta()
+        if self.meta["version"]!=INDEX_VERSION:
+            raise ValueError("{}: unsupported version {}".format(path, self.meta["version"]))
+        self.labels=self.meta["labels"]
+        self.columns=dict([FILE_COLUMN]+list(TIME_COLUMNS)+[(label, SCORE_TYPE) for label in self.labels])
+        self.files=[]
+        filesName=os.path.join(path, FILES_NAME)
+        if os.path.exists(filesName):
+            with open(filesName, "rt") as fin:
+                self.files=[ln.rstrip("\n") for ln in fin]
+        self.fileIds=dict((name, i) for (i, name) in enumerate(self.files))
+        self.writers=None
+        self.maps={}
+
+    def colFile(self, name, ext=".col"):
+        '''Column file name'''
+        return os.path.join(self.path, name+ext)
+
+    def saveMeta(self):
+        '''Write the metadata file atomically'''
+        (fd, tmpName)=tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        with os.fdopen(fd, "wt") as fout:
+            json.dump(self.meta, fout, indent=2)
+        os.replace(tmpName, os.path.join(self.path, META_NAME))
+
+    def append(self, fileName, preds):
+        '''
+        Append the predictions of a file or stream
+        :param fileName: audio file or stream name
+        :param preds: list of predictions (dicts with the label scores, t1 and t2).
+                      Skipped silent segments have NaN scores.
+        '''
+        if not preds:
+            return
+        if self.writers is None:
+            n=self.nRows()
+            self.writers=dict((name, open(self.colFile(name), "ab")) for name in self.columns)
+            # drop the values of an interrupted append (without the file id)
+            for (name, t) in self.columns.items():
+                self.writers[name].truncate(n*np.dtype(t).itemsize)
+            self.filesOut=open(os.path.join(self.path, FILES_NAME), "at")
+        if fileName not in self.fileIds:
+            self.fileIds[fileName]=len(self.files)
+            self.files.append(fileName)
+            self.filesOut.write(fileName+"\n")
+            self.filesOut.flush()
+        cols={"file": np.full(len(preds), self.fileIds[fileName])}
+        for (name, t) in TIME_COLUMNS:
+            cols[name]=np.array([p[name] for p in preds])
+        for label in self.labels:
+            cols[label]=sigmoid(np.array([p.get(label, np.nan) for p in preds], dtype=np.float64))
+        # the file id column is written last: readers count the rows by this column
+        for name in list(self.columns)[1:]+[FILE_COLUMN[0]]:
+            self.writers[name].write(np.asarray(cols[name], dtype=self.columns[name]).tobytes())
+
+    def flush(self):
+        '''Make the appended rows visible to readers'''
+        if self.writers is not None:
+            for name in list(self.columns)[1:]+[FILE_COLUMN[0]]:
+                self.writers[name].flush()
+
+    def close(self):
+        '''Close the column files'''
+        if self.writers is not None:
+            self.flush()
+            for fout in self.writers.values():
+                fout.close()
+            self.filesOut.close()
+            self.writers=None
+
+    def nRows(self):
+        '''
+        Number of complete rows
+        :returns: number of segments
+        '''
+        self.flush()
+        n=[os.path.getsize(self.colFile(name))//np.dtype(t).itemsize if os.path.exists(self.colFile(name)) else 0
+           for (name, t) in self.columns.items()]
+        return min(n)
+
+    def mapFile(self, fileName, dtype, n):
+        '''
+        Memory map the first n values of a file. One mapping of each file is
+        kept, and the file is mapped again when it has grown past it.
+        :returns: array (read only)
+        '''
+        m=self.maps.get(fileName)
+        if m is None or len(m)<n:
+            size=os.path.getsize(fileName)//np.dtype(dtype).itemsize if n>0 else 0
+            m=np.memmap(fileName, dtype=dtype, mode="r", shape=(size,)) if size>0 else np.zeros(0, dtype=dtype)
+            self.maps[fileName]=m
+        return m[:n]
+
+    def column(self, name, n=None):
+        '''
+        Memory mapped column
+        :param name: "file", "t1", "t2" or a label
+        :param n: number of rows (default: all complete rows)
+        :returns: array
+        '''
+        n=self.nRows() if n is None else n
+        return self.mapFile(self.colFile(name), self.columns[name], n)
+
+    def buildIndex(self):
+        '''
+        Build the sorted indexes of all the rows: for each label the rows by
+        decreasing score (silent segments last), and the rows by file and time
+        '''
+        n=self.nRows()
+        t0=time.time()
+        for label in self.labels:
+            neg=-np.asarray(self.column(label, n), dtype=SCORE_TYPE)
+            order=np.argsort(neg, kind="stable")
+            self.writeArray(self.colFile(label, ".order"), order.astype(np.int64))
+            self.writeArray(self.colFile(label, ".sorted"), neg[order])
+        order=np.lexsort((self.column("t1", n), self.column("file", n)))
+        self.writeArray(self.colFile("file", ".order"), order.astype(np.int64))
+        self.writeArray(self.colFile("file", ".sorted"), np.asarray(self.column("file", n))[order])
+        t1=np.asarray(self.column("t1", n))
+        self.writeArray(self.colFile("t1", ".sorted"), t1[order])
+        self.meta["maxSegLen"]=float((self.column("t2", n)-t1).max()) if n>0 else 0.0
+        self.meta["indexed"]=n
+        self.saveMeta()
+        self.maps={}
+        logging.info("buildIndex: {} rows in {:.2f} sec".format(n, time.time()-t0))
+
+    def writeArray(self, fileName, x):
+        '''Write an array file atomically'''
+        (fd, tmpName)=tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        with os.fdopen(fd, "wb") as fout:
+            fout.write(np.ascontiguousarray(x).tobytes())
+        os.replace(tmpName, fileName)
+
+    def indexed(self, name, dtype):
+        '''
+        Sorted index of a column
+        :returns: tuple with the rows order and the sorted keys
+        '''
+        n=self.meta["indexed"]
+        return (self.mapFile(self.colFile(name, ".order"), np.int64, n),
+                self.mapFile(self.colFile(name, ".sorted"), dtype, n))
+
+    def threshold(self, label, minScore, limit=None):
+        '''
+        Segments with a label score of at least minScore
+        :param label: label name
+        :param minScore: minimal score (0-1)
+        :param limit: maximal number of returned rows
+        :returns: array of rows by decreasing score
+        '''
+        (order, neg)=self.indexed(label, SCORE_TYPE)
+        k=np.searchsorted(neg, -SCORE_TYPE(minScore), side="right")
+        rows=order[:k if limit is None else min(k, limit)]
+        tail=self.tailRows()
+        if len(tail)>0:
+            tail=tail[self.column(label)[tail]>=SCORE_TYPE(minScore)]
+            rows=self.byScore(label, np.concatenate([rows, tail]))[:limit]
+        return np.asarray(rows)
+
+    def topK(self, label, k):
+        '''
+        Segments with the highest scores of a label (silent segments are not returned)
+        :param label: label name
+        :param k: number of segments
+        :returns: array of rows by decreasing score
+        '''
+        return self.threshold(label, -np.inf, k)
+
+    def tailRows(self):
+        '''Rows which are not in the sorted indexes'''
+        return np.arange(self.meta["indexed"], self.nRows())
+
+    def byScore(self, label, rows):
+        '''Sort rows by decreasing score of a label'''
+        return rows[np.argsort(-self.column(label)[rows], kind="stable")]
+
+    def timeRange(self, fileName, t1=None, t2=None):
+        '''
+        Segments of a file which overlap a time range
+        :param fileName: audio file or stream name
+        :param t1: start of the range (sec)
+        :param t2: end of the range (sec)
+        :returns: array of rows by time
+        '''
+        if fileName not in self.fileIds:
+            return np.zeros(0, dtype=np.int64)
+        fileId=self.fileIds[fileName]
+        (order, files)=self.indexed("file", np.uint32)
+        (a, b)=np.searchsorted(files, [fileId, fileId+1])
+        # the indexed rows of a file are sorted by t1
+        starts=self.mapFile(self.colFile("t1", ".sorted"), np.float64, self.meta["indexed"])[a:b]
+        if t2 is not None:
+            b=a+np.searchsorted(starts, t2, side="left")
+        if t1 is not None:
+            a+=np.searchsorted(starts, t1-self.meta["maxSegLen"], side="right")
+        rows=np.asarray(order[a:max(a, b)])
+        tail=self.tailRows()
+        rows=np.concatenate([rows, tail[self.column("file")[tail]==fileId]])
+        return self.filterTime(rows, t1, t2)
+
+    def filterTime(self, rows, t1=None, t2=None):
+        '''
+        Keep the rows which overlap a time range
+        :param rows: array of rows
+        :returns: array of rows
+        '''
+        keep=np.ones(len(rows), dtype=bool)
+        if t1 is not None:
+            keep&=self.column("t2")[rows]>t1
+        if t2 is not None:
+            keep&=self.column("t1")[rows]<t2
+        return rows[keep]
+
+    def query(self, label=None, minScore=None, top=None, fileName=None, t1=None, t2=None, limit=None):
+        '''
+        Combined query. With a file the rows of the file are selected by the
+        file index, otherwise the label index is scanned by decreasing score
+        until enough rows in the time range are found.
+        :param label: label name for minScore and top
+        :param minScore: minimal score of the label
+        :param top: number of segments with the highest scores
+        :param fileName: audio file or stream name
+        :param t1: start of the time range (sec)
+        :param t2: end of the time range (sec)
+        :param limit: maximal number of returned rows
+        :returns: array of rows (by decreasing score with a label, otherwise by time)
+        '''
+        if label is not None and label not in self.labels:
+            raise ValueError("unknown label "+label)
+        n=min(x for x in (top, limit, self.nRows()) if x is not None)
+        if fileName is not None:
+            rows=self.timeRange(fileName, t1, t2)
+            if label is not None:
+                s=self.column(label)[rows]
+                rows=self.byScore(label, rows[s>=SCORE_TYPE(minScore) if minScore is not None else np.isfinite(s)])
+            return rows[:n]
+        if label is None:
+            raise ValueError("a label or a file is required")
+        minScore=-np.inf if minScore is None else minScore
+        if t1 is None and t2 is None:
+            return self.threshold(label, minScore, n)
+        return self.firstInRange(self.threshold(label, minScore), t1, t2, n)
+
+    def firstInRange(self, rows, t1, t2, n, blockLen=65536):
+        '''
+        First rows which overlap a time range
+        :param rows: array of rows
+        :param n: maximal number of returned rows
+        :param blockLen: number of rows checked together
+        :returns: array of rows
+        '''
+        res=[np.zeros(0, dtype=np.int64)]
+        found=0
+        for i in range(0, len(rows), blockLen):
+            res.append(self.filterTime(np.asarray(rows[i:i+blockLen]), t1, t2))
+            found+=len(res[-1])
+            if found>=n:
+                break
+        return np.concatenate(res)[:n]
+
+    def records(self, rows):
+        '''
+        Segment values
+        :param rows: array of rows
+        :returns: list of dicts with file, t1, t2 and the label scores
+        '''
+        rows=np.asarray(rows, dtype=np.int64)
+        cols=dict((name, np.asarray(self.column(name)[rows])) for name in self.columns)
+        res=[]
+        for i in range(len(rows)):
+            r={"file": self.files[int(cols["file"][i])], "t1": float(cols["t1"][i]), "t2": float(cols["t2"][i])}
+            for label in self.labels:
+                r[label]=float(cols[label][i])
+            res.append(r)
+        return res
+
+
+def main(argv):
+    '''Command line score index queries.'''
+
+    parser = argparse.ArgumentParser(description="Query the segment scores index written by classify.py --index")
+    parser.add_argument("-v", "--verbose", dest="verbose", action="count", help="increase verbosity level", default=0)
+    parser.add_argument("-b", "--build", dest="build", action="store_true", help="build the sorted indexes of all the segments")
+    parser.add_argument("-l", "--label", dest="label", help="label of the score conditions")
+    parser.add_argument("-s", "--min_score", dest="minScore", type=float, help="minimal score of the label (0-1)")
+    parser.add_argument("-k", "--top", dest="top", type=int, help="segments with the highest scores of the label")
+    parser.add_argument("-f", "--file", dest="fileName", help="segments of this audio file or stream")
+    parser.add_argument("--t1", dest="t1", type=float, help="start of the time range (sec)")
+    parser.add_argument("--t2", dest="t2", type=float, help="end of the time range (sec)")
+    parser.add_argument("-n", "--limit", dest="limit", type=int, default=100, help="maximal number of printed segments [%(default)s]")
+    parser.add_argument("index_dir", help="score index folder")
+    args = parser.parse_args()
+    if args.verbose==1:
+        logging.basicConfig(level=logging.INFO)
+    if args.verbose>1:
+        logging.basicConfig(level=logging.DEBUG)
+    index=ScoreIndex(args.index_dir)
+    if args.build:
+        index.buildIndex()
+    n=index.nRows()
+    print("{} segments of {} files ({} indexed), labels: {}".format(n, len(index.files), index.meta["indexed"], " ".join(index.labels)), file=sys.stderr)
+    if args.label is None and args.fileName is None:
+        return 0
+    t0=time.perf_counter()
+    try:
+        rows=index.query(args.label, args.minScore, args.top, args.fileName, args.t1, args.t2, args.limit)
+    except ValueError as e:
+        parser.error(str(e))
+    dt=time.perf_counter()-t0
+    print(",".join(["file", "t1", "t2"]+index.labels))
+    for r in index.records(rows):
+        print(",".join([r["file"], "{}".format(r["t1"]), "{}".format(r["t2"])]+["{}".format(r[label]) for label in index.labels]))
+    print("{} segments in {:.2f} ms".format(len(rows), 1000*dt), file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
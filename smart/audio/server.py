@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+# SMART FP7 - Search engine for MultimediA enviRonment generated contenT
+# Webpage: http://smartfp7.eu
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# The Original Code is Copyright (C) 2013 IBM Corp.
+# All Rights Reserved
+#
+# Contributor(s):
+#  Zvi Kons <zvi@il.ibm.com>
+
+'''
+smart.audio.server - audio classification service CLI.
+'''
+
+import sys
+
+from smart.audio import AudioClassifier, Configuration, classify, utils
+import argparse
+import collections
+import concurrent.futures
+import datetime
+import http.server
+import json
+import logging
+import os
+import os.path
+import socketserver
+import threading
+import time
+import urllib.parse
+import numpy as np
+
+# classifier used by each worker process
+_cls=None
+
+def initWorker(modelDir, cfgDict):
+    '''
+    Load the models once in each worker process
+    :param modelDir: input folder
+    :param cfgDict: configuration values
+    '''
+    global _cls
+    _cls=AudioClassifier.AudioClassifier(utils.configFromDict(cfgDict))
+    _cls.loadModels(modelDir)
+
+def classifyTask(task):
+    '''
+    Classify an audio file or raw samples in a worker process
+    :param task: tuple with kind ("file" or "pcm"), file name or 16 bit PCM bytes, segment length and hop
+    :returns: tuple with list of predictions and duration (sec)
+    '''
+    (kind, data, segLen, hop)=task
+    if kind=="pcm":
+        x=np.frombuffer(data, dtype=np.int16)
+        dur=len(x)/_cls.cfg.samplerate
+        cum=_cls.samplesLogLik(x)
+        return (list(_cls.windowScores(cum, dur, segLen, hop)), dur)
+    if _cls.gmms is not None:
+        (cum, dur)=_cls.fileLogLik(data)
+        return (list(_cls.windowScores(cum, dur, segLen, hop)), dur)
+    # the last segment may end after the end of the audio
+    dur=_cls.fileDuration(data)
+    return (list(_cls.predFile(data, segLen, hop, dur)), dur)
+
+
+class ClassifyService:
+    '''
+    Classification requests served by a pool of worker processes which load
+    the models once. Keeps the queue depth and the latency of recent requests.
+    '''
+
+    def __init__(self, modelDir, cfg, workers, componentName, nLatencies=1000):
+        '''
+        :param modelDir: input folder
+        :param cfg: configuration
+        :param workers: number of worker processes
+        :param componentName: name of EdgeNode component in JSON responses
+        :param nLatencies: number of recent requests used for the latency percentiles
+        '''
+        cls=AudioClassifier.AudioClassifier(cfg)
+        cls.loadModels(modelDir)
+        self.labels=cls.labels
+        self.pcmSupported=cls.gmms is not None
+        self.componentName=componentName
+        self.workers=workers
+        self.executor=concurrent.futures.ProcessPoolExecutor(workers, initializer=initWorker,
+                                                             initargs=(modelDir, utils.configDict(cfg)))
+        self.lock=threading.Lock()
+        self.start=time.time()
+        self.pending=0
+        self.counters={"requests": 0, "errors": 0, "audio": 0.0}
+        self.latencies=collections.deque(maxlen=nLatencies)
+
+    def classify(self, kind, data, segLen=None, hop=None):
+        '''
+        Classify audio in the worker pool (blocks until the result is ready)
+        :param kind: "file" or "pcm"
+        :param data: audio file name or 16 bit PCM bytes at the working sample rate
+        :param segLen: segment length (default: Configuration.segLen)
+        :param hop: distance between segments (default: Configuration.segHop)
+        :returns: tuple with list of predictions and duration (sec)
+        '''
+        t0=time.time()
+        with self.lock:
+            self.pending+=1
+        try:
+            (preds, dur)=self.executor.submit(classifyTask, (kind, data, segLen, hop)).result()
+        except Exception:
+            with self.lock:
+                self.counters["errors"]+=1
+            raise
+        finally:
+            with self.lock:
+                self.pending-=1
+        with self.lock:
+            self.counters["requests"]+=1
+            self.counters["audio"]+=dur
+            self.latencies.append(time.time()-t0)
+        return (preds, dur)
+
+    def stats(self):
+        '''
+        Service statistics
+        :returns: dict with queue depth, counters and latency percentiles (sec)
+        '''
+        with self.lock:
+            lat=np.array(self.latencies)
+            res={"uptime": time.time()-self.start, "workers": self.workers, "pending": self.pending,
+                 "queueDepth": max(self.pending-self.workers, 0)}
+            res.update(self.counters)
+        if len(lat)>0:
+            (p50, p90, p99)=np.percentile(lat, [50, 90, 99])
+            res["latency"]={"p50": p50, "p90": p90, "p99": p99, "max": float(lat.max()), "n": len(lat)}
+        return res
+
+    def close(self):
+        '''Stop the worker processes'''
+        self.executor.shutdown()
+
+
+class ClassifyHandler(http.server.BaseHTTPRequestHandler):
+    '''
+    HTTP API:
+     POST /classify?file=<audio file>    classify a local audio file
+     POST /classify (16 bit PCM body)    classify uploaded audio at the working sample rate
+          optional parameters: format=json|csv, seg_len, hop, component,
+          start (sample start time, ISO format)
+     GET  /stats                         queue depth, counters and latency percentiles
+     GET  /labels                        list of labels
+    '''
+    protocol_version="HTTP/1.1"
+
+    def do_GET(self):
+        url=urllib.parse.urlsplit(self.path)
+        if url.path=="/stats":
+            self.reply(200, "application/json", json.dumps(self.server.service.stats(), indent=2))
+        elif url.path=="/labels":
+            self.reply(200, "application/json", json.dumps(self.server.service.labels))
+        else:
+            self.reply(404, "text/plain", "Not found\n")
+
+    def do_POST(self):
+        url=urllib.parse.urlsplit(self.path)
+        service=self.server.service
+        length=int(self.headers.get("Content-Length", 0))
+        body=self.rfile.read(length) if length>0 else b""
+        if url.path!="/classify":
+            self.reply(404, "text/plain", "Not found\n")
+            return
+        query=dict(urllib.parse.parse_qsl(url.query))
+        try:
+            segLen=float(query["seg_len"]) if "seg_len" in query else None
+            hop=float(query["hop"]) if "hop" in query else None
+            if "file" in query:
+                (kind, data)=("file", query["file"])
+                sampleDateTime=datetime.datetime.fromtimestamp(os.path.getmtime(data))
+            else:
+                if not service.pcmSupported:
+                    raise ValueError("uploaded audio requires the numpy backend")
+                if len(body)<2:
+                    raise ValueError("missing file parameter or PCM data")
+                (kind, data)=("pcm", body[:len(body)//2*2])
+                sampleDateTime=datetime.datetime.now()
+            if "start" in query:
+                sampleDateTime=datetime.datetime.fromisoformat(query["start"])
+        except (ValueError, OSError) as e:
+            self.reply(400, "text/plain", "{}\n".format(e))
+            return
+        try:
+            (preds, dur)=service.classify(kind, data, segLen, hop)
+        except Exception as e:
+            logging.error("ERROR: Failed to classify\n{}\n".format(e))
+            self.reply(500, "text/plain", "{}\n".format(e))
+            return
+        if query.get("format", "json")=="csv":
+            lines=[classify.csvHeader(service.labels)]
+            lines.extend(classify.pred2csv(service.labels, p) for p in preds)
+            self.reply(200, "text/csv", "\n".join(lines)+"\n")
+        else:
+            componentName=query.get("component", service.componentName)
+            res=[json.loads(classify.pred2json(componentName, p, sampleDateTime)) for p in preds]
+            self.reply(200, "application/json", json.dumps(res, indent=2))
+
+    def reply(self, status, contentType, text):
+        '''
+        Send a response
+        :param status: HTTP status code
+        :param contentType: content type
+        :param text: response body
+        '''
+        data=text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logging.info("server: "+format%args)
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    '''HTTP server on a Unix socket'''
+    daemon_threads=True
+
+    def get_request(self):
+        (conn, addr)=socketserver.UnixStreamServer.get_request(self)
+        # BaseHTTPRequestHandler expects a (host, port) client address
+        return (conn, ("local", 0))
+
+
+def main(argv):
+    '''Command line classification service.'''
+
+    parser = argparse.ArgumentParser(description="Audio classification service")
+    parser.add_argument("-v", "--verbose", dest="verbose", action="count", help="increase verbosity level", default=0)
+    parser.add_argument("-m", "--model_dir", dest="modelDir", default="./models", help="input directory for models data [%(default)s]")
+    parser.add_argument("--cache_dir", dest="cacheDir", help="folder of the persistent features cache [Configuration.cacheDir]")
+    parser.add_argument("-n", "--component_name", dest="componentName", default="audio", help="Name of the component in the JSON responses [%(default)s]")
+    parser.add_argument("-w", "--workers", dest="workers", type=int, default=os.cpu_count(), help="number of worker processes [%(default)s]")
+    parser.add_argument("-p", "--port", dest="port", type=int, default=8090, help="HTTP port on localhost [%(default)s]")
+    parser.add_argument("--host", dest="host", default="127.0.0.1", help="HTTP address [%(default)s]")
+    parser.add_argument("-u", "--socket", dest="socketPath", help="serve on this Unix socket instead of HTTP port")
+    args = parser.parse_args()
+    if args.verbose==1:
+        logging.basicConfig(level=logging.INFO)
+    if args.verbose>1:
+        logging.basicConfig(level=logging.DEBUG)
+    cfg=Configuration
+    if args.cacheDir:
+        cfg.cacheDir=args.cacheDir
+
+    service=ClassifyService(args.modelDir, cfg, args.workers, args.componentName)
+    if args.socketPath:
+        if os.path.exists(args.socketPath):
+            os.remove(args.socketPath)
+        server=UnixHTTPServer(args.socketPath, ClassifyHandler)
+        logging.info("server: listening on "+args.socketPath)
+    else:
+        server=http.server.ThreadingHTTPServer((args.host, args.port), ClassifyHandler)
+        logging.info("server: listening on {}:{}".format(args.host, args.port))
+    server.service=service
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+        if args.socketPath and os.path.exists(args.socketPath):
+            os.remove(args.socketPath)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,138 @@
+'''
+smart.audio.stats - Processing timers and counters.
+'''
+
+# SMART FP7 - Search engine for MultimediA enviRonment generated contenT
+# Webpage: http://smartfp7.eu
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# The Original Code is Copyright (C) 2013 IBM Corp.
+# All Rights Reserved
+#
+# Contributor(s):
+#  Zvi Kons <zvi@il.ibm.com>
+
+import contextlib
+import sys
+import threading
+import time
+
+
+class Stats:
+    '''
+    Thread safe timers and counters of the processing stages.
+    Each timer keeps the number of calls, the total and the maximal time.
+    '''
+
+    def __init__(self):
+        self.lock=threading.Lock()
+        self.reset()
+
+    def reset(self):
+        '''Clear all timers and counters'''
+        with self.lock:
+            self.start=time.time()
+            # name -> [calls, total, max]
+            self.timers={}
+            self.counters={}
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        '''
+        Context manager timing a stage
+        :param name: stage name
+        '''
+        t0=time.perf_counter()
+        try:
+            yield
+        finally:
+            self.addTime(name, time.perf_counter()-t0)
+
+    def addTime(self, name, sec, calls=1, maxSec=None):
+        '''
+        Add time to a stage timer
+        :param name: stage name
+        :param sec: time (sec)
+        :param calls: number of calls
+        :param maxSec: longest call (default: sec)
+        '''
+        with self.lock:
+            t=self.timers.setdefault(name, [0, 0.0, 0.0])
+            t[0]+=calls
+            t[1]+=sec
+            t[2]=max(t[2], sec if maxSec is None else maxSec)
+
+    def count(self, name, n=1):
+        '''
+        Increment a counter
+        :param name: counter name
+        :param n: increment
+        '''
+        with self.lock:
+            self.counters[name]=self.counters.get(name, 0)+n
+
+    def snapshot(self):
+        '''
+        Current values
+        :returns: dict with uptime, timers (calls, total and max of each stage) and counters
+        '''
+        with self.lock:
+            timers=dict((k, {"calls": v[0], "total": v[1], "max": v[2]}) for (k, v) in self.timers.items())
+            return {"uptime": time.time()-self.start, "timers": timers, "counters": dict(self.counters)}
+
+    def merge(self, snap):
+        '''
+        Add the values of a snapshot (e.g. from a worker process)
+        :param snap: dict returned by snapshot
+        '''
+        for (name, t) in snap["timers"].items():
+            self.addTime(name, t["total"], t["calls"], t["max"])
+        for (name, n) in snap["counters"].items():
+            self.count(name, n)
+
+    def dump(self):
+        '''
+        Text format of the current values, one metric per line
+        :returns: string
+        '''
+        snap=self.snapshot()
+        lines=["smart_audio_uptime_seconds {:.3f}".format(snap["uptime"])]
+        for name in sorted(snap["timers"]):
+            t=snap["timers"][name]
+            lines.append('smart_audio_stage_calls_total{{stage="{}"}} {}'.format(name, t["calls"]))
+            lines.append('smart_audio_stage_seconds_total{{stage="{}"}} {:.6f}'.format(name, t["total"]))
+            lines.append('smart_audio_stage_seconds_max{{stage="{}"}} {:.6f}'.format(name, t["max"]))
+        for name in sorted(snap["counters"]):
+            lines.append('smart_audio_{}_total {}'.format(name, snap["counters"][name]))
+        return "\n".join(lines)+"\n"
+
+
+class StatsDumper:
+    '''Background thread writing the statistics periodically'''
+
+    def __init__(self, stats, period, fout=None):
+        '''
+        :param stats: Stats object
+        :param period: time between dumps (sec)
+        :param fout: output file (default: standard error)
+        '''
+        self.stats=stats
+        self.period=period
+        self.fout=fout or sys.stderr
+        self.stopping=threading.Event()
+        self.thread=threading.Thread(target=self.run, name="StatsDumper", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        '''Background thread loop'''
+        while not self.stopping.wait(self.period):
+            self.fout.write(self.stats.dump())
+            self.fout.flush()
+
+    def close(self):
+        '''Stop the background thread'''
+        self.stopping.set()
+        self.thread.join()
@@ -0,0 +1,322 @@
+'''
+smart.audio.stream - Incremental classification of live audio.
+'''
+
+# SMART FP7 - Search engine for MultimediA enviRonment generated contenT
+# Webpage: http://smartfp7.eu
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# The Original Code is Copyright (C) 2013 IBM Corp.
+# All Rights Reserved
+#
+# Contributor(s):
+#  Zvi Kons <zvi@il.ibm.com>
+
+import collections
+import time
+import numpy as np
+from smart.audio import features
+from smart.audio.stats import Stats
+
+
+class StreamFeatures:
+    '''
+    Incremental MFCC with delta and delta^2. The output is identical to
+    features.extract of the whole stream. Each frame is returned as soon as
+    the frames needed for its dynamic features are available.
+    '''
+
+    def __init__(self, cfg, stats=None):
+        '''
+        :param cfg: configuration
+        :param stats: optional Stats object timing the features stages
+        '''
+        self.cfg=cfg
+        self.stats=stats or Stats()
+        # the first frame is centered on the first sample
+        self.buf=np.zeros(cfg.winLen//2)
+        self.nSamples=0
+        self.nFrames=0
+        self.width=max(len(w) for w in features.DELTA_WINDOWS)//2
+        # static frames kept for the delta context
+        self.static=np.zeros((0, cfg.nMfcc))
+        self.first=0
+        self.emitted=0
+        # energy of the frames which were not returned yet
+        self.energy=np.zeros(0, dtype=np.float32)
+        # energy of the frames returned by the last call (dB)
+        self.lastEnergy=np.zeros(0, dtype=np.float32)
+
+    def push(self, x):
+        '''
+        Add audio samples
+        :param x: audio samples (16 bit scale)
+        :returns: float32 array of new feature frames (frames x ftrLen)
+        '''
+        self.nSamples+=len(x)
+        self.buf=np.concatenate([self.buf, x])
+        n=0
+        if len(self.buf)>=self.cfg.winLen:
+            n=(len(self.buf)-self.cfg.winLen)//self.cfg.frmLen+1
+        return self.addFrames(n, False)
+
+    def flush(self):
+        '''
+        End of stream: pad the last frames with zeros
+        :returns: float32 array of the remaining feature frames
+        '''
+        n=features.nFrames(self.nSamples, self.cfg.winLen, self.cfg.frmLen)-self.nFrames
+        need=(n-1)*self.cfg.frmLen+self.cfg.winLen if n>0 else 0
+        if need>len(self.buf):
+            self.buf=np.concatenate([self.buf, np.zeros(need-len(self.buf))])
+        return self.addFrames(n, True)
+
+    def addFrames(self, n, final):
+        '''
+        Calculate the static features of n frames from the buffer and
+        return all the frames with complete dynamic features
+        '''
+        if n>0:
+            # the buffer already holds the zeros before the first frame
+            shape=(n, self.cfg.winLen)
+            strides=(self.buf.strides[0]*self.cfg.frmLen, self.buf.strides[0])
+            with self.stats.timer("framing"):
+                frm=np.lib.stride_tricks.as_strided(self.buf, shape=shape, strides=strides, writeable=False)
+            if self.cfg.silenceDb is not None:
+                with self.stats.timer("energy"):
+                    self.energy=np.concatenate([self.energy, features.frameEnergy(frm).astype(np.float32)])
+            with self.stats.timer("mfcc"):
+                c=features.mfcc(frm, self.cfg.nMfcc, self.cfg.mfccFs).astype(np.float32)
+            self.static=np.vstack([self.static, c.astype(np.float64)])
+            self.buf=self.buf[n*self.cfg.frmLen:].copy()
+            self.nFrames+=n
+            self.stats.count("frames", n)
+        last=self.nFrames if final else self.nFrames-self.width
+        if last<=self.emitted:
+            self.lastEnergy=self.energy[:0]
+            return np.zeros((0, self.cfg.ftrLen), dtype=np.float32)
+        with self.stats.timer("deltas"):
+            d=features.delta(self.static)
+            out=d[self.emitted-self.first:last-self.first].astype(np.float32)
+        (self.lastEnergy, self.energy)=(self.energy[:last-self.emitted], self.energy[last-self.emitted:])
+        self.emitted=last
+        # keep the left context of the next frames
+        keep=max(last-self.width, self.first)
+        self.static=self.static[keep-self.first:]
+        self.first=keep
+        return out
+
+
+class StreamClassifier:
+    '''
+    Incremental classification of an audio stream. Scores are returned for
+    each segment as soon as all its frames were received.
+    '''
+
+    def __init__(self, cls, segLen=None, hop=None):
+        '''
+        :param cls: AudioClassifier with loaded models
+        :param segLen: segment length (default: Configuration.segLen)
+        :param hop: distance between segments (default: Configuration.segHop)
+        '''
+        self.cls=cls
+        self.cfg=cls.cfg
+        self.segLen=segLen or self.cfg.segLen
+        self.hop=hop or self.cfg.segHop or self.segLen
+        self.ftr=StreamFeatures(self.cfg, cls.stats)
+        # cumulative frame log likelihoods starting at frame self.cumFirst
+        # (with the count of scored frames in the last column)
+        self.cum=np.zeros((1, cls.gmms.nModels+1))
+        self.cumFirst=0
+        self.nSeg=0
+        # arrival time of the received samples
+        self.arrivals=collections.deque()
+        self.procTime=0.0
+        self.lagSum=0.0
+        self.lagMax=0.0
+
+    def push(self, x, arrival=None):
+        '''
+        Add audio samples
+        :param x: audio samples (16 bit scale)
+        :param arrival: wall clock time the samples were received
+        :returns: list of predictions for the completed segments
+        '''
+        t0=time.time()
+        (ftr, active)=self.features(x, arrival or t0)
+        res=self.score(ftr, active, False)
+        self.procTime+=time.time()-t0
+        return res
+
+    def flush(self):
+        '''
+        End of stream
+        :returns: list of predictions for the remaining segments
+        '''
+        t0=time.time()
+        (ftr, active)=self.features(None)
+        res=self.score(ftr, active, True)
+        self.procTime+=time.time()-t0
+        return res
+
+    def features(self, x, arrival=None):
+        '''
+        Add audio samples and calculate the new feature frames
+        :param x: audio samples (16 bit scale), None at the end of the stream
+        :param arrival: wall clock time the samples were received
+        :returns: tuple with features array of the new frames and their
+                  activity (None when silence detection is disabled)
+        '''
+        if x is None:
+            ftr=self.ftr.flush()
+        else:
+            self.arrivals.append((self.ftr.nSamples+len(x), arrival or time.time()))
+            ftr=self.ftr.push(x)
+        return (ftr, self.cls.activeFrames(self.ftr.lastEnergy))
+
+    def score(self, ftr, active, final):
+        '''
+        Score new frames and return the completed segments
+        '''
+        cum=self.cls.ftrLogLik(ftr, active) if len(ftr)>0 else None
+        return self.addScores(cum, final)
+
+    def addScores(self, cum, final):
+        '''
+        Add the scores of new frames and return the completed segments
+        :param cum: cumulative frame log likelihoods of the new frames as
+                    returned by AudioClassifier.ftrLogLik, or None
+        :param final: end of stream
+        :returns: list of predictions
+        '''
+        if cum is not None and len(cum)>1:
+            self.cum=np.vstack([self.cum, self.cum[-1]+cum[1:]])
+        nFrames=self.cumFirst+len(self.cum)-1
+        dur=self.ftr.nSamples/self.cfg.samplerate
+        res=[]
+        while True:
+            t1=self.nSeg*self.hop
+            t2=t1+self.segLen
+            if final:
+                if t1>=dur:
+                    break
+                (f1,f2)=self.cls.segFrames(t1, min(t2,dur), nFrames)
+            else:
+                # the segment is complete when the frames after it are available
+                (f1,f2)=self.cls.segFrames(t1, t2, nFrames+1)
+                if f2>=nFrames+1:
+                    break
+            p=self.cls.segmentScores(self.cum[f2-self.cumFirst]-self.cum[f1-self.cumFirst], f2-f1)
+            p["t1"]=t1
+            p["t2"]=t2
+            res.append(p)
+            lag=time.time()-self.arrivalTime(int(min(t2, dur)*self.cfg.samplerate))
+            self.lagSum+=lag
+            self.lagMax=max(self.lagMax, lag)
+            self.nSeg+=1
+            self.cls.stats.count("segments")
+        # drop the frames before the next segment
+        (f1,f2)=self.cls.segFrames(self.nSeg*self.hop, self.nSeg*self.hop, nFrames+1)
+        f1=min(f1, nFrames)
+        if f1>self.cumFirst:
+            self.cum=self.cum[f1-self.cumFirst:]
+            self.cumFirst=f1
+        return res
+
+    def arrivalTime(self, sample):
+        '''
+        Wall clock time a sample was received
+        :param sample: sample index
+        :returns: time (sec since epoch)
+        '''
+        while len(self.arrivals)>1 and self.arrivals[0][0]<sample:
+            self.arrivals.popleft()
+        return self.arrivals[0][1]
+
+    def metrics(self):
+        '''
+        Processing metrics
+        :returns: dict with audio and processing time, real time factor
+                  and segment latency (average and maximum)
+        '''
+        audio=self.ftr.nSamples/self.cfg.samplerate
+        return {"audio": audio, "processing": self.procTime, "rtf": self.procTime/max(audio, 1e-9),
+                "segments": self.nSeg, "lagAvg": self.lagSum/max(self.nSeg, 1), "lagMax": self.lagMax}
+
+
+class MultiStreamClassifier:
+    '''
+    Incremental classification of several audio streams with one copy of
+    the models. The new frames of all the streams are scored together in a
+    single call to the models.
+    '''
+
+    def __init__(self, cls, segLen=None, hop=None):
+        '''
+        :param cls: AudioClassifier with loaded models
+        :param segLen: segment length (default: Configuration.segLen)
+        :param hop: distance between segments (default: Configuration.segHop)
+        '''
+        self.cls=cls
+        self.segLen=segLen
+        self.hop=hop
+        self.streams={}
+        self.batches=0
+        self.procTime=0.0
+
+    def add(self, name):
+        '''
+        Add a stream
+        :param name: stream name
+        '''
+        self.streams[name]=StreamClassifier(self.cls, self.segLen, self.hop)
+
+    def push(self, chunks):
+        '''
+        Add audio of several streams
+        :param chunks: list of (stream name, audio samples, arrival time),
+                       samples are None at the end of the stream
+        :returns: list of (stream name, list of predictions for the completed segments)
+        '''
+        t0=time.time()
+        parts=[]
+        for (name, x, arrival) in chunks:
+            sc=self.streams[name]
+            (ftr, active)=sc.features(x, arrival)
+            parts.append((name, ftr, active, x is None))
+        nFrames=sum(len(p[1]) for p in parts)
+        cum=None
+        if nFrames>0:
+            # one scoring call for the frames of all the streams
+            ftr=np.concatenate([p[1] for p in parts])
+            active=None
+            if self.cls.cfg.silenceDb is not None:
+                active=np.concatenate([p[2] for p in parts])
+            cum=self.cls.ftrLogLik(ftr, active)
+            self.cls.stats.count("batchedFrames", nFrames)
+        self.batches+=1
+        res=[]
+        first=0
+        for (name, ftr, active, final) in parts:
+            n=len(ftr)
+            part=cum[first:first+n+1]-cum[first] if n>0 else None
+            first+=n
+            res.append((name, self.streams[name].addScores(part, final)))
+        dt=time.time()-t0
+        self.procTime+=dt
+        # the processing time is shared by the streams in proportion to their frames
+        for (name, ftr, active, final) in parts:
+            self.streams[name].procTime+=dt*len(ftr)/max(nFrames, 1)
+        return res
+
+    def metrics(self):
+        '''
+        Processing metrics
+        :returns: dict with the metrics of each stream (see StreamClassifier.metrics)
+                  and the number of scoring batches
+        '''
+        res=dict((name, sc.metrics()) for (name, sc) in self.streams.items())
+        return {"streams": res, "batches": self.batches, "processing": self.procTime}
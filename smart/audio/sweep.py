@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+# SMART FP7 - Search engine for MultimediA enviRonment generated contenT
+# Webpage: http://smartfp7.eu
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# The Original Code is Copyright (C) 2013 IBM Corp.
+# All Rights Reserved
+#
+# Contributor(s):
+#  Zvi Kons <zvi@il.ibm.com>
+
+
+"""
+smart.audio.sweep - Train and test a grid of configuration values CLI.
+"""
+import sys
+
+from smart.audio import AudioClassifier, Configuration, utils
+from smart.audio.cache import FEATURE_KEYS
+import argparse
+import concurrent.futures
+import csv
+import itertools
+import logging
+import os
+import os.path
+import tempfile
+import time
+
+# Configuration values which do not change the trained models
+SEGMENT_KEYS=("segLen", "segHop")
+
+
+def parseValue(key, text):
+    '''
+    Convert a grid value to the type of the configuration variable
+    :param key: configuration variable name
+    :param text: value
+    :returns: converted value
+    '''
+    if text.lower()=="none":
+        return None
+    default=getattr(Configuration, key)
+    if isinstance(default, bool):
+        return text.lower() in ("1", "true", "yes")
+    for t in (int, float):
+        if isinstance(default, t) or default is None:
+            try:
+                return t(text)
+            except ValueError:
+                pass
+    return text
+
+def parseGrid(params):
+    '''
+    Parse the grid arguments
+    :param params: list of "key=v1,v2,..." strings
+    :returns: list of (key, list of values)
+    '''
+    grid=[]
+    for p in params:
+        (key, values)=p.split("=", 1)
+        if not hasattr(Configuration, key):
+            raise ValueError("unknown configuration variable "+key)
+        grid.append((key, [parseValue(key, v) for v in values.split(",")]))
+    return grid
+
+def gridConfigs(base, grid):
+    '''
+    All the configurations of a grid
+    :param base: dict with the configuration values
+    :param grid: list of (key, list of values)
+    :returns: list of tuples with the grid values and the configuration dict
+    '''
+    res=[]
+    for values in itertools.product(*[v for (k, v) in grid]):
+        d=dict(base)
+        d.update(zip([k for (k, v) in grid], values))
+        if "nMfcc" in dict(grid) and "ftrLen" not in dict(grid):
+            # MFCC with delta and delta^2
+            d["ftrLen"]=3*d["nMfcc"]
+        res.append((values, d))
+    return res
+
+def extractFeatures(cfgDict, fileNames):
+    '''
+    Calculate the features of the files into the cache
+    :param cfgDict: configuration values (with cacheDir)
+    :param fileNames: list of audio files
+    '''
+    cls=AudioClassifier.AudioClassifier(utils.configFromDict(cfgDict))
+    for ftr in cls.iterFeatures(fileNames):
+        pass
+
+def runJob(task):
+    '''
+    Train models for one configuration and test them for several segmentations
+    :param task: tuple with configuration dict, list of (segment length, hop),
+                 training and testing list files and models folder
+    :returns: tuple with labels, list of ((segment length, hop), dict with EER of each label,
+              scoring real time factor) and training time (sec)
+    '''
+    (cfgDict, segs, trainList, testList, modelDir)=task
+    cfg=utils.configFromDict(cfgDict, nJobs=1, keepStats=False)
+    trn=AudioClassifier.AudioClassifier(cfg)
+    t0=time.perf_counter()
+    trn.createAllGmms(modelDir, trn.loadFilesData(trainList))
+    trainTime=time.perf_counter()-t0
+    cls=AudioClassifier.AudioClassifier(cfg)
+    cls.loadModels(modelDir)
+    scr=dict((seg, dict((label, []) for label in cls.labels)) for seg in segs)
+    trg=dict((seg, dict((label, []) for label in cls.labels)) for seg in segs)
+    scoring=0.0
+    audio=0.0
+    for f in cls.loadFilesData(testList):
+        # the features are read from the cache
+        (ftr, dur)=cls.fileFeatures(f[0])
+        t0=time.perf_counter()
+        cum=cls.ftrLogLik(ftr)
+        scoring+=time.perf_counter()-t0
+        audio+=dur
+        for (segLen, hop) in segs:
+            (scr1, trg1)=cls.testPreds(f, cls.windowScores(cum, dur, segLen, hop))
+            for label in cls.labels:
+                scr[(segLen, hop)][label].extend(scr1[label])
+                trg[(segLen, hop)][label].extend(trg1[label])
+    rtf=scoring/max(audio, 1e-9)
+    res=[]
+    for seg in segs:
+        eers=dict((label, utils.eer(scr[seg][label], trg[seg][label])) for label in cls.labels)
+        res.append((seg, eers, rtf))
+    return (cls.labels, res, trainTime)
+
+def main(argv):
+    '''Command line configuration sweep.'''
+
+    parser = argparse.ArgumentParser(description="Train and test audio classifiers for a grid of configuration values")
+    parser.add_argument("-v", "--verbose", dest="verbose", action="count", help="increase verbosity level", default=0)
+    parser.add_argument("-p", "--param", dest="params", action="append", default=[], help="configuration variable and values, e.g. nGauss=16,32,64 (repeat for a grid)")
+    parser.add_argument("-w", "--workers", dest="workers", type=int, default=os.cpu_count(), help="number of parallel jobs [%(default)s]")
+    parser.add_argument("-d", "--work_dir", dest="workDir", help="folder for the models of all the configurations [temporary folder]")
+    parser.add_argument("--cache_dir", dest="cacheDir", help="folder of the features cache shared by the configurations [Configuration.cacheDir or work folder]")
+    parser.add_argument("-o", "--output", dest="output", help="also write the results table to a CSV file")
+    parser.add_argument("train_list", help="file containing list of training samples and labels")
+    parser.add_argument("test_list", help="file containing list of testing samples and labels")
+    args = parser.parse_args()
+    if args.verbose==1:
+        logging.basicConfig(level=logging.INFO)
+    if args.verbose>1:
+        logging.basicConfig(level=logging.DEBUG)
+    try:
+        grid=parseGrid(args.params)
+    except ValueError as e:
+        parser.error(str(e))
+    keys=[k for (k, v) in grid]
+
+    with tempfile.TemporaryDirectory() as tmpDir:
+        workDir=args.workDir or tmpDir
+        base=utils.configDict(Configuration)
+        base["cacheDir"]=args.cacheDir or Configuration.cacheDir or os.path.join(workDir, "cache")
+        configs=gridConfigs(base, grid)
+        # the segments are scored with the in-process models
+        sptk=sorted(set(d["backend"] for (values, d) in configs if d["backend"] in AudioClassifier.SPTK_BACKENDS))
+        if sptk:
+            parser.error("backend {} is not supported, the sweep scores with the numpy backend".format(", ".join(sptk)))
+        cls=AudioClassifier.AudioClassifier(Configuration)
+        fileNames=[f[0] for listFile in (args.train_list, args.test_list) for f in cls.loadFilesData(listFile)]
+
+        # the features are calculated once for each front-end configuration
+        frontEnds={}
+        for (values, d) in configs:
+            frontEnds.setdefault(tuple(d[k] for k in FEATURE_KEYS), d)
+        logging.info("sweep: {} configurations, {} feature sets".format(len(configs), len(frontEnds)))
+        t0=time.perf_counter()
+        for d in frontEnds.values():
+            extractFeatures(dict(d, nJobs=args.workers), fileNames)
+        print("Features of {} files for {} front-end configurations in {:.1f} sec".format(len(fileNames), len(frontEnds), time.perf_counter()-t0), file=sys.stderr)
+
+        # configurations which differ only by the segmentation share the models
+        jobs={}
+        for (values, d) in configs:
+            jobKey=tuple((k, d[k]) for k in sorted(d) if k not in SEGMENT_KEYS)
+            jobs.setdefault(jobKey, []).append((values, d))
+        tasks=[]
+        for (i, members) in enumerate(jobs.values()):
+            segs=list(dict.fromkeys((d["segLen"], d["segHop"]) for (values, d) in members))
+            tasks.append((members[0][1], segs, args.train_list, args.test_list, os.path.join(workDir, "models_{}".format(i))))
+        rows=[]
+        labels=None
+        with concurrent.futures.ProcessPoolExecutor(args.workers) as executor:
+            for (members, res) in zip(jobs.values(), executor.map(runJob, tasks)):
+                (labels, results, trainTime)=res
+                bySeg=dict((seg, (eers, rtf)) for (seg, eers, rtf) in results)
+                for (values, d) in members:
+                    (eers, rtf)=bySeg[(d["segLen"], d["segHop"])]
+                    rows.append((values, eers, rtf, trainTime))
+
+    header=keys+labels+["meanEER", "rtf", "trainSec"]
+    table=[]
+    for (values, eers, rtf, trainTime) in rows:
+        mean=sum(eers.values())/max(len(eers), 1)
+        table.append([str(v) for v in values]+["{:.2f}".format(100*eers[l]) for l in labels]+
+                     ["{:.2f}".format(100*mean), "{:.5f}".format(rtf), "{:.1f}".format(trainTime)])
+    widths=[max(len(h), *(len(r[i]) for r in table)) for (i, h) in enumerate(header)]
+    print("  ".join(h.rjust(w) for (h, w) in zip(header, widths)))
+    for r in table:
+        print("  ".join(c.rjust(w) for (c, w) in zip(r, widths)))
+    if args.output:
+        with open(args.output, "wt", newline="") as fout:
+            writer=csv.writer(fout)
+            writer.writerow(header)
+            writer.writerows(table)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
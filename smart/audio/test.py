@@ -24,6 +24,44 @@ import sys
 from smart.audio import AudioClassifier, Configuration, utils
 import argparse
 import logging
+import time
+
+
+def compareTopC(cls, fd, topC):
+    '''
+    Compare the EER and the scoring time of full scoring and top-C Gaussian selection
+    :param cls: classifier with loaded models
+    :param fd: list of audio files and labels
+    :param topC: number of selected UBM Gaussians
+    :returns: exit code
+    '''
+    if cls.gmms is None:
+        logging.critical("top-C scoring requires the numpy backend\n")
+        return 1
+    if not cls.gmms.aligned:
+        logging.warning("The models are not adapted from the UBM, top-C scores are not reliable")
+    modes=(None, topC)
+    scr=dict((c, dict((label, []) for label in cls.labels)) for c in modes)
+    trg=dict((label, []) for label in cls.labels)
+    times=dict((c, 0.0) for c in modes)
+    for f in fd:
+        (ftr, dur)=cls.fileFeatures(f[0])
+        for c in modes:
+            cls.gmms.topC=c
+            t0=time.perf_counter()
+            cum=cls.ftrLogLik(ftr)
+            times[c]+=time.perf_counter()-t0
+            (scr1,trg1)=cls.testPreds(f, cls.windowScores(cum, dur))
+            for label in cls.labels:
+                scr[c][label].extend(scr1[label])
+                if c is None:
+                    trg[label].extend(trg1[label])
+    for label in cls.labels:
+        e0=utils.eer(scr[None][label], trg[label])
+        e1=utils.eer(scr[topC][label], trg[label])
+        print("{}: {:.2f}% top-{} {:.2f}% (delta {:+.2f}%)".format(label, 100*e0, topC, 100*e1, 100*(e1-e0)))
+    print("scoring time: full {:.3f} sec, top-{} {:.3f} sec, speedup {:.2f}x".format(times[None], topC, times[topC], times[None]/max(times[topC], 1e-9)))
+    return 0
 
 
 def main(argv): 
@@ -32,6 +70,10 @@ def main(argv):
     parser = argparse.ArgumentParser(description="Test audio classifier using a testing set")
     parser.add_argument("-v", "--verbose", dest="verbose", action="count", help="increase verbosity level", default=0)
     parser.add_argument("-m", "--model_dir", dest="modelDir", default="./models", help="input directory for models data [%(default)s]")
+    parser.add_argument("--cache_dir", dest="cacheDir", help="folder of the persistent features cache [Configuration.cacheDir]")
+    parser.add_argument("-a", "--all_metrics", dest="allMetrics", action="store_true", help="print also the interpolated EER and the minimal DCF")
+    parser.add_argument("-C", "--top_c", dest="topC", type=int, help="compare full scoring with scoring of the top C UBM Gaussians")
+    parser.add_argument("--stats", dest="stats", action="store_true", help="print processing timers and counters to the standard error at the end")
     parser.add_argument("list_file", help="file containing list of testing samples and labels")
     args = parser.parse_args()
     if args.verbose==1:
@@ -39,9 +81,13 @@ def main(argv):
     if args.verbose>1:
         logging.basicConfig(level=logging.DEBUG)
     cfg=Configuration
+    if args.cacheDir:
+        cfg.cacheDir=args.cacheDir
     cls=AudioClassifier.AudioClassifier(cfg)
     cls.loadModels(args.modelDir)
     fd=cls.loadFilesData(args.list_file)
+    if args.topC:
+        return compareTopC(cls, fd, args.topC)
 
     # create long source and target vectors from all audio files and labels
     scr={}
@@ -56,7 +102,13 @@ def main(argv):
             trg[label].extend(trg1[label])
     # print EER for each label
     for label in cls.labels:
-        print("{}: {:.2f}%".format(label, 100*utils.eer(scr[label], trg[label])))
+        if args.allMetrics:
+            print("{}: {:.2f}% (interpolated {:.2f}%, minDCF {:.4f})".format(label, 100*utils.eer(scr[label], trg[label]),
+                100*utils.eerInterp(scr[label], trg[label]), utils.minDcf(scr[label], trg[label])))
+        else:
+            print("{}: {:.2f}%".format(label, 100*utils.eer(scr[label], trg[label])))
+    if args.stats:
+        sys.stderr.write(cls.stats.dump())
 
 if __name__ == "__main__":
     sys.exit(main(sys.argv))
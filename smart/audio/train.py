@@ -24,6 +24,7 @@ import sys
 from smart.audio import AudioClassifier, Configuration
 import argparse
 import logging
+import os.path
 
 
 def main(argv): 
@@ -32,20 +33,71 @@ def main(argv):
     parser = argparse.ArgumentParser(description="Train audio classifier from training set")
     parser.add_argument("-v", "--verbose", dest="verbose", action="count", help="increase verbosity level", default=0)
     parser.add_argument("-m", "--model_dir", dest="modelDir", default="./models", help="output directory for models data [%(default)s]")
-    parser.add_argument("list_file", help="file containing list of training samples and labels")
+    parser.add_argument("--cache_dir", dest="cacheDir", help="folder of the persistent features cache [Configuration.cacheDir]")
+    parser.add_argument("-j", "--jobs", dest="jobs", type=int, help="number of parallel jobs [number of CPUs]")
+    parser.add_argument("--stats", dest="stats", action="store_true", help="print processing timers and counters to the standard error at the end")
+    parser.add_argument("--stream_ubm", dest="streamUbm", action="store_true", help="train the UBM with bounded memory mini-batch EM")
+    parser.add_argument("--reservoir", dest="reservoir", type=int, help="train the streaming UBM on a random sample of this number of frames")
+    parser.add_argument("--checkpoint", dest="checkpoint", help="checkpoint file of the streaming UBM training [<model_dir>/ubm.ckpt.npz]")
+    parser.add_argument("--map", dest="map", action="store_true", help="adapt the label models from the UBM instead of training them independently")
+    parser.add_argument("-r", "--relevance", dest="relevance", type=float, help="MAP adaptation relevance factor [Configuration.mapRelevance]")
+    parser.add_argument("--map_adapt", dest="mapAdapt", help="MAP adapted parameters: any of w, m and v [Configuration.mapAdapt]")
+    parser.add_argument("--keep_stats", dest="keepStats", action="store_true", help="keep the statistics of the training data for --update even when this requires a second pass over the files [Configuration.keepStats]")
+    parser.add_argument("-u", "--update", dest="update", action="store_true", help="update the models with the files of the list which were not used before")
+    parser.add_argument("--bundle_only", dest="bundleOnly", action="store_true", help="only write the bundle file of the models in the model directory (with --map for models adapted from the UBM [as the existing bundle or statistics])")
+    parser.add_argument("list_file", nargs="?", help="file containing list of training samples and labels")
     args = parser.parse_args()
     if args.verbose==1:
         logging.basicConfig(level=logging.INFO)
     if args.verbose>1:
         logging.basicConfig(level=logging.DEBUG)
     cfg=Configuration
+    if args.cacheDir:
+        cfg.cacheDir=args.cacheDir
+    if args.jobs:
+        cfg.nJobs=args.jobs
+    if args.streamUbm or args.reservoir:
+        cfg.ubmTrainer="stream"
+    if args.reservoir:
+        cfg.ubmReservoir=args.reservoir
+    if args.checkpoint:
+        cfg.ubmCheckpoint=args.checkpoint
+    if args.map:
+        cfg.trainMode="map"
+    if args.relevance:
+        cfg.mapRelevance=args.relevance
+    if args.mapAdapt:
+        cfg.mapAdapt=args.mapAdapt
+    if args.keepStats:
+        cfg.keepStats=True
 
     # create classifier
     trn=AudioClassifier.AudioClassifier(cfg)
+    if args.bundleOnly:
+        trn.modelDir=args.modelDir
+        with open(os.path.join(args.modelDir, "labels.txt"), "rt") as flbl:
+            trn.labels=flbl.read().split()
+        # the bundle is stamped with the current configuration
+        try:
+            trn.checkModelFiles()
+        except AudioClassifier.TrainException as e:
+            logging.error("ERROR: {}\n".format(e.msg))
+            return 1
+        # the aligned flag enables the topC scoring of MAP adapted models
+        trn.saveBundle(args.map or trn.modelsAligned())
+        return 0
+    if not args.list_file:
+        parser.error("list_file is required")
     # load the file list
     fd=trn.loadFilesData(args.list_file)
-    # train GMMs
-    trn.createAllGmms(args.modelDir, fd)
+    if args.update:
+        # fold the new files into the existing models
+        trn.updateModels(args.modelDir, fd)
+    else:
+        # train GMMs
+        trn.createAllGmms(args.modelDir, fd)
+    if args.stats:
+        sys.stderr.write(trn.stats.dump())
 
 if __name__ == "__main__":
     sys.exit(main(sys.argv))
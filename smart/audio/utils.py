@@ -16,6 +16,35 @@ smart.audio.utils - Utilities functions.
 #  Zvi Kons <zvi@il.ibm.com>
 
 
+import types
+import statistics
+import numpy as np
+
+
+def configDict(cfg):
+    '''
+    Copy the configuration values into a dictionary
+    (e.g. for passing the configuration to worker processes)
+    :param cfg: configuration module or object
+    :returns: dict with the configuration values
+    '''
+    d={}
+    for (k, v) in vars(cfg).items():
+        if not k.startswith("_") and isinstance(v, (int, float, str, type(None))):
+            d[k]=v
+    return d
+
+def configFromDict(d, **overrides):
+    '''
+    Create a configuration object from a dictionary
+    :param d: dict with the configuration values
+    :param overrides: values replacing those in d
+    :returns: configuration object
+    '''
+    cfg=types.SimpleNamespace(**d)
+    for (k, v) in overrides.items():
+        setattr(cfg, k, v)
+    return cfg
 
 def eer(scr, trg):
     '''
@@ -25,49 +54,81 @@ def eer(scr, trg):
     :returns: EER
     '''
     (fa,md)=roc(scr, trg)
-    mind=10
     # find best point where fa~=md
-    for fm in zip(fa,md):
-        d=abs(fm[0]-fm[1])
-        if d<mind:
-            e=sum(fm)/2
-            mind=d
-    return e
+    i=np.argmin(np.abs(np.array(fa)-np.array(md)))
+    return (fa[i]+md[i])/2
 
-def  roc(scr, trg):   
+def roc(scr, trg):
     '''
     Calculate ROC: false alarm vs. miss detection curve
     :param scr: scores vector
     :param trg: target vector
     :returns: two vectors for false alarms and miss detection curve
     '''
+    scr=np.asarray(scr, dtype=np.float64)
     # convert target to Booleans
-    t1=[x>0.5 for x in trg]
+    t1=np.asarray(trg)>0.5
     # number of true
-    nt=sum(t1)
+    nt=int(np.sum(t1))
     # number of false
     nf=len(t1)-nt
     if nt==0 or nf==0:
         return ([0, 1], [1, 0])
-    #possible thresholds
-    ths=[min(scr)-1] # add point lower than min
-    ths.extend(set(scr)) # all unit scores
-    ths.append(max(scr)+1) # add point larger than max
-    ths.sort()
-    
-    # check FA / MD for all possible thresholds
-    fa=[]
-    md=[]
-    for th in ths:
-        fa1=0.0
-        md1=0.0
-        for st in zip(scr, t1):
-            # count how many positives have scores below threshold (MD)
-            if st[0]<th and st[1]:
-                md1+=1.0
-            # count how many negatives have scores above threshold (FA)
-            if st[0]>=th and not st[1]:
-                fa1+=1.0
-        fa.append(fa1/nf)
-        md.append(md1/nt)
-    return (fa, md)
+    # possible thresholds: all unique scores and points below and above them
+    ths=np.concatenate([[scr.min()-1], np.unique(scr), [scr.max()+1]])
+    # count positives with scores below threshold (MD) and
+    # negatives with scores above threshold (FA)
+    pos=np.sort(scr[t1])
+    neg=np.sort(scr[~t1])
+    md=np.searchsorted(pos, ths, side="left")/float(nt)
+    fa=(nf-np.searchsorted(neg, ths, side="left"))/float(nf)
+    return (fa.tolist(), md.tolist())
+
+def eerInterp(scr, trg):
+    '''
+    Calculate the EER by linear interpolation of the ROC curve
+    :param scr: scores vector
+    :param trg: target vector
+    :returns: EER
+    '''
+    (fa,md)=roc(scr, trg)
+    d=np.array(fa)-np.array(md)
+    # first point where the miss detection reaches the false alarm
+    i=int(np.argmax(d<=0))
+    if i==0:
+        return (fa[0]+md[0])/2
+    a=d[i-1]/(d[i-1]-d[i])
+    return fa[i-1]+a*(fa[i]-fa[i-1])
+
+def probit(p):
+    '''
+    Inverse of the standard normal cumulative distribution
+    :param p: probabilities vector
+    :returns: normal deviates
+    '''
+    inv=np.vectorize(statistics.NormalDist().inv_cdf, otypes=[np.float64])
+    return inv(np.clip(np.asarray(p, dtype=np.float64), 1e-6, 1-1e-6))
+
+def det(scr, trg):
+    '''
+    Calculate DET curve: ROC points on normal deviate scale
+    :param scr: scores vector
+    :param trg: target vector
+    :returns: two vectors for false alarms and miss detection deviates
+    '''
+    (fa,md)=roc(scr, trg)
+    return (probit(fa).tolist(), probit(md).tolist())
+
+def minDcf(scr, trg, pTarget=0.01, cMiss=1.0, cFa=1.0):
+    '''
+    Calculate the minimal normalized detection cost function (minDCF)
+    :param scr: scores vector
+    :param trg: target vector
+    :param pTarget: prior probability of the target
+    :param cMiss: cost of a miss detection
+    :param cFa: cost of a false alarm
+    :returns: minDCF
+    '''
+    (fa,md)=roc(scr, trg)
+    dcf=cMiss*pTarget*np.array(md)+cFa*(1-pTarget)*np.array(fa)
+    return float(dcf.min()/min(cMiss*pTarget, cFa*(1-pTarget)))